@@ -74,31 +74,41 @@ geometry.addDummyMonitor(0.001, 0.001)
 geometry.addMonitorIds([0])
 geometry.addComponent("single_detectors", "single_detectors", blank_location=False)
 sds = geometry.makeTypeElement("single_detectors")
+
+def addLocations(root, xyz, nxyz, names):
+    """
+    Place the pixels at the real or the neutronic positions.
+    """
+    if args.geometrytype == 'N':
+        geometry.addLocations(root, nxyz, names=names)
+    else:
+        geometry.addLocations(root, xyz, names=names, neutronic=nxyz)
+
 sdc = geometry.addComponent("single_pixel", root=sds)
+xyz, nxyz, names = [], [], []
 for i in range(len(SD_azimuths)):
     t=SD_azimuths[i]* pi/180.
     x = sd * sin(t)
     y = 0.
     z = - sd * cos(t)
-    nx, ny, nz = mirror(x, y, z, sd_analyser)
-    if args.geometrytype == 'N':
-        geometry.addLocation(root=sdc, x=nx, y=ny, z=nz, name="single_tube_{0}".format(i+1))
-    else:
-        geometry.addLocation(root=sdc, x=x, y=y, z=z, nx=nx, ny=ny, nz=nz, name="single_tube_{0}".format(i+1), neutronic=True)
+    xyz.append([x, y, z])
+    nxyz.append(mirror(x, y, z, sd_analyser))
+    names.append("single_tube_{0}".format(i+1))
+addLocations(sdc, xyz, nxyz, names)
 geometry.addComponent("psds", "psds", blank_location=False)
 psds = geometry.makeTypeElement("psds")
 psdc = geometry.addComponent("single_pixel", root=psds)
+xyz, nxyz, names = [], [], []
 for i in range(len(PSD_azimuths)):
     t = PSD_azimuths[i]*pi/180.
     x = psd * sin(t)
     z = - psd * cos(t)
     for p in range(pixels):
         y = -height/2 + p * height/pixels
-        nx, ny, nz = mirror(x, y, z, psd_analyser, i==0 and args.firsttubedefocus == 'Y')
-        if args.geometrytype == 'N':
-            geometry.addLocation(root=psdc, x=nx, y=ny, z=nz, name="tube_{0}_pixel_{1}".format(i+1, p+1))
-        else:
-            geometry.addLocation(root=psdc, x=x, y=y, z=z, nx=nx, ny=ny, nz=nz, name="tube_{0}_pixel_{1}".format(i+1, p+1), neutronic=True)
+        xyz.append([x, y, z])
+        nxyz.append(mirror(x, y, z, psd_analyser, i==0 and args.firsttubedefocus == 'Y'))
+        names.append("tube_{0}_pixel_{1}".format(i+1, p+1))
+addLocations(psdc, xyz, nxyz, names)
 pixel_factor = 1.
 if args.geometrytype == 'N':
     # make pixels bigger so they are visible in instrument view
@@ -6,6 +6,10 @@ from sns_geometry import Geometry, Component, Maths, Recipe, Vector, \
 from math import cos, sin, acos, atan2
 from datetime import datetime, date
 import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import quaternion
 
 geometry = generateGeom("TOPAZ")
 entry = geometry.getEntry()
@@ -86,11 +90,7 @@ def x_rotation_matrix(polar=0):
     """Generate a rotation matrix for a polar rotation,
     i.e. a rotation about the x axis."""
 
-    #s and c are temp. variables for sin(x) and cos(x)
-    c = cos(polar)
-    s = sin(polar)
-    M = np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
-    return M;
+    return quaternion.toMatrix(quaternion.aboutAxis(np.degrees(polar), 0))
 
 
 #===============================================================================================
@@ -104,21 +104,11 @@ def rotation_matrix(phi=0, chi=0, omega=0):
        Angles in radians.
        Use rotated_vector = matrix * initial_vector"""
 
-    #s and c are temp. variables for sin(x) and cos(x)
-    c = cos(phi)
-    s = sin(phi)
-    M_phi = np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
-
-    c = cos(chi)
-    s = sin(chi)
-    M_chi = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
-
-    c = cos(omega)
-    s = sin(omega)
-    M_omega = np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
-
     #rotated =  M_omega * (M_chi * (M_phi * vector));
-    M = np.dot(M_omega, np.dot(M_chi, M_phi))
+    quat = quaternion.multiply(quaternion.aboutAxis(np.degrees(omega), 1),
+                               quaternion.multiply(quaternion.aboutAxis(np.degrees(chi), 2),
+                                                   quaternion.aboutAxis(np.degrees(phi), 1)))
+    M = quaternion.toMatrix(quat)
 
     return M;
 
@@ -1,11 +1,17 @@
 from __future__ import (print_function)
 
+import contextlib
+import copy
+import hashlib
+import re
 import sys
 from datetime import datetime
+from functools import lru_cache
 from lxml import etree as le # python-lxml on rpm based systems
 import numpy as np
-from itertools import groupby
-from operator import itemgetter
+from xml.sax.saxutils import escape
+import idf_model
+import quaternion
 
 # Conversions from 2.7 to 3.x without modifying the code
 split = lambda s: s.split()  # replaces from string import split
@@ -17,10 +23,262 @@ XMLNS = "http://www.mantidproject.org/IDF/1.0"
 XSI = "http://www.w3.org/2001/XMLSchema-instance"
 SCHEMA_LOC = "http://www.mantidproject.org/IDF/1.0 http://schema.mantidproject.org/IDF/1.0/IDFSchema.xsd"
 nEA = np.empty(0)  # empty array
+# default number of decimal places written for each kind of quantity
+PRECISION = {"length": 7, "angle": 6, "energy": 6}
+
+
+def _formatFloat(value, decimals=None):
+    """
+    Format a float rounded to ``decimals`` places without trailing zeros or
+    negative zero. All of the digits are kept if ``decimals`` is None.
+    """
+    value = float(value)
+    if decimals is None or not abs(value) * 10 ** decimals < 2 ** 53:  # also catches nan
+        text = repr(value)
+        if text.endswith(".0"):
+            text = text[:-2]
+        return "0" if text == "-0" else text
+    text = "%.*f" % (decimals, value)  # correctly rounded from the exact binary value
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+_formatScalar = lru_cache(maxsize=1024)(_formatFloat)  # repeated constants are common
+
+
+def _formatFloats(values, decimals=None):
+    """
+    Array version of ``_formatFloat`` returning a list of strings. The values
+    are formatted in one comprehension rather than one call each, which is
+    faster than generating the digits with numpy string operations.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if decimals is None or not (np.abs(values) * 10 ** decimals < 2 ** 53).all():  # also catches nan
+        return [_formatFloat(value, decimals) for value in values.tolist()]
+    form = "%%.%df" % decimals
+    if decimals == 0:
+        text = [form % value for value in values.tolist()]
+    else:
+        text = [(form % value).rstrip("0").rstrip(".") for value in values.tolist()]
+    if "-0" in text:
+        text = ["0" if value == "-0" else value for value in text]
+    return text
+
+
+def _strColumn(values, decimals=None):
+    """
+    Convert an array to a list of strings. Floats are rounded to
+    ``decimals`` places and text is escaped for use as an attribute value.
+    A list is taken to be markup already and returned as it is.
+    """
+    if isinstance(values, list):
+        return values
+    if values.dtype.kind == "f":
+        return _formatFloats(values, decimals)
+    values = values.astype(str).tolist()
+    if any(char in ''.join(values) for char in '&<>"'):
+        values = [escape(value, {'"': '&quot;'}) for value in values]
+    return values
+
+
+def _isProgression(values):
+    """
+    Whether there are at least two values and they are evenly spaced to
+    within rounding errors.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return False
+    expected = np.linspace(values[0], values[-1], len(values))
+    return np.allclose(values, expected, rtol=0., atol=1e-9 * max(1., np.abs(values).max()))
+
+
+def _typeHash(type_element):
+    """
+    Hash of a type element that ignores its name, comments and the order
+    of the attributes.
+    """
+    text = le.tostring(type_element, method="c14n", with_comments=False, with_tail=False)
+    start = text.index(b">")  # attributes of the type element itself
+    text = re.sub(b' name="[^"]*"', b"", text[:start], count=1) + text[start:]
+    return hashlib.sha256(text).digest()
+
+
+def _translations(component):
+    """
+    Offsets of the location and locations elements of a component in order.
+    None if any of them does more than translate (rotations by zero are
+    fine) or the component has other children.
+    """
+    offsets = []
+    for location in component.iterchildren(le.Element):
+        if location.tag == "location":
+            if set(location.keys()) - {"x", "y", "z", "name"}:
+                return None
+            for rot in location.iter("rot"):
+                if float(rot.get("val", 0.)) != 0.:
+                    return None
+            if any(child.tag != "rot" for child in location.iterdescendants(le.Element)):
+                return None
+            offsets.append([[float(location.get(axis, 0.)) for axis in "xyz"]])
+        elif location.tag == "locations":
+            if len(location) or set(location.keys()) - {"x", "y", "z", "x-end", "y-end", "z-end",
+                                                        "n-elements", "name", "name-count-start",
+                                                        "name-count-increment"}:
+                return None
+            num = int(location.get("n-elements"))
+            starts = [float(location.get(axis, 0.)) for axis in "xyz"]
+            ends = [float(location.get(axis + "-end", start)) for axis, start in zip("xyz", starts)]
+            offsets.append(np.linspace(starts, ends, num))
+        else:
+            return None
+    return offsets
+
+
+def _pixelPositions(types, name, cache):
+    """
+    Positions of the detector pixels within a type in the order Mantid
+    assigns the IDs and the names of the pixel types. None if the type
+    isn't only translated components ending in detectors.
+    """
+    if name not in cache:
+        cache[name] = None
+        type_element = types.get(name)
+        if type_element is None:
+            return None
+        if type_element.get("is") in ("detector", "Detector"):
+            cache[name] = (np.zeros((1, 3)), {name})
+            return cache[name]
+        if type_element.get("is") is not None:
+            return None
+        positions = []
+        pixel_types = set()
+        for child in type_element.iterchildren(le.Element):
+            if child.tag == "properties":
+                continue
+            if child.tag != "component" or set(child.keys()) - {"type", "name"}:
+                return None
+            sub = _pixelPositions(types, child.get("type"), cache)
+            offsets = _translations(child)
+            if sub is None or offsets is None:
+                return None
+            positions.extend([sub[0] + offset for offset in np.concatenate(offsets)])
+            pixel_types |= sub[1]
+        if positions:
+            cache[name] = (np.concatenate(positions), pixel_types)
+    return cache[name]
+
+
+def _expandIds(idlist):
+    """
+    All of the IDs of an idlist element in order.
+    """
+    ids = []
+    for elem in idlist.iterchildren("id"):
+        if elem.get("val") is not None:
+            ids.append([int(elem.get("val"))])
+        else:
+            step = int(elem.get("step", 1))
+            ids.append(np.arange(int(elem.get("start")), int(elem.get("end")) + step, step))
+    return np.concatenate(ids) if ids else np.empty(0, dtype=int)
+
+
+def _rectangularGrid(positions, ids, tol=1e-9):
+    """
+    Describe pixels on a regular grid in the xy-plane with IDs filled along
+    one of the axes as the arguments of a rectangular detector. None if
+    they aren't. The positions may be off the grid by up to ``tol``, e.g.
+    from being rounded when they were written.
+    """
+    if len(ids) != len(positions) or np.abs(positions[:, 2]).max() > tol:
+        return None
+    steps = {}
+    indices = []
+    for axis, values in zip("xy", positions[:, :2].T):
+        # the columns are the runs of sorted values closer than the tolerance
+        ordered = np.sort(values)
+        firsts = np.concatenate(([0], np.flatnonzero(np.diff(ordered) > 2. * tol) + 1))
+        unique = np.add.reduceat(ordered, firsts) / np.diff(np.append(firsts, len(ordered)))
+        if len(unique) < 2:
+            return None
+        index = np.rint((values - unique[0]) * ((len(unique) - 1) / (unique[-1] - unique[0]))).astype(int)
+        step, start = np.polyfit(index, values, 1)  # best fit to all of the rounded positions
+        if np.abs(start + index * step - values).max() > tol:
+            return None
+        steps[axis] = [start, step, len(unique)]
+        indices.append(index)
+    (xstart, xstep, xpixels), (ystart, ystep, ypixels) = steps["x"], steps["y"]
+    if xpixels * ypixels != len(ids) or \
+       len(np.unique(indices[0] * ypixels + indices[1])) != len(ids):
+        return None
+
+    grid = np.empty((xpixels, ypixels), dtype=int)
+    grid[indices[0], indices[1]] = ids
+    idstart = grid[0, 0]
+    xid = grid[1, 0] - idstart
+    yid = grid[0, 1] - idstart
+    expected = idstart + xid * np.arange(xpixels)[:, None] + yid * np.arange(ypixels)[None, :]
+    if not (grid == expected).all():
+        return None
+    # count the IDs up from the corner with the smallest one
+    if xid < 0:
+        xstart, xstep, xid, idstart = xstart + xstep * (xpixels - 1), -xstep, -xid, grid[-1, 0]
+    if yid < 0:
+        ystart, ystep, yid, idstart = ystart + ystep * (ypixels - 1), -ystep, -yid, idstart + yid * (ypixels - 1)
+    if yid == 1 and xid >= ypixels:
+        fill, stepbyrow = "y", xid
+    elif xid == 1 and yid >= xpixels:
+        fill, stepbyrow = "x", yid
+    else:
+        return None
+    return dict(xstart=xstart, xstep=xstep, xpixels=xpixels,
+                ystart=ystart, ystep=ystep, ypixels=ypixels,
+                idstart=int(idstart), idfillbyfirst=fill, idstepbyrow=int(stepbyrow))
+
+
+def _appendRows(parent, template, columns, decimals=None, chunk=10000):
+    """
+    Fill the ``%s`` of ``template`` with one row of the ``columns`` arrays
+    for every element and append the result to ``parent``. Letting libxml2
+    parse the text in chunks is much faster than creating the elements one
+    at a time and keeps the memory bounded by the chunk size. ``decimals``
+    gives the number of decimal places for each float column.
+    """
+    if decimals is None:
+        decimals = [None] * len(columns)
+    for begin in range(0, len(columns[0]), chunk):
+        rows = zip(*[_strColumn(column[begin:begin + chunk], places)
+                     for column, places in zip(columns, decimals)])
+        fragment = ''.join([template % row for row in rows])
+        parent.extend(le.fromstring('<fragment>' + fragment + '</fragment>'))
+
 
 class MantidGeom:
 
-    def __init__(self, instname, comment=None, valid_from=None, valid_to=None):
+    def __init__(self, instname, comment=None, valid_from=None, valid_to=None,
+                 stream=None, precision=None, compact_locations=True,
+                 fuse_rotations=False):
+        """
+        If ``stream`` is a filename the geometry is written as it is built.
+        Call ``flush`` once the top-level elements added so far are complete
+        and ``writeGeom`` to finish the file. Use the geometry in a ``with``
+        statement so that the file is closed if building it fails.
+        ``precision`` overrides the number of decimal places written for the
+        quantities in ``PRECISION`` e.g. ``{"length": 5}``.
+        With ``compact_locations`` evenly spaced tubes and pixels are written
+        as a single ``locations`` element rather than one ``location`` each.
+        With ``fuse_rotations`` the nested rotations of a location are
+        combined into a single ``rot`` (see addRotations).
+        """
+        self.__compact_locations = compact_locations
+        self.__fuse_rotations = fuse_rotations
+        self.__precision = dict(PRECISION)
+        if precision is not None:
+            unknown = set(precision) - set(PRECISION)
+            if unknown:
+                raise ValueError("Unknown quantities in precision: %s" % ", ".join(sorted(unknown)))
+            self.__precision.update(precision)
         from datetime import datetime
         if valid_to is None:
             valid_to = str(datetime(2100, 1, 31, 23, 59, 59))
@@ -43,30 +301,409 @@ class MantidGeom:
                     self.__root.append(le.Comment(bit))
             else:
                 self.__root.append(le.Comment(comment))
+        self.__origin = None  # root of the geometry this was forked from
+        self.__base = None  # root whose top-level elements a fork shares
+        self.__snapshot = None  # top-level elements of the base when it was forked
+        self.__shared = None  # the ones not copied into this yet, None for those that are
+        self.__stream = None
+        self.__stream_name = stream
+        self.__stream_started = False
+        if stream is not None:
+            print(f'writing {stream}')
+            self.__stream = open(stream, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def writeGeom(self, filename=None):
+    def close(self):
+        """
+        Close the stream, leaving the file unfinished if writeGeom wasn't
+        called. Does nothing when the geometry is not being streamed.
+        """
+        if self.__stream is not None:
+            self.__stream.close()
+            self.__stream = None
+
+    def writeGeom(self, filename=None, merge_types=False, check_ids=True, check_overlaps=False):
         """
         Write the XML geometry to the given filename
         If the filename isn't provided, it will be <instname>_Definition_<iso8601date>.xml
-        """
+        In streaming mode the remaining elements are flushed and the file is closed.
+        Duplicate types are merged first (see mergeDuplicateTypes) if
+        merge_types is True, which changes the type names in the output,
+        except when the geometry is streamed, where components may have
+        been written before the types they point at. Problems with
+        the idlists are printed (see checkIds) unless check_ids is False and
+        the tubes that overlap (see checkOverlaps) if check_overlaps is True.
+        """
+        if self.__stream_name is not None:
+            if filename and filename != self.__stream_name:
+                raise RuntimeError("Geometry is being streamed to '%s' not '%s'"
+                                   % (self.__stream_name, filename))
+            self.__writeStream(final=True)
+            return
+
         if not filename:
             today = datetime.now().isoformat().split('T')[0]
             filename = '{}_Definition_{}.xml'.format(self.__instname, today)
 
+        if merge_types:
+            self.mergeDuplicateTypes()
+        if check_ids:
+            for problem in self.checkIds():
+                print('WARNING: ' + problem)
+        if check_overlaps:
+            for problem in self.checkOverlaps():
+                print('WARNING: ' + problem)
+
         print(f'writing {filename}')
-        fh = open(filename, "w")
-        to_write = le.tostring(self.__root, pretty_print=True, xml_declaration=True)
-        if sys.version_info.major > 2:
-            to_write = to_write.decode("utf-8")  # conversion from bytes to str
-        fh.write(to_write)
-        fh.close()
+        # serialize straight to the file rather than building the document in memory
+        with self.__document() as root:
+            le.ElementTree(root).write(filename, pretty_print=True, xml_declaration=True)
+
+    def fork(self):
+        """
+        Return a variant of the geometry built so far, e.g. to add the parts
+        that differ between variants of an instrument to the common ones.
+        The top-level elements are shared with this geometry rather than
+        copied and one is only copied when the fork changes it, so a fork
+        costs about as much as the parts that differ. Use lookup to get the
+        fork's own copy of an element, e.g. a handle from makeTypeElement,
+        before changing it and don't change the shared elements here while
+        the fork is in use. Using root or merging or promoting types on the
+        fork copies all of them.
+        """
+        if self.__stream_name is not None:
+            raise RuntimeError("Cannot fork a geometry that is streamed to '%s'" % self.__stream_name)
+        other = copy.copy(self)
+        other.__precision = dict(self.__precision)
+        other.__origin = self.__root
+        if self.__shared is None:
+            other.__base = self.__root
+            other.__snapshot = list(self.__root)
+            other.__shared = list(other.__snapshot)
+            other.__root = le.Element(self.__root.tag, attrib=dict(self.__root.attrib), nsmap=self.__root.nsmap)
+        else:  # share the same elements and copy the ones this has
+            other.__shared = list(self.__shared)
+            other.__root = copy.deepcopy(self.__root)
+        return other
+
+    def lookup(self, element):
+        """
+        Return the element of a fork that is at the same place as the
+        element of the geometry it was forked from, copying the top-level
+        element it is in if that is still shared.
+        """
+        if self.__origin is None:
+            raise RuntimeError("Geometry was not forked")
+        path = []  # indices of the element and its ancestors below the top-level one
+        top = element
+        while top.getparent() is not None and top.getparent().getparent() is not None:
+            path.append(top.getparent().index(top))
+            top = top.getparent()
+        parent = top.getparent()
+        if parent is None and top in (self.__origin, self.__base):
+            return self.__root
+        if parent is not None and parent is self.__base and self.__shared is not None:
+            index = [i for i, shared in enumerate(self.__snapshot) if shared is top][0]
+            if self.__shared[index] is not None:
+                self.__copyShared(index)
+            top = self.__root[self.__shared[:index].count(None)]
+        elif parent is not None and parent is self.__origin:
+            top = self.__root[parent.index(top)]
+        else:
+            raise ValueError("Element is not part of the geometry this was forked from")
+        for index in reversed(path):
+            top = top[index]
+        return top
+
+    def __copyShared(self, index):
+        """
+        Copy a shared top-level element into the fork. The copies are kept in
+        order in front of the elements that were added to the fork.
+        """
+        self.__root.insert(self.__shared[:index].count(None), copy.deepcopy(self.__shared[index]))
+        self.__shared[index] = None
+
+    def __unshare(self):
+        """
+        Copy all of the top-level elements that are still shared.
+        """
+        if self.__shared is None:
+            return
+        for index, element in enumerate(self.__shared):
+            if element is not None:
+                self.__copyShared(index)
+        self.__base = self.__snapshot = self.__shared = None
+
+    @contextlib.contextmanager
+    def __document(self):
+        """
+        The root of the whole geometry for reading it. A fork lends its own
+        elements to the root it shares the others with for the duration,
+        which is much cheaper than copying the shared ones. If that has
+        changed since it was forked the shared elements are copied instead.
+        """
+        if self.__shared is not None and list(self.__base) != self.__snapshot:
+            self.__unshare()
+        if self.__shared is None:
+            yield self.__root
+            return
+
+        base = self.__base
+        own = list(self.__root)
+        copied = [index for index, element in enumerate(self.__shared) if element is None]
+        attrib = dict(base.attrib)
+        try:
+            for index, element in zip(copied, own):
+                base.replace(self.__snapshot[index], element)
+            base.extend(own[len(copied):])
+            if attrib != dict(self.__root.attrib):
+                base.attrib.clear()
+                base.attrib.update(self.__root.attrib)
+            yield base
+        finally:
+            for index, element in zip(copied, own):
+                base.replace(element, self.__snapshot[index])
+            self.__root.extend(own)
+            if attrib != dict(base.attrib):
+                base.attrib.clear()
+                base.attrib.update(attrib)
+
+    def model(self):
+        """
+        Return the geometry built so far as an idf_model.InstrumentModel,
+        with the locations, rotations and ids of each type in numpy arrays.
+        """
+        if self.__stream_started:
+            raise RuntimeError("Part of the geometry was already flushed to '%s'" % self.__stream_name)
+        with self.__document() as root:
+            return idf_model.InstrumentModel.fromElement(root)
+
+    def checkIds(self):
+        """
+        Return the problems with the idlists that Mantid would refuse to
+        load, such as an idlist with a different number of ids than there
+        are detectors under its component or ids that are in more than one
+        idlist. The detectors are counted per type from the number of
+        locations of each component, without working out where they are.
+        """
+        if self.__stream_started:
+            raise RuntimeError("Part of the geometry was already flushed to '%s'" % self.__stream_name)
+        with self.__document() as root:
+            return idf_model.InstrumentModel.fromElement(root, positions=False).checkIdLists()
+
+    def checkOverlaps(self, depth=1, tolerance=1e-5):
+        """
+        Return the pairs of tubes (or of the components depth levels above
+        the pixels) whose oriented bounding boxes overlap by more than
+        tolerance metres, deepest first. See idf_spatial.checkOverlaps.
+        """
+        import idf_spatial  # which needs this module
+        return idf_spatial.checkOverlaps(self.model(), depth, tolerance)
+
+    def flush(self):
+        """
+        Write the top-level elements added so far to the stream and release
+        them. Anything hanging off of a flushed element (e.g. a handle from
+        makeTypeElement) must be complete before calling this.
+        Does nothing when the geometry is not being streamed.
+        """
+        if self.__stream is not None:
+            self.__writeStream()
+
+    def __writeStream(self, final=False):
+        """
+        Serialize the pending top-level elements inside the (otherwise empty)
+        root so that indentation and namespaces are exactly what writing the
+        whole tree at once would produce, then strip the root tags.
+        """
+        if self.__stream is None:
+            raise RuntimeError("Stream '%s' is already closed" % self.__stream_name)
+        root = self.__root
+        try:
+            if len(root) > 0 or not self.__stream_started:
+                to_write = le.tostring(root, pretty_print=True,
+                                       xml_declaration=not self.__stream_started)
+                if len(root) > 0:
+                    end = len(to_write) - len(b'</instrument>\n')
+                    start = 0
+                    if self.__stream_started:
+                        start = to_write.index(b'>\n', to_write.index(b'<instrument')) + 2
+                    self.__stream.write(memoryview(to_write)[start:end])
+                    del root[:]
+                    self.__stream_started = True
+                elif final:
+                    self.__stream.write(to_write)  # nothing was ever added
+            if final and self.__stream_started:
+                self.__stream.write(b'</instrument>\n')
+        finally:
+            if final:
+                self.close()
+
+    def mergeDuplicateTypes(self):
+        """
+        Merge type elements that are identical apart from their name (and
+        comments) into the first of them and point the components at it.
+        Components without a name keep the one they had from the type.
+        This is repeated since merging can make the types using them equal.
+        Returns a dict of the removed type names to the kept ones.
+        """
+        self.__unshare()
+        references = {}  # type name to the elements pointing at it
+        for element in self.__root.iter("component", "type"):
+            if element.get("type") is not None:
+                references.setdefault(element.get("type"), []).append(element)
+
+        hashes = {}  # only types that can have a duplicate are hashed
+        merged = {}
+        while True:
+            # cheap signature to find the candidates for a full comparison
+            candidates = {}
+            for type_element in self.__root.iterchildren("type"):
+                attrs = sorted(item for item in type_element.items() if item[0] != "name")
+                signature = (tuple(attrs), sum(1 for _ in type_element.iterchildren(le.Element)))
+                candidates.setdefault(signature, []).append(type_element)
+
+            renames = {}
+            for group in candidates.values():
+                if len(group) < 2:
+                    continue
+                kept = {}  # hash to name of the type that is kept
+                for type_element in group:
+                    name = type_element.get("name")
+                    if name not in hashes:
+                        hashes[name] = _typeHash(type_element)
+                    if hashes[name] in kept:
+                        renames[name] = kept[hashes[name]]
+                        self.__root.remove(type_element)
+                    else:
+                        kept[hashes[name]] = name
+            if not renames:
+                break
+
+            for old, new in renames.items():
+                del hashes[old]
+                for element in references.pop(old, []):
+                    element.set("type", new)
+                    references.setdefault(new, []).append(element)
+                    if element.tag == "component" and element.get("name") is None:
+                        locations = element.findall("location") + element.findall("locations")
+                        if not locations or any(loc.get("name") is None for loc in locations):
+                            element.set("name", old)
+                    # the type holding the element has to be compared again
+                    owner = element if element.tag == "type" else next(element.iterancestors("type"), None)
+                    if owner is not None:
+                        hashes.pop(owner.get("name"), None)
+
+            for old, new in merged.items():
+                merged[old] = renames.get(new, new)
+            merged.update(renames)
+
+        if merged:
+            print('merged {} duplicate types'.format(len(merged)))
+        return merged
+
+    def promoteRectangularDetectors(self):
+        """
+        Replace banks whose pixels form a regular grid in the xy-plane with a
+        rectangular_detector type, as addRectangularDetector and
+        addComponentRectangularDetector would write them. Only top-level
+        components with an idlist and a single location are considered, the
+        pixels have to be reached through plain translations and the IDs
+        have to fill one axis first. The tubes and pixels of a promoted bank
+        get the names Mantid gives rectangular detectors.
+        Returns the names of the promoted types.
+        """
+        self.__unshare()
+        types = {elem.get("name"): elem for elem in self.__root.iterchildren("type")}
+        idlists = {elem.get("idname"): elem for elem in self.__root.iterchildren("idlist")}
+        uses = {}  # number of references to each type
+        for element in self.__root.iter("component", "type"):
+            uses[element.get("type")] = uses.get(element.get("type"), 0) + 1
+        num_elements = sum(1 for _ in self.__root.iter())
+        # the positions were rounded when written and a pixel's adds up those of a few levels
+        places = self.__precision["length"]
+        tol = 1e-9 if places is None else 2. * 10. ** -places
+
+        cache = {}
+        promoted = []
+        replaced = set()  # types that may not be needed anymore
+        for component in list(self.__root.iterchildren("component")):
+            name = component.get("type")
+            idname = component.get("idlist")
+            if idname not in idlists or uses.get(name) != 1 or len(component) != 1 \
+               or component[0].tag != "location":
+                continue
+            pixels = _pixelPositions(types, name, cache)
+            if pixels is None or len(pixels[1]) != 1:
+                continue
+            grid = _rectangularGrid(pixels[0], _expandIds(idlists[idname]), tol)
+            if grid is None:
+                continue
+
+            pixel_type = pixels[1].pop()
+            replaced.update(child.get("type") for child in types[name].iter("component"))
+            # extra digits for the steps as the rounding adds up over the pixels
+            rectangle = self.addRectangularDetector(name, pixel_type, grid["xstart"],
+                                                    self.formatValue(grid["xstep"], decimals=12),
+                                                    grid["xpixels"], grid["ystart"],
+                                                    self.formatValue(grid["ystep"], decimals=12),
+                                                    grid["ypixels"])
+            types[name].addprevious(rectangle)
+            self.__root.remove(types[name])
+            types[name] = rectangle
+            del component.attrib["idlist"]
+            for key in ("idstart", "idfillbyfirst", "idstepbyrow"):
+                component.set(key, str(grid[key]))
+            if not any(other.get("idlist") == idname for other in self.__root.iter("component")):
+                self.__root.remove(idlists.pop(idname))
+            promoted.append(name)
+            print("promoted {} to a {}x{} rectangular detector filled along {}".format(
+                name, grid["xpixels"], grid["ypixels"], grid["idfillbyfirst"]))
+
+        # remove the tube and pack types that nothing points at anymore
+        while replaced:
+            used = set(element.get("type") for element in self.__root.iter("component", "type"))
+            unused = [name for name in replaced if name not in used and name in types]
+            replaced = set()
+            for name in unused:
+                replaced.update(child.get("type") for child in types[name].iter("component"))
+                self.__root.remove(types.pop(name))
+
+        if promoted:
+            removed = num_elements - sum(1 for _ in self.__root.iter())
+            print("promoted {} banks, {} of {} elements ({:.0f}%) removed".format(
+                len(promoted), removed, num_elements, 100. * removed / num_elements))
+        return promoted
+
+    def formatValue(self, value, quantity="length", decimals=None):
+        """
+        Convert a value to attribute text. Floats are rounded to the precision
+        of the quantity ("length", "angle" or "energy") unless ``decimals`` is
+        given, None keeps every digit. Text is passed through unchanged and
+        arrays are converted to a list of strings.
+        """
+        if decimals is None and quantity is not None:
+            decimals = self.__precision[quantity]
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (np.ndarray, list, tuple)):
+            return _strColumn(np.asarray(value), decimals)
+        if isinstance(value, (int, np.integer)):  # includes bool
+            return str(value)
+        return _formatScalar(float(value), decimals)
 
     def showGeom(self):
         """
         Print the XML geometry to the screeen
         """
-        print(le.tostring(self.__root, pretty_print=True,
-                             xml_declaration=True))
+        with self.__document() as root:
+            print(le.tostring(root, pretty_print=True,
+                                 xml_declaration=True))
 
 
 
@@ -114,7 +751,7 @@ class MantidGeom:
           distance = float(distance)
           if distance > 0:
             distance *= -1.0
-          le.SubElement(source, "location", z=str(distance))
+          le.SubElement(source, "location", z=self.formatValue(distance))
         except:
           pos_loc = le.SubElement(source, "location")
           processed=split(str(distance))
@@ -139,7 +776,7 @@ class MantidGeom:
           distance = float(distance)
           if distance > 0:
             distance *= -1.0
-          le.SubElement(source, "location", z=str(distance))
+          le.SubElement(source, "location", z=self.formatValue(distance))
         except:
           pos_loc = le.SubElement(source, "location")
           processed=split(str(distance))
@@ -155,13 +792,13 @@ class MantidGeom:
                       **{"name":"moderator", "is":"Source"})
         cuboid = le.SubElement(type_element, "cuboid", id="shape")
         le.SubElement(cuboid, "left-front-bottom-point",
-                      x=str(-width/2), y=str(-height/2),z=str(-depth/2))
+                      x=self.formatValue(-width/2), y=self.formatValue(-height/2),z=self.formatValue(-depth/2))
         le.SubElement(cuboid, "left-front-top-point",
-                      x=str(-width/2), y=str(height/2),z=str(-depth/2))
+                      x=self.formatValue(-width/2), y=self.formatValue(height/2),z=self.formatValue(-depth/2))
         le.SubElement(cuboid, "left-back-bottom-point",
-                      x=str(-width/2), y=str(-height/2),z=str(depth/2))
+                      x=self.formatValue(-width/2), y=self.formatValue(-height/2),z=self.formatValue(depth/2))
         le.SubElement(cuboid, "right-front-bottom-point",
-                      x=str(width/2), y=str(-height/2),z=str(-depth/2))
+                      x=self.formatValue(width/2), y=self.formatValue(-height/2),z=self.formatValue(-depth/2))
         le.SubElement(type_element, "algebra", val="shape")
 
     def addSamplePosition(self, location=None, coord_type="cartesian"):
@@ -175,11 +812,12 @@ class MantidGeom:
             le.SubElement(source, "location", x="0.0", y="0.0", z="0.0")
         else:
             if coord_type is "cartesian":
-                le.SubElement(source, "location", x=str(location[0]),
-                              y=str(location[1]), z=str(location[2]))
+                le.SubElement(source, "location", x=self.formatValue(location[0]),
+                              y=self.formatValue(location[1]), z=self.formatValue(location[2]))
             if coord_type is "spherical":
-                le.SubElement(source, "location", r=str(location[0]),
-                              t=str(location[1]), p=str(location[2]))
+                le.SubElement(source, "location", r=self.formatValue(location[0]),
+                              t=self.formatValue(location[1], "angle"),
+                              p=self.formatValue(location[2], "angle"))
 
         le.SubElement(self.__root, "type",
                       **{"name":"sample-position", "is":"SamplePos"})
@@ -209,47 +847,48 @@ class MantidGeom:
         """
         type_element = le.SubElement(self.__root, "type", name=name)
 
-        def triad_factory(symbols, components):
-            """
-            Generates lambda functions to produce **kwargs for le.SubElement
-            :param symbols: triad of argument keywords for le.SubElement
-            :param components: lists of neutronic positions
-            :return: lambda object
-            """
-            return lambda i, j: dict(zip(symbols,
-                                       [str(comp[i][j]) for comp in components]))
-
-        # Find polar or cartesian coordinates. Create dictionary with lambda
+        # Find polar or cartesian coordinates, same for neutronic positions
         if r.any():
-            first_comp = r
-            triad = triad_factory(['r', 't', 'p'], [r, theta, phi])
+            symbols, components = ('r', 't', 'p'), (r, theta, phi)
         else:
-            first_comp = x
-            triad = triad_factory(['x', 'y', 'z'], [x, y, z])
-        # Same for neutronic positions
+            symbols, components = ('x', 'y', 'z'), (x, y, z)
+        neutronic = nr.any() or nx.any()
         if nr.any():
-            first_ncomp = nr
-            ntriad = triad_factory(['r', 't', 'p'], [nr, ntheta, nphi])
+            nsymbols, ncomponents = ('r', 't', 'p'), (nr, ntheta, nphi)
         else:
-            first_ncomp = nx
-            ntriad = triad_factory(['x', 'y', 'z'], [nx, ny, nz])
-
-        # Create the pixels
-        for i in range(len(first_comp)):
-            for j in range(len(first_comp[i])):
-                if not(np.isnan(first_comp[i][j]) or np.isnan(first_ncomp[i][j])):
-                    basecomponent = le.SubElement(type_element, "component", type="pixel")
-                    location_element = le.SubElement(basecomponent, "location",
-                                                     name=str(names[i][j]), **triad(i,j))
-                    if nr.any() or nx.any():
-                        le.SubElement(location_element, "neutronic", **ntriad(i,j))
-                    else:
-                        le.SubElement(location_element, "facing", x="0.0", y="0.0", z="0.0")
-                    if output_efixed:
-                        efixed_comp = le.SubElement(basecomponent, "parameter", name="EFixed")
-                        le.SubElement(efixed_comp, "value", val=str(energy[i][j]))
+            nsymbols, ncomponents = ('x', 'y', 'z'), (nx, ny, nz)
 
-    def addDetectorPixelsIdList(self, name, r=[], names=[], elg="single_list"):
+        # work on flat arrays and mask out the unphysical (nan) pixels once
+        components = [np.asarray(comp, dtype=float).ravel() for comp in components]
+        keep = ~np.isnan(components[0])
+        if neutronic:
+            ncomponents = [np.asarray(comp, dtype=float).ravel() for comp in ncomponents]
+            keep &= ~np.isnan(ncomponents[0])
+        columns = [np.asarray(names).ravel()[keep]] + [comp[keep] for comp in components]
+        places = {symbol: self.__precision["angle" if symbol in "tp" else "length"]
+                  for symbol in ('r', 't', 'p', 'x', 'y', 'z')}
+        decimals = [None] + [places[symbol] for symbol in symbols]
+
+        template = '<component type="pixel"><location name="%s" ' \
+            + ' '.join(['%s="%%s"' % symbol for symbol in symbols]) + '>'
+        if neutronic:
+            template += '<neutronic ' + ' '.join(['%s="%%s"' % symbol for symbol in nsymbols]) + '/>'
+            columns += [comp[keep] for comp in ncomponents]
+            decimals += [places[symbol] for symbol in nsymbols]
+        else:
+            template += '<facing x="0.0" y="0.0" z="0.0"/>'
+        template += '</location>'
+        if output_efixed:
+            template += '<parameter name="EFixed"><value val="%s"/></parameter>'
+            columns.append(np.asarray(energy).ravel()[keep])
+            decimals.append(self.__precision["energy"])
+        template += '</component>'
+
+        # format the columns and create the elements in bulk
+        _appendRows(type_element, template, columns, decimals)
+
+    def addDetectorPixelsIdList(self, name, r=[], names=[], elg="single_list",
+                                compress=True):
         """
         Add the detector IDs
         :param name: name of the component owning the detector pixes
@@ -257,27 +896,20 @@ class MantidGeom:
         :param names: (list of list) pixel ID's
         :param elg: element grouping, 'single_list' creates one element per pixel,
          'multiple_ranges' creates one element for every range of physical pixels
+        :param compress: write runs of IDs as ranges regardless of the grouping
         """
-        if elg=="single_list":
+        if elg not in ("single_list", "multiple_ranges"):
+            raise NotImplementedError("invalid element grouping scheme")
+        # find ID's of pixels with physical distances, nan indicates unphysical pixel
+        pxids = np.asarray(names).ravel()[~np.isnan(np.asarray(r, dtype=float).ravel())]
+        if compress or elg == "multiple_ranges":
+            id_element = le.SubElement(self.__root, "idlist", idname=name)
+            self.__addIdRuns(id_element, self.compressIds(pxids))
+        else:
             component = le.SubElement(self.__root, "idlist",
                                       idname=name)
-            for i in range(len(r)):
-                for j in range(len(r[i])):
-                    # nan indicates unphysical pixel
-                    if (str(r[i][j]) != "nan"):
-                        le.SubElement(component, "id", val=str(names[i][j]))
-        elif elg=="multiple_ranges":
-            # find ID's of pixels with physical distances
-            pxids = names.flatten()[np.where(~np.isnan(r.flatten()))[0]]
-            # Split pxids into continous chunks of pixel ID's
-            idlist = list()
-            for k, g in groupby(enumerate(pxids), key=lambda p: p[0] - p[1]):
-                chunk = list(map(itemgetter(1), g))
-                idlist += [chunk[0], chunk[-1], None]
-            # Create one element for every continous chunks
-            self.addDetectorIds(name, idlist)
-        else:
-            raise NotImplementedError("invalid element grouping scheme")
+            for pxid in pxids:
+                le.SubElement(component, "id", val=str(pxid))
 
     def addMonitors(self, distance=[], names=[], neutronic=False):
         """
@@ -297,7 +929,7 @@ class MantidGeom:
         for i in range(len(distance)):
             try:
                 zi=float(distance[i]) # check if float
-                zi=str(zi) # convert it to a string for lxml
+                zi=self.formatValue(zi) # convert it to a string for lxml
                 location = le.SubElement(basecomponent, "location", z=zi, name=names[i])
                 if neutronic:
                     le.SubElement(location, "neutronic", z=zi)
@@ -380,7 +1012,7 @@ class MantidGeom:
         Return a simple type element.
         """
         for key in extra_attrs.keys():
-            extra_attrs[key] = str(extra_attrs[key])  # convert everything to strings
+            extra_attrs[key] = self.formatValue(extra_attrs[key], None)  # convert everything to strings
         return le.SubElement(self.__root, "type", name=name, **extra_attrs)
 
     def makeDetectorElement(self, name, idlist_type=None, root=None, extra_attrs={}, location=[0.0, 0.0, 0.0]):
@@ -393,7 +1025,7 @@ class MantidGeom:
             root_element = self.__root
 
         for key in extra_attrs.keys():
-            extra_attrs[key] = str(extra_attrs[key]) # convert everything to strings
+            extra_attrs[key] = self.formatValue(extra_attrs[key], None) # convert everything to strings
 
         if idlist_type is not None:
             comp = le.SubElement(root_element, "component", type=name,
@@ -428,9 +1060,14 @@ class MantidGeom:
         Add a rectangular detector in a type element for the XML definition.
         """
         type_element = le.SubElement(self.__root, "type",
-                                     xstart=str(xstart), xstep=str(xstep), xpixels=str(xpixels),
-                                     ystart=str(ystart), ystep=str(ystep), ypixels=str(ypixels),
+                                     xstart=self.formatValue(xstart),
+                                     xstep=self.formatValue(xstep),
+                                     xpixels=self.formatValue(xpixels),
+                                     ystart=self.formatValue(ystart),
+                                     ystep=self.formatValue(ystep),
+                                     ypixels=self.formatValue(ypixels),
                                      **{"name": name, "is": "rectangular_detector", "type": type})
+        return type_element
 
     def addSingleDetector(self, root, x, y, z, rot_x, rot_y, rot_z, name=None,
                           usepolar=None, facingSample=False):
@@ -452,37 +1089,130 @@ class MantidGeom:
         Add a location element to a specific parent node given by root.
         """
         if name is not None:
-            pos_loc = le.SubElement(root, "location", x=str(x), y=str(y), z=str(z), name=name)
+            pos_loc = le.SubElement(root, "location",
+                                    x=self.formatValue(x),
+                                    y=self.formatValue(y),
+                                    z=self.formatValue(z),
+                                    name=name)
         else:
-            pos_loc = le.SubElement(root, "location", x=str(x), y=str(y), z=str(z))
+            pos_loc = le.SubElement(root, "location",
+                                    x=self.formatValue(x),
+                                    y=self.formatValue(y),
+                                    z=self.formatValue(z))
 
-        if rot_y is not None:
-            r1 = le.SubElement(pos_loc, "rot", **{"val":str(rot_y), "axis-x":"0",
-                                                  "axis-y":"1", "axis-z":"0"})
-        else:
-            r1 = pos_loc
-
-        if rot_x is not None:
-            r2 = le.SubElement(r1, "rot", **{"val":str(rot_x), "axis-x":"1",
-                                             "axis-y":"0", "axis-z":"0"})
-        else:
-            r2 = r1
-
-        if rot_z is not None:
-            r3 = le.SubElement(r2, "rot", **{"val":str(rot_z), "axis-x":"0",
-                                             "axis-y":"0", "axis-z":"1"})
-        else:
-            r3 = r2
+        rotations = [(rot_y, (0, 1, 0)), (rot_x, (1, 0, 0)), (rot_z, (0, 0, 1))]
+        r3 = self.addRotations(pos_loc, [rot for rot in rotations if rot[0] is not None])
 
         if facingSample:
             le.SubElement(pos_loc, "facing", x="0.0", y="0.0", z="0.0")
 
         if neutronic:
-            le.SubElement(pos_loc, "neutronic", x=str(nx), y=str(ny), z=str(nz))
+            le.SubElement(pos_loc, "neutronic", x=self.formatValue(nx), y=self.formatValue(ny), z=self.formatValue(nz))
 
         return r3
 
+    def addRotations(self, root, rotations, fuse=None, tolerance=quaternion.TOLERANCE):
+        """
+        Add a rot element for each (angle, axis) in rotations, each one nested
+        in the one before. If fuse is True, or None and the geometry was
+        created with fuse_rotations, they are combined into a single rot that
+        is left out if there is no rotation. Returns the innermost element.
+        """
+        if fuse is None:
+            fuse = self.__fuse_rotations
+        if fuse and rotations:
+            try:
+                fused = quaternion.fuseRotations([(float(angle), axis) for angle, axis in rotations],
+                                                 tolerance)
+            except ValueError:  # angles from logs can't be combined
+                pass
+            else:
+                if fused is None:
+                    return root
+                rotations = [fused]
+
+        for angle, axis in rotations:
+            attrs = {"val": self.formatValue(angle, "angle")}
+            for key, value in zip(("axis-x", "axis-y", "axis-z"), axis):
+                attrs[key] = self.formatValue(value, decimals=9)
+            root = le.SubElement(root, "rot", **attrs)
+        return root
+
+    def addLocations(self, root, xyz, rotations=None, names=None, neutronic=None,
+                     facingSample=False, fuse=None):
+        """
+        Batched version of addLocation that adds a location element to root
+        for each row of the N x 3 positions in one go.
+        :param rotations: N x 3 angles used as rot_x, rot_y and rot_z, columns
+         that are all zero are left out, or N x 4 quaternions (w, x, y, z)
+         that are written as a single rot
+        :param names: N location names
+        :param neutronic: N x 3 neutronic positions
+        :param fuse: combine the angles into a single rot, see addRotations
+        Returns the new location elements.
+        """
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        num = len(xyz)
+        length = self.__precision["length"]
+        angle = self.__precision["angle"]
+        template = '<location x="%s" y="%s" z="%s"'
+        columns = list(xyz.T)
+        decimals = [length] * 3
+        if names is not None:
+            template += ' name="%s"'
+            columns.append(np.asarray(names).ravel())
+            decimals.append(None)
+        template += '>'
+
+        if rotations is not None:
+            rotations = np.asarray(rotations, dtype=float).reshape(num, -1)
+            if fuse is None:
+                fuse = self.__fuse_rotations
+            if rotations.shape[1] == 4:
+                angles, axes = quaternion.toAxisAngle(rotations)
+                angles = np.where(angles < quaternion.TOLERANCE, 0., angles)
+            elif rotations.shape[1] == 3:
+                # same nesting as addLocation
+                chain = [(rotations[:, column], axis) for column, axis in
+                         ((1, (0, 1, 0)), (0, (1, 0, 0)), (2, (0, 0, 1))) if rotations[:, column].any()]
+                if fuse:
+                    angles, axes = quaternion.fuseRotationArrays(chain)
+                    # scalars when no column has an angle
+                    angles = np.broadcast_to(angles, (num,))
+                    axes = np.broadcast_to(axes, (num, 3))
+                else:
+                    angles = None
+                    for column, axis in chain:
+                        template += '<rot val="%%s" axis-x="%d" axis-y="%d" axis-z="%d">' % axis
+                        columns.append(column)
+                        decimals.append(angle)
+                    template += '</rot>' * len(chain)
+            else:
+                raise ValueError("Rotations must be N x 3 angles or N x 4 quaternions")
+
+            if angles is not None:
+                # a single rot for each row that isn't left out
+                rows = zip(_formatFloats(angles, angle), *[_formatFloats(values, 9) for values in axes.T])
+                template += '%s'
+                columns.append(['<rot val="%s" axis-x="%s" axis-y="%s" axis-z="%s"/>' % row
+                                if row[0] != "0" else "" for row in rows])
+                decimals.append(None)
+
+        if facingSample:
+            template += '<facing x="0.0" y="0.0" z="0.0"/>'
+        if neutronic is not None:
+            template += '<neutronic x="%s" y="%s" z="%s"/>'
+            columns.extend(np.asarray(neutronic, dtype=float).reshape(num, 3).T)
+            decimals.extend([length] * 3)
+        template += '</location>'
+
+        _appendRows(root, template, columns, decimals)
+        return root[len(root) - num:]
+
     def addLocationPolar(self, root, r, theta, phi, name=None):
+        r = self.formatValue(r)
+        theta = self.formatValue(theta, "angle")
+        phi = self.formatValue(phi, "angle")
         if name is not None:
             pos_loc = le.SubElement(root, "location", r=r, t=theta, p=phi, name=name)
         else:
@@ -593,13 +1323,19 @@ class MantidGeom:
 
         pack_start = (effective_tube_width / 2.0) * (1 - num_tubes)
 
+        if self.__compact_locations and not neutronic:
+            x = pack_start + np.arange(num_tubes) * effective_tube_width
+            if self.__addLocations(component, "tube", decimals=5, x=x) is not None:
+                return
+
         for i in range(num_tubes):
             tube_name = "tube%d" % (i + 1)
             x = pack_start + (i * effective_tube_width)
-            location_element = le.SubElement(component, "location", name=tube_name, x='{:.5f}'.format(x))
+            location_element = le.SubElement(component, "location", name=tube_name,
+                                              x=self.formatValue(x, decimals=5))
             if (neutronic):
                 if (neutronicIsPhysical):
-                    le.SubElement(location_element, "neutronic", x='{:.5f}'.format(x))
+                    le.SubElement(location_element, "neutronic", x=self.formatValue(x, decimals=5))
                 else:
                     le.SubElement(location_element, "neutronic", x="0.0")
 
@@ -636,7 +1372,7 @@ class MantidGeom:
             z = pack_start_z + separation * i
             x = pack_start_x + slip * i
             le.SubElement(component, 'location', name=pack_name,
-                          x=str(x), z=str(z))
+                          x=self.formatValue(x), z=self.formatValue(z))
         if neutronic is True:
             raise NotImplementedError('Not implemented for neutronic'
                                       'posisitons')
@@ -680,10 +1416,10 @@ class MantidGeom:
         component = le.SubElement(type_assembly, 'component', type=sub_type)
         theta_angles = dtheta * (0.5 + np.arange(num_sub)) - \
                        num_sub * dtheta / 2 + theta_0
-        rot = [f'{v:.4f}' for v in theta_angles]
+        rot = self.formatValue(theta_angles, 'angle', decimals=4)
         rot_axis = {'axis-x': '0', 'axis-y': '1', 'axis-z': '0'}
         for i in range(num_sub):
-            kwargs = dict(name=f'{sub_name}{first_index+i}', r=str(radius),
+            kwargs = dict(name=f'{sub_name}{first_index+i}', r=self.formatValue(radius),
                           t=rot[i], rot=rot[i])
             kwargs.update(rot_axis)
             le.SubElement(component, 'location', **kwargs)
@@ -704,12 +1440,21 @@ class MantidGeom:
 
         pack_start = (effective_tube_width / 2.0) * (1 - num_tubes)
 
+        if self.__compact_locations:
+            x = pack_start + np.arange(num_tubes) * effective_tube_width
+            angle = x/radius/2
+            if self.__addLocations(component, type_name, x=-x*np.cos(angle),
+                                   z=-x*np.sin(angle)) is not None:
+                return
+
         for i in range(num_tubes):
             tube_name = type_name + "%d" % (i + 1)
             x = pack_start + (i * effective_tube_width) # Mantid
             #x = -(pack_start + (i * effective_tube_width)) # Flipped
             angle = x/radius/2
-            location_element = le.SubElement(component, "location", name=tube_name, x=str(-x*np.cos(angle)), z=str(-x*np.sin(angle)))
+            location_element = le.SubElement(component, "location", name=tube_name,
+                                              x=self.formatValue(-x*np.cos(angle)),
+                                              z=self.formatValue(-x*np.sin(angle)))
 
     def addPixelatedTube(self, name, num_pixels, tube_height,
                          type_name="pixel", neutronic=False, neutronicIsPhysical=False):
@@ -731,16 +1476,48 @@ class MantidGeom:
         pixel_width = tube_height / num_pixels
         tube_start = (pixel_width / 2.0) * (1 - num_pixels)
 
+        if self.__compact_locations and not neutronic:
+            y = tube_start + np.arange(num_pixels) * pixel_width
+            if self.__addLocations(component, "pixel", decimals=5, y=y) is not None:
+                return
+
         for i in range(num_pixels):
             pixel_name = "pixel%d" % (i + 1)
             y = tube_start + (i * pixel_width)
-            location_element = le.SubElement(component, "location", name=pixel_name, y='{:.5f}'.format(y))
+            location_element = le.SubElement(component, "location", name=pixel_name,
+                                              y=self.formatValue(y, decimals=5))
             if (neutronic):
                 if (neutronicIsPhysical):
-                    le.SubElement(location_element, "neutronic", y=str(y))
+                    le.SubElement(location_element, "neutronic", y=self.formatValue(y))
                 else:
                     le.SubElement(location_element, "neutronic", y="0.0")
 
+    def __addLocations(self, component, name, decimals=None, **coords):
+        """
+        Add a locations element for the positions given by the coordinate
+        arrays, named ``name`` followed by a count from 1. Nothing is added
+        and None returned unless all coordinates are evenly spaced. decimals
+        is the rounding of separate location elements that the interpolated
+        positions have to match.
+        """
+        if not all(_isProgression(values) for values in coords.values()):
+            return None
+        # Mantid interpolates between the ends, so they keep every digit and
+        # the positions must come out within the rounding of separate locations
+        rounding = .5 * 10.**-(self.__precision["length"] if decimals is None else decimals)
+        attrs = {}
+        for axis in sorted(coords):
+            values = np.asarray(coords[axis], dtype=float)
+            start = self.formatValue(values[0], quantity=None)
+            end = self.formatValue(values[-1], quantity=None)
+            if np.abs(np.linspace(float(start), float(end), len(values)) - values).max() > rounding:
+                return None
+            attrs[axis] = start
+            attrs[axis + "-end"] = end
+        attrs.update({"n-elements": str(len(coords[axis])), "name": name,
+                      "name-count-start": "1"})
+        return le.SubElement(component, "locations", **attrs)
+
     def addCylinderPixel(self, name, center_bottom_base, axis, pixel_radius,
                          pixel_height, is_type="detector", algebra="cyl-approx"):
         """
@@ -751,13 +1528,14 @@ class MantidGeom:
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id=algebra)
         le.SubElement(cylinder, "centre-of-bottom-base",
-                      r=str(center_bottom_base[0]),
-                      t=str(center_bottom_base[1]),
-                      p=str(center_bottom_base[2]))
-        le.SubElement(cylinder, "axis", x='{:.5f}'.format(axis[0]), y='{:.5f}'.format(axis[1]),
-                      z='{:.5f}'.format(axis[2]))
-        le.SubElement(cylinder, "radius", val='{:.5f}'.format(pixel_radius))
-        le.SubElement(cylinder, "height", val='{:.5f}'.format(pixel_height))
+                      r=self.formatValue(center_bottom_base[0]),
+                      t=self.formatValue(center_bottom_base[1], "angle"),
+                      p=self.formatValue(center_bottom_base[2], "angle"))
+        le.SubElement(cylinder, "axis", x=self.formatValue(axis[0], decimals=5),
+                      y=self.formatValue(axis[1], decimals=5),
+                      z=self.formatValue(axis[2], decimals=5))
+        le.SubElement(cylinder, "radius", val=self.formatValue(pixel_radius, decimals=5))
+        le.SubElement(cylinder, "height", val=self.formatValue(pixel_height, decimals=5))
         le.SubElement(type_element, "algebra", val=algebra)
 
         return
@@ -771,12 +1549,13 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id=algebra)
-        center_bottom_base = {k:str(v) for k, v in center_bottom_base.items()}
-        axis = {k:str(v) for k, v in axis.items()}
+        center_bottom_base = {k:self.formatValue(v, "angle" if k in "tp" else "length")
+                              for k, v in center_bottom_base.items()}
+        axis = {k:self.formatValue(v) for k, v in axis.items()}
         le.SubElement(cylinder, "centre-of-bottom-base", **center_bottom_base)
         le.SubElement(cylinder, "axis", **axis)
-        le.SubElement(cylinder, "radius", val=str(pixel_radius))
-        le.SubElement(cylinder, "height", val=str(pixel_height))
+        le.SubElement(cylinder, "radius", val=self.formatValue(pixel_radius))
+        le.SubElement(cylinder, "height", val=self.formatValue(pixel_height))
         le.SubElement(type_element, "algebra", val=algebra)
 
         return
@@ -792,14 +1571,14 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cuboid = le.SubElement(type_element, "cuboid", id=shape_id)
-        le.SubElement(cuboid, "left-front-bottom-point", x=str(lfb_pt[0]),
-                      y=str(lfb_pt[1]), z=str(lfb_pt[2]))
-        le.SubElement(cuboid, "left-front-top-point", x=str(lft_pt[0]),
-                      y=str(lft_pt[1]), z=str(lft_pt[2]))
-        le.SubElement(cuboid, "left-back-bottom-point", x=str(lbb_pt[0]),
-                      y=str(lbb_pt[1]), z=str(lbb_pt[2]))
-        le.SubElement(cuboid, "right-front-bottom-point", x=str(rfb_pt[0]),
-                      y=str(rfb_pt[1]), z=str(rfb_pt[2]))
+        le.SubElement(cuboid, "left-front-bottom-point", x=self.formatValue(lfb_pt[0]),
+                      y=self.formatValue(lfb_pt[1]), z=self.formatValue(lfb_pt[2]))
+        le.SubElement(cuboid, "left-front-top-point", x=self.formatValue(lft_pt[0]),
+                      y=self.formatValue(lft_pt[1]), z=self.formatValue(lft_pt[2]))
+        le.SubElement(cuboid, "left-back-bottom-point", x=self.formatValue(lbb_pt[0]),
+                      y=self.formatValue(lbb_pt[1]), z=self.formatValue(lbb_pt[2]))
+        le.SubElement(cuboid, "right-front-bottom-point", x=self.formatValue(rfb_pt[0]),
+                      y=self.formatValue(rfb_pt[1]), z=self.formatValue(rfb_pt[2]))
         le.SubElement(type_element, "algebra", val=shape_id)
 
     def addDummyMonitor(self, radius, height):
@@ -812,8 +1591,8 @@ class MantidGeom:
         le.SubElement(cylinder, "centre-of-bottom-base", p="0.0", r="0.0",
                       t="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.formatValue(radius))
+        le.SubElement(cylinder, "height", val=self.formatValue(height))
 
         le.SubElement(type_element, "algebra", val="cyl-approx")
 
@@ -824,17 +1603,76 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type", **{"name":"monitor",
                                                              "is":"monitor"})
         cuboid = le.SubElement(type_element, "cuboid", id="shape")
-        le.SubElement(cuboid, "left-front-bottom-point", x=str(-width/2), y=str(-height/2),z=str(-depth/2))
-        le.SubElement(cuboid, "left-front-top-point", x=str(-width/2), y=str(height/2),z=str(-depth/2))
-        le.SubElement(cuboid, "left-back-bottom-point", x=str(-width/2), y=str(-height/2),z=str(depth/2))
-        le.SubElement(cuboid, "right-front-bottom-point", x=str(width/2), y=str(-height/2),z=str(-depth/2))
+        le.SubElement(cuboid, "left-front-bottom-point",
+                      x=self.formatValue(-width/2),
+                      y=self.formatValue(-height/2),
+                      z=self.formatValue(-depth/2))
+        le.SubElement(cuboid, "left-front-top-point",
+                      x=self.formatValue(-width/2),
+                      y=self.formatValue(height/2),
+                      z=self.formatValue(-depth/2))
+        le.SubElement(cuboid, "left-back-bottom-point",
+                      x=self.formatValue(-width/2),
+                      y=self.formatValue(-height/2),
+                      z=self.formatValue(depth/2))
+        le.SubElement(cuboid, "right-front-bottom-point",
+                      x=self.formatValue(width/2),
+                      y=self.formatValue(-height/2),
+                      z=self.formatValue(-depth/2))
         le.SubElement(type_element, "algebra", val="shape")
 
-    def addDetectorIds(self, idname, idlist):
+    @staticmethod
+    def compressIds(ids):
+        """
+        Find the runs of constant stride in an array of IDs. Returns a list
+        of (start, end, step) tuples that reproduces the IDs in order. The
+        step is 1 for contiguous runs and isolated IDs have start == end.
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if ids.size < 2:
+            return [(int(value), int(value), 1) for value in ids]
+
+        # segments of equal differences between neighbouring IDs
+        diffs = np.diff(ids)
+        bounds = np.flatnonzero(diffs[1:] != diffs[:-1]) + 1
+        seg_first = np.concatenate(([0], bounds))  # index of the first ID in the segment
+        seg_last = np.concatenate((bounds, [diffs.size]))  # index of the last ID in the segment
+        seg_step = diffs[seg_first]
+
+        # neighbouring segments share an ID so claim them in order
+        runs = []
+        claimed = 0  # first index not in a run yet
+        for first, last, step in zip(seg_first.tolist(), seg_last.tolist(), seg_step.tolist()):
+            first = max(first, claimed)
+            length = last - first + 1
+            # non-contiguous pairs are no shorter as ranges, zero steps aren't allowed
+            if step == 0 or length < 2 or (length < 3 and step != 1):
+                continue
+            runs.extend([(value, value, 1) for value in ids[claimed:first].tolist()])
+            runs.append((int(ids[first]), int(ids[last]), step))
+            claimed = last + 1
+        runs.extend([(value, value, 1) for value in ids[claimed:].tolist()])
+        return runs
+
+    def __addIdRuns(self, id_element, runs):
+        """
+        Add an id element for each (start, end, step) run.
+        """
+        for start, end, step in runs:
+            if start == end:
+                le.SubElement(id_element, "id", val=str(start))
+            elif step == 1:
+                le.SubElement(id_element, "id", start=str(start), end=str(end))
+            else:
+                le.SubElement(id_element, "id", start=str(start), step=str(step),
+                              end=str(end))
+
+    def addDetectorIds(self, idname, idlist, compress=True):
         """
         Add the detector IDs. A list is provided that must be divisible by 3.
         The list should be specified as [start1, end1, step1, start2, end2,
-        step2, ...]. If no step is required, use None.
+        step2, ...]. If no step is required, use None. Unless compress is
+        False, ranges that continue each other are written as one.
         """
         if len(idlist) % 3 != 0:
             raise IndexError("Please specifiy list as [start1, end1, step1, "\
@@ -842,6 +1680,12 @@ class MantidGeom:
                              +"required, use None.")
         num_ids = int(len(idlist) / 3)
         id_element = le.SubElement(self.__root, "idlist", idname=idname)
+        if compress:
+            ids = [np.arange(int(idlist[i*3]), int(idlist[(i*3)+1]) + step, step)
+                   for i, step in ((i, int(idlist[(i*3)+2] or 1)) for i in range(num_ids))]
+            if ids:
+                self.__addIdRuns(id_element, self.compressIds(np.concatenate(ids)))
+            return
         for i in range(num_ids):
             if idlist[(i*3)+2] is None:
                 le.SubElement(id_element, "id", start=str(idlist[(i*3)]),
@@ -851,11 +1695,15 @@ class MantidGeom:
                               step=str(idlist[(i*3)+2]),
                               end=str(idlist[(i*3)+1]))
 
-    def addMonitorIds(self, ids=[]):
+    def addMonitorIds(self, ids=[], compress=True):
         """
-        Add the monitor IDs.
+        Add the monitor IDs. Unless compress is False, runs of IDs are
+        written as ranges.
         """
         idElt = le.SubElement(self.__root, "idlist", idname="monitors")
+        if compress:
+            self.__addIdRuns(idElt, self.compressIds([int(value) for value in ids]))
+            return
         for i in range(len(ids)):
             le.SubElement(idElt, "id", val=str(ids[i]))
 
@@ -872,7 +1720,7 @@ class MantidGeom:
                 raise IndexError("Will not be able to parse:", arg)
 
             par = le.SubElement(complink, "parameter", name=arg[0])
-            le.SubElement(par, "value", val=str(arg[1]), units=str(arg[2]))
+            le.SubElement(par, "value", val=self.formatValue(arg[1], None), units=str(arg[2]))
 
     def addDetectorStringParameters(self, component_name, *args):
         """
@@ -897,7 +1745,7 @@ class MantidGeom:
         """
         component = le.SubElement(self.__root, "component", type = component_name)
         distance = float(distance)
-        le.SubElement(component, "location", z=str(distance))
+        le.SubElement(component, "location", z=self.formatValue(distance))
         for arg in args:
             log = le.SubElement(component, "parameter", name=arg[0])
             if len(arg) == 2:
@@ -913,7 +1761,7 @@ class MantidGeom:
         """
         component = le.SubElement(self.__root, "component", type = component_name)
         distance = float(distance)
-        le.SubElement(component, "location", z=str(distance))
+        le.SubElement(component, "location", z=self.formatValue(distance))
         le.SubElement(self.__root, "type",
                       **{"name":component_name, "is":is_type})
 
@@ -927,20 +1775,20 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x=str(center[0]),
-                      y=str(center[1]),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x=self.formatValue(center[0]),
+                      y=self.formatValue(center[1]),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.formatValue(radius))
+        le.SubElement(cylinder, "height", val=self.formatValue(height))
         cuboid = le.SubElement(type_element, "cuboid", id="hole")
         le.SubElement(cuboid, "left-front-bottom-point",
-                      x=str(hole[0]),y=str(-hole[1]),z="0.0")
+                      x=self.formatValue(hole[0]),y=self.formatValue(-hole[1]),z="0.0")
         le.SubElement(cuboid, "left-front-top-point",
-                      x=str(hole[0]),y=str(-hole[1]),z=str(height))
+                      x=self.formatValue(hole[0]),y=self.formatValue(-hole[1]),z=self.formatValue(height))
         le.SubElement(cuboid, "left-back-bottom-point",
-                      x=str(-hole[0]),y=str(-hole[1]),z="0.0")
+                      x=self.formatValue(-hole[0]),y=self.formatValue(-hole[1]),z="0.0")
         le.SubElement(cuboid, "right-front-bottom-point",
-                      x=str(hole[0]),y=str(hole[1]),z="0.0")
+                      x=self.formatValue(hole[0]),y=self.formatValue(hole[1]),z="0.0")
         le.SubElement(type_element, "algebra", val="body (# hole)")
 
 
@@ -954,26 +1802,26 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder1 = le.SubElement(type_element, "cylinder", id="body1")
-        le.SubElement(cylinder1, "centre-of-bottom-base",x=str(center[0]),
-                      y=str(center[1]),z="0.0")
+        le.SubElement(cylinder1, "centre-of-bottom-base",x=self.formatValue(center[0]),
+                      y=self.formatValue(center[1]),z="0.0")
         le.SubElement(cylinder1, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder1, "radius", val=str(radius))
-        le.SubElement(cylinder1, "height", val=str(height))
+        le.SubElement(cylinder1, "radius", val=self.formatValue(radius))
+        le.SubElement(cylinder1, "height", val=self.formatValue(height))
         cuboid = le.SubElement(type_element, "cuboid", id="hole")
         le.SubElement(cuboid, "left-front-bottom-point",
-                      x=str(hole[0]),y=str(-hole[1]),z="0.0")
+                      x=self.formatValue(hole[0]),y=self.formatValue(-hole[1]),z="0.0")
         le.SubElement(cuboid, "left-front-top-point",
-                      x=str(hole[0]),y=str(-hole[1]),z=str(height*2+separation))
+                      x=self.formatValue(hole[0]),y=self.formatValue(-hole[1]),z=self.formatValue(height*2+separation))
         le.SubElement(cuboid, "left-back-bottom-point",
-                      x=str(-hole[0]),y=str(-hole[1]),z="0.0")
+                      x=self.formatValue(-hole[0]),y=self.formatValue(-hole[1]),z="0.0")
         le.SubElement(cuboid, "right-front-bottom-point",
-                      x=str(hole[0]),y=str(hole[1]),z="0.0")
+                      x=self.formatValue(hole[0]),y=self.formatValue(hole[1]),z="0.0")
         cylinder2 = le.SubElement(type_element, "cylinder", id="body2")
-        le.SubElement(cylinder2, "centre-of-bottom-base",x=str(-center[0]),
-                      y=str(-center[1]),z=str(height+separation))
+        le.SubElement(cylinder2, "centre-of-bottom-base",x=self.formatValue(-center[0]),
+                      y=self.formatValue(-center[1]),z=self.formatValue(height+separation))
         le.SubElement(cylinder2, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder2, "radius", val=str(radius))
-        le.SubElement(cylinder2, "height", val=str(height))
+        le.SubElement(cylinder2, "radius", val=self.formatValue(radius))
+        le.SubElement(cylinder2, "height", val=self.formatValue(height))
         le.SubElement(type_element, "algebra", val="(body1 : body2) (#hole)")
 
     def addFermiChopper(self, name, radius=0.05, height=0.065,width=0.061,is_type="chopper"):
@@ -985,18 +1833,31 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=str(y0),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=self.formatValue(y0),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="1.0", z="0.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.formatValue(radius))
+        le.SubElement(cylinder, "height", val=self.formatValue(height))
         cuboid = le.SubElement(type_element, "cuboid", id="hole")
-        le.SubElement(cuboid, "left-front-bottom-point", x=str(x0),y=str(y0),z=str(-radius))
-        le.SubElement(cuboid, "left-front-top-point", x=str(x0),y=str(-y0),z=str(-radius))
-        le.SubElement(cuboid, "left-back-bottom-point", x=str(-x0),y=str(y0),z=str(-radius))
-        le.SubElement(cuboid, "right-front-bottom-point",x=str(x0),y=str(y0),z=str(radius))
+        le.SubElement(cuboid, "left-front-bottom-point",
+                      x=self.formatValue(x0),
+                      y=self.formatValue(y0),
+                      z=self.formatValue(-radius))
+        le.SubElement(cuboid, "left-front-top-point",
+                      x=self.formatValue(x0),
+                      y=self.formatValue(-y0),
+                      z=self.formatValue(-radius))
+        le.SubElement(cuboid, "left-back-bottom-point",
+                      x=self.formatValue(-x0),
+                      y=self.formatValue(y0),
+                      z=self.formatValue(-radius))
+        le.SubElement(cuboid, "right-front-bottom-point",
+                      x=self.formatValue(x0),
+                      y=self.formatValue(y0),
+                      z=self.formatValue(radius))
         le.SubElement(type_element, "algebra", val="body (# hole)")
 
-    def addVerticalAxisT0Chopper(self, name, radius=0.175, height=0.090,width_out=0.095,width_in=0.085,is_type="chopper"):
+    def addVerticalAxisT0Chopper(self, name, radius=0.175, height=0.090,width_out=0.095,width_in=0.085,
+                                 is_type="chopper"):
         """
          Add a Vertical Axis T0 chopper
         """
@@ -1007,44 +1868,44 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=str(y0),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=self.formatValue(y0),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="1.0", z="0.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.formatValue(radius))
+        le.SubElement(cylinder, "height", val=self.formatValue(height))
         hex_1 = le.SubElement(type_element, "hexahedron", id="hole1")
         le.SubElement(hex_1, "left-front-bottom-point",
-                      x=str(x0_o),y=str(y0),z=str(-radius))
+                      x=self.formatValue(x0_o),y=self.formatValue(y0),z=self.formatValue(-radius))
         le.SubElement(hex_1, "left-front-top-point",
-                     x=str(x0_o),y=str(-y0),z=str(-radius))
+                     x=self.formatValue(x0_o),y=self.formatValue(-y0),z=self.formatValue(-radius))
         le.SubElement(hex_1, "left-back-bottom-point",
-                      x=str(-x0_o),y=str(y0),z=str(-radius))
+                      x=self.formatValue(-x0_o),y=self.formatValue(y0),z=self.formatValue(-radius))
         le.SubElement(hex_1, "left-back-top-point",
-                      x=str(-x0_o),y=str(-y0),z=str(-radius))
+                      x=self.formatValue(-x0_o),y=self.formatValue(-y0),z=self.formatValue(-radius))
         le.SubElement(hex_1, "right-front-bottom-point",
-                      x=str(x0_i),y=str(y0),z=str(0))
+                      x=self.formatValue(x0_i),y=self.formatValue(y0),z=self.formatValue(0))
         le.SubElement(hex_1, "right-front-top-point",
-                      x=str(x0_i),y=str(-y0),z=str(0))
+                      x=self.formatValue(x0_i),y=self.formatValue(-y0),z=self.formatValue(0))
         le.SubElement(hex_1, "right-back-bottom-point",
-                      x=str(-x0_i),y=str(y0),z=str(0))
+                      x=self.formatValue(-x0_i),y=self.formatValue(y0),z=self.formatValue(0))
         le.SubElement(hex_1, "right-back-top-point",
-                      x=str(-x0_i),y=str(-y0),z=str(0))
+                      x=self.formatValue(-x0_i),y=self.formatValue(-y0),z=self.formatValue(0))
         hex_2 = le.SubElement(type_element, "hexahedron", id="hole2")
         le.SubElement(hex_2, "right-front-bottom-point",
-                     x=str(x0_o),y=str(y0),z=str(radius))
+                     x=self.formatValue(x0_o),y=self.formatValue(y0),z=self.formatValue(radius))
         le.SubElement(hex_2, "right-front-top-point",
-                      x=str(x0_o),y=str(-y0),z=str(radius))
+                      x=self.formatValue(x0_o),y=self.formatValue(-y0),z=self.formatValue(radius))
         le.SubElement(hex_2, "right-back-bottom-point",
-                      x=str(-x0_o),y=str(y0),z=str(radius))
+                      x=self.formatValue(-x0_o),y=self.formatValue(y0),z=self.formatValue(radius))
         le.SubElement(hex_2, "right-back-top-point",
-                      x=str(-x0_o),y=str(-y0),z=str(radius))
+                      x=self.formatValue(-x0_o),y=self.formatValue(-y0),z=self.formatValue(radius))
         le.SubElement(hex_2, "left-front-bottom-point",
-                      x=str(x0_i),y=str(y0),z=str(0))
+                      x=self.formatValue(x0_i),y=self.formatValue(y0),z=self.formatValue(0))
         le.SubElement(hex_2, "left-front-top-point",
-                      x=str(x0_i),y=str(-y0),z=str(0))
+                      x=self.formatValue(x0_i),y=self.formatValue(-y0),z=self.formatValue(0))
         le.SubElement(hex_2, "left-back-bottom-point",
-                      x=str(-x0_i),y=str(y0),z=str(0))
+                      x=self.formatValue(-x0_i),y=self.formatValue(y0),z=self.formatValue(0))
         le.SubElement(hex_2, "left-back-top-point",
-                      x=str(-x0_i),y=str(-y0),z=str(0))
+                      x=self.formatValue(-x0_i),y=self.formatValue(-y0),z=self.formatValue(0))
         le.SubElement(type_element, "algebra", val="body (# (hole1 : hole2))")
 
     def addCorrelationChopper(self, name, center=(-0.28, 0.0),
@@ -1058,11 +1919,11 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x=str(center[0]),
-                      y=str(center[1]),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x=self.formatValue(center[0]),
+                      y=self.formatValue(center[1]),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder, "radius", val=str(radius*0.85))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.formatValue(radius*0.85))
+        le.SubElement(cylinder, "height", val=self.formatValue(height))
         sequence=map(float,sequence.split())
         n=len(sequence)
         s=sum(sequence)
@@ -1078,42 +1939,48 @@ class MantidGeom:
             yy1=math.cos(angle_start)*radius
             yy2=math.cos(angle_end)*radius
             le.SubElement(hexahedrons[i], "left-back-bottom-point",
-                          x=str(xx1+center[0]),
-                          y=str(yy1+center[1]),
+                          x=self.formatValue(xx1+center[0]),
+                          y=self.formatValue(yy1+center[1]),
                           z="0.0")
             le.SubElement(hexahedrons[i], "left-front-bottom-point",
-                          x=str(xx1+center[0]),
-                          y=str(yy1+center[1]),
-                          z=str(height))
+                          x=self.formatValue(xx1+center[0]),
+                          y=self.formatValue(yy1+center[1]),
+                          z=self.formatValue(height))
             le.SubElement(hexahedrons[i], "right-front-bottom-point",
-                          x=str(xx2+center[0]),
-                          y=str(yy2+center[1]),
-                          z=str(height))
+                          x=self.formatValue(xx2+center[0]),
+                          y=self.formatValue(yy2+center[1]),
+                          z=self.formatValue(height))
             le.SubElement(hexahedrons[i], "right-back-bottom-point",
-                          x=str(xx2+center[0]),
-                          y=str(yy2+center[1]),
+                          x=self.formatValue(xx2+center[0]),
+                          y=self.formatValue(yy2+center[1]),
                           z="0.0")
             le.SubElement(hexahedrons[i], "left-back-top-point",
-                          x=str(xx1*0.8+center[0]),
-                          y=str(yy1*0.8+center[1]),
+                          x=self.formatValue(xx1*0.8+center[0]),
+                          y=self.formatValue(yy1*0.8+center[1]),
                           z="0.0")
             le.SubElement(hexahedrons[i], "left-front-top-point",
-                          x=str(xx1*0.8+center[0]),
-                          y=str(yy1*0.8+center[1]),
-                          z=str(height))
+                          x=self.formatValue(xx1*0.8+center[0]),
+                          y=self.formatValue(yy1*0.8+center[1]),
+                          z=self.formatValue(height))
             le.SubElement(hexahedrons[i], "right-front-top-point",
-                          x=str(xx2*0.8+center[0]),
-                          y=str(yy2*0.8+center[1]),
-                          z=str(height))
+                          x=self.formatValue(xx2*0.8+center[0]),
+                          y=self.formatValue(yy2*0.8+center[1]),
+                          z=self.formatValue(height))
             le.SubElement(hexahedrons[i], "right-back-top-point",
-                          x=str(xx2*0.8+center[0]),
-                          y=str(yy2*0.8+center[1]),
+                          x=self.formatValue(xx2*0.8+center[0]),
+                          y=self.formatValue(yy2*0.8+center[1]),
                           z="0.0")
         le.SubElement(type_element, "algebra", val="body : "+hole_list[:-3])
 
     def getRoot(self):
+        self.__unshare()
         return self.__root
 
+    @property
+    def fuse_rotations(self):
+        return self.__fuse_rotations
+
     @property
     def root(self):
+        self.__unshare()
         return self.__root
@@ -0,0 +1,398 @@
+#!/bin/env python
+from helper import MantidGeom
+from lxml import etree as le
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+LAST_MODIFIED = "2020-01-01 00:00:00"
+
+
+def makeGeom(**kwargs):
+    instr = MantidGeom("TEST", comment=" test ", valid_from=LAST_MODIFIED, **kwargs)
+    instr.root.set("last-modified", LAST_MODIFIED)  # make the output reproducible
+    return instr
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.direc = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.direc)
+
+    def build(self, instr):
+        instr.addSnsDefaults()
+        instr.addComment("SOURCE")
+        instr.addModerator(-20.)
+        instr.addSamplePosition()
+        instr.flush()
+        instr.addMonitors(distance=[-1., 2.], names=["monitor1", "monitor2"])
+        instr.addDetectorIds("bank1", [0, 127, None])
+        instr.flush()
+        instr.addComponent("bank1", idlist="bank1")
+        instr.addPixelatedTube("bank1", 128, 1.)
+        instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, 1. / 128)
+
+    def testMatchesInMemory(self):
+        memory = os.path.join(self.direc, "memory.xml")
+        instr = makeGeom()
+        self.build(instr)
+        instr.writeGeom(memory)
+
+        streamed = os.path.join(self.direc, "streamed.xml")
+        instr = makeGeom(stream=streamed)
+        self.build(instr)
+        self.assertEqual(len(instr.root), 3)  # only the unflushed elements are kept
+        instr.writeGeom()
+
+        with open(memory, "rb") as left, open(streamed, "rb") as right:
+            self.assertEqual(left.read(), right.read())
+
+    def testEmpty(self):
+        memory = os.path.join(self.direc, "memory.xml")
+        makeGeom().writeGeom(memory)
+        streamed = os.path.join(self.direc, "streamed.xml")
+        makeGeom(stream=streamed).writeGeom(streamed)
+        with open(memory, "rb") as left, open(streamed, "rb") as right:
+            self.assertEqual(left.read(), right.read())
+
+    def testFork(self):
+        with makeGeom(stream=os.path.join(self.direc, "streamed.xml")) as instr:
+            self.assertRaises(RuntimeError, instr.fork)
+
+    def testWrongFilename(self):
+        with makeGeom(stream=os.path.join(self.direc, "streamed.xml")) as instr:
+            self.assertRaises(RuntimeError, instr.writeGeom, os.path.join(self.direc, "other.xml"))
+
+    def testClosedOnError(self):
+        streamed = os.path.join(self.direc, "streamed.xml")
+        with self.assertRaises(ValueError):
+            with makeGeom(stream=streamed) as instr:
+                self.build(instr)
+                instr.flush()
+                raise ValueError("failed while building")
+        self.assertRaises(RuntimeError, instr.writeGeom)  # the file was closed
+        with open(streamed, "rb") as handle:
+            self.assertTrue(handle.read().startswith(b"<?xml"))
+
+
+class TestFork(unittest.TestCase):
+    def testVariants(self):
+        common = makeGeom()
+        common.addSnsDefaults()
+        common.addComponent("bank1", idlist="bank1")
+        handle = common.makeTypeElement("bank1")
+
+        variants = []
+        for num in (2, 4):
+            variant = common.fork()
+            variant.addComponent("tube", root=variant.lookup(handle))
+            variant.addPixelatedTube("tube", num, 1.)
+            variants.append(variant)
+
+        self.assertEqual(len(handle), 0)  # the original is untouched
+        self.assertEqual(len(common.root), 4)
+        for variant, num in zip(variants, (2, 4)):
+            self.assertEqual(len(variant.root), 5)
+            self.assertEqual(variant.root.find("type/component").get("type"), "tube")
+            self.assertEqual(variant.root.findall("type")[1].find("component/locations").get("n-elements"),
+                             str(num))
+
+    def testShared(self):
+        direc = tempfile.mkdtemp()
+        try:
+            def build(instr, num, handle=None):
+                instr.addComponent("tube", root=handle)
+                instr.addPixelatedTube("tube", num, 1.)
+                instr.addDetectorIds("bank1", [0, num - 1, None])
+
+            expected = makeGeom()
+            expected.addSnsDefaults()
+            expected.addComponent("bank1", idlist="bank1")
+            build(expected, 3, expected.makeTypeElement("bank1"))
+            expected.writeGeom(os.path.join(direc, "expected.xml"))
+
+            common = makeGeom()
+            common.addSnsDefaults()
+            common.addComponent("bank1", idlist="bank1")
+            handle = common.makeTypeElement("bank1")
+            shared = list(common.root)
+            variant = common.fork()
+            build(variant, 3, variant.lookup(handle))
+            nested = variant.fork()  # shares the same elements
+            variant.writeGeom(os.path.join(direc, "variant.xml"))
+            nested.writeGeom(os.path.join(direc, "nested.xml"))
+
+            self.assertEqual(list(common.root), shared)  # lent elements are given back
+            self.assertEqual(len(handle), 0)
+            with open(os.path.join(direc, "expected.xml"), "rb") as xml:
+                expected = xml.read()
+            for name in ("variant.xml", "nested.xml"):
+                with open(os.path.join(direc, name), "rb") as xml:
+                    self.assertEqual(xml.read(), expected)
+        finally:
+            shutil.rmtree(direc)
+
+    def testErrors(self):
+        instr = makeGeom()
+        self.assertRaises(RuntimeError, instr.lookup, instr.root)
+        self.assertRaises(ValueError, instr.fork().lookup, makeGeom().root)
+
+
+class TestDetectorPixels(unittest.TestCase):
+    def testBulk(self):
+        instr = makeGeom()
+        x = np.array([[0.1, 0.2], [0.3, 0.4]])
+        nr = np.array([[1., np.nan], [2., 3.]])
+        names = np.array([["a&b", "p2"], ["p3", "p4"]])
+        instr.addDetectorPixels("bank1", x=x, y=x, z=x, nr=nr, ntheta=x, nphi=x,
+                                names=names, energy=np.full(x.shape, 3.5))
+        pixels = instr.root.find("type").findall("component")
+        self.assertEqual(len(pixels), 3)  # nan is skipped
+
+        location = pixels[0].find("location")
+        self.assertEqual(location.attrib, {"name": "a&b", "x": "0.1", "y": "0.1", "z": "0.1"})
+        self.assertEqual(location.find("neutronic").attrib, {"r": "1", "t": "0.1", "p": "0.1"})
+        self.assertEqual(pixels[0].find("parameter/value").get("val"), "3.5")
+        self.assertEqual(pixels[2].find("location").get("name"), "p4")
+
+
+class TestFormatting(unittest.TestCase):
+    def testScalar(self):
+        instr = makeGeom()
+        self.assertEqual(instr.formatValue(1.0), "1")
+        self.assertEqual(instr.formatValue(-0.0), "0")
+        self.assertEqual(instr.formatValue(-1e-12), "0")
+        self.assertEqual(instr.formatValue(0.1 + 0.2), "0.3")
+        self.assertEqual(instr.formatValue(-2.54), "-2.54")
+        self.assertEqual(instr.formatValue(np.float32(0.1)), "0.1")
+        self.assertEqual(instr.formatValue(12.3456789, "angle"), "12.345679")
+        self.assertEqual(instr.formatValue(0.123456, decimals=4), "0.1235")
+        self.assertEqual(instr.formatValue(0.1 + 0.2, None), "0.30000000000000004")
+        self.assertEqual(instr.formatValue(7), "7")
+        self.assertEqual(instr.formatValue("ssmotor 2 ssmotor *"), "ssmotor 2 ssmotor *")
+
+    def testArray(self):
+        instr = makeGeom(precision={"length": 3})
+        values = np.array([1.0, -0.0, -0.0004, 0.0005, 0.0015, -2.5, 1.23456, 1e300, np.nan])
+        self.assertEqual(instr.formatValue(values),
+                         ["1", "0", "0", "0.001", "0.002", "-2.5", "1.235", "1e+300", "nan"])
+        # the scalar and array versions agree
+        self.assertEqual(instr.formatValue(values), [instr.formatValue(value) for value in values])
+        # rounded from the exact binary values: 2.675 is just below 2.675 and 0.125 is a tie
+        values = np.array([2.675, 0.125, 1.005, -0.0051])
+        self.assertEqual(instr.formatValue(values, decimals=2), ["2.67", "0.12", "1", "-0.01"])
+        self.assertEqual(instr.formatValue(values, decimals=2),
+                         [instr.formatValue(value, decimals=2) for value in values])
+
+    def testUnknownQuantity(self):
+        self.assertRaises(ValueError, makeGeom, precision={"time": 3})
+
+
+class TestCompactLocations(unittest.TestCase):
+    def testTube(self):
+        instr = makeGeom()
+        instr.addPixelatedTube("tube", 4, 1.)
+        locations = instr.root.find("type/component/locations")
+        self.assertEqual(locations.attrib, {"y": "-0.375", "y-end": "0.375", "n-elements": "4",
+                                            "name": "pixel", "name-count-start": "1"})
+
+    def testInterpolated(self):
+        # the positions Mantid interpolates between the ends are the ones given
+        instr = makeGeom()
+        instr.addPixelatedTube("tube", 7, 1.0000123)
+        instr.addNPack("pack", 5, 0.0254123, 0.0021)
+        for name, axis, count in (("tube", "y", 7), ("pack", "x", 5)):
+            locations = [element for element in instr.root.findall("type")
+                         if element.get("name") == name][0].find("component/locations")
+            self.assertEqual(locations.get("n-elements"), str(count))
+            rebuilt = np.linspace(float(locations.get(axis)), float(locations.get(axis + "-end")), count)
+            if name == "tube":
+                expected = 1.0000123 / 7 * (np.arange(7) - 3.)
+            else:
+                expected = (0.0254123 + 0.0021) * (np.arange(5) - 2.)
+            self.assertTrue(np.allclose(rebuilt, expected, rtol=0., atol=1e-12))
+
+    def testOptOut(self):
+        instr = makeGeom(compact_locations=False)
+        instr.addNPack("pack", 2, 0.01, 0.001)
+        self.assertEqual([loc.attrib for loc in instr.root.findall("type/component/location")],
+                         [{"name": "tube1", "x": "-0.0055"}, {"name": "tube2", "x": "0.0055"}])
+
+    def testFallback(self):
+        instr = makeGeom()
+        instr.addPixelatedTube("tube", 4, 1., neutronic=True)
+        instr.addWANDDetector("wand", 4, 0.01, 0.001, 0.5)
+        for type_element in instr.root.iterchildren("type"):
+            self.assertEqual(len(type_element.findall("component/location")), 4)
+            self.assertIsNone(type_element.find("component/locations"))
+
+
+class TestAddLocations(unittest.TestCase):
+    def testMatchesAddLocation(self):
+        xyz = np.array([[0., 1., 2.], [-1.5, 0.25, 3.]])
+        angles = np.array([[0., 10., 20.], [5., 0., -30.]])
+        neutronic = xyz * 2.
+        looped = makeGeom()
+        for i in range(2):
+            looped.addLocation(looped.root, *xyz[i], rot_x=angles[i, 0], rot_y=angles[i, 1],
+                               rot_z=angles[i, 2], name="det%d" % i, facingSample=True,
+                               neutronic=True, nx=neutronic[i, 0], ny=neutronic[i, 1], nz=neutronic[i, 2])
+        batched = makeGeom()
+        locations = batched.addLocations(batched.root, xyz, angles, ["det0", "det1"], neutronic,
+                                         facingSample=True)
+        self.assertEqual(len(locations), 2)
+        self.assertEqual(le.tostring(batched.root), le.tostring(looped.root))
+
+    def testFused(self):
+        looped = makeGeom(fuse_rotations=True)
+        batched = makeGeom(fuse_rotations=True)
+        angles = np.array([[0., 0., 0.], [0., 90., 0.], [30., 20., 10.]])
+        for row in angles:
+            looped.addLocation(looped.root, 0., 0., 0., *row)
+        batched.addLocations(batched.root, np.zeros((3, 3)), angles)
+        self.assertEqual(le.tostring(batched.root), le.tostring(looped.root))
+        self.assertEqual(len(batched.root[0]), 0)  # identity is left out
+
+    def testFusedZero(self):
+        instr = makeGeom(fuse_rotations=True)
+        locations = instr.addLocations(instr.root, np.arange(9.).reshape(3, 3), np.zeros((3, 3)))
+        self.assertEqual(len(instr.root.findall("location")), 3)
+        self.assertEqual([location.get("x") for location in locations], ["0", "3", "6"])
+        self.assertEqual(sum(len(location) for location in locations), 0)
+
+    def testQuaternions(self):
+        instr = makeGeom()
+        quats = [[1., 0., 0., 0.], [np.sqrt(.5), 0., -np.sqrt(.5), 0.]]
+        locations = instr.addLocations(instr.root, np.zeros((2, 3)), quats)
+        self.assertEqual(len(locations[0]), 0)
+        self.assertEqual(locations[1][0].attrib, {"val": "90", "axis-x": "0", "axis-y": "-1", "axis-z": "0"})
+        self.assertRaises(ValueError, instr.addLocations, instr.root, np.zeros((2, 3)), np.zeros((2, 2)))
+
+
+class TestMergeTypes(unittest.TestCase):
+    def testMerge(self):
+        instr = makeGeom()
+        for i in (1, 2):
+            instr.addComponent("pack%d" % i, idlist="pack%d" % i)
+            instr.addNPack("pack%d" % i, 2, 0.01, 0.001, type_name="tube%d" % i)
+            instr.addComment("tube%d" % i)  # comments don't matter
+            instr.addPixelatedTube("tube%d" % i, 4, 1.)
+        instr.addPixelatedTube("tube3", 8, 1.)
+        instr.addRectangularDetector("panel1", "tube1", -.1, .1, 2, -.1, .1, 2)
+        instr.addRectangularDetector("panel2", "tube2", -.1, .1, 2, -.1, .1, 2)
+
+        self.assertEqual(instr.mergeDuplicateTypes(),
+                         {"pack2": "pack1", "tube2": "tube1", "panel2": "panel1"})
+        self.assertEqual([elem.get("name") for elem in instr.root.iterchildren("type")],
+                         ["pack1", "tube1", "tube3", "panel1"])
+        component = instr.root.findall("component")[1]
+        self.assertEqual(component.attrib, {"type": "pack1", "idlist": "pack2", "name": "pack2"})
+        self.assertEqual(instr.mergeDuplicateTypes(), {})
+
+    def testWriteDefault(self):
+        instr = makeGeom()
+        instr.addPixelatedTube("tube1", 4, 1.)
+        instr.addPixelatedTube("tube2", 4, 1.)
+        direc = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(direc, "TEST_Definition.xml")
+            instr.writeGeom(filename)  # unchanged unless asked
+            self.assertEqual(len(instr.root.findall("type")), 2)
+            instr.writeGeom(filename, merge_types=True)
+            self.assertEqual(len(instr.root.findall("type")), 1)
+        finally:
+            shutil.rmtree(direc)
+
+
+class TestPromoteRectangular(unittest.TestCase):
+    def build(self, instr, ids):
+        bank = instr.addComponent("bank1", idlist="bank1")
+        instr.addLocation(bank, 0., 0., 2., rot_y=30.)
+        instr.addNPack("bank1", 4, 0.01, 0.002)
+        instr.addPixelatedTube("tube", 8, 1.)
+        instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .005, 1. / 8)
+        instr.addDetectorIds("bank1", ids)
+
+    def testPromote(self):
+        instr = makeGeom()
+        self.build(instr, [100, 131, None])
+        self.assertEqual(instr.promoteRectangularDetectors(), ["bank1"])
+        self.assertEqual([elem.get("name") for elem in instr.root.iterchildren("type")],
+                         ["bank1", "pixel"])
+        self.assertIsNone(instr.root.find("idlist"))
+        component = instr.root.find("component")
+        self.assertEqual(component.get("idstart"), "100")
+        self.assertEqual(component.get("idfillbyfirst"), "y")
+        self.assertEqual(component.get("idstepbyrow"), "8")
+        self.assertEqual(component.find("location/rot").get("val"), "30")
+        rectangle = instr.root.find("type")
+        self.assertEqual(rectangle.get("is"), "rectangular_detector")
+        self.assertEqual((rectangle.get("xstart"), rectangle.get("xpixels")), ("-0.018", "4"))
+        self.assertEqual((rectangle.get("ystart"), rectangle.get("ypixels")), ("-0.4375", "8"))
+
+    def testReversed(self):
+        instr = makeGeom()
+        self.build(instr, [131, 100, -1])  # the last pixel has the first ID
+        instr.promoteRectangularDetectors()
+        rectangle = instr.root.find("type")
+        self.assertEqual((rectangle.get("xstart"), rectangle.get("xstep")), ("0.018", "-0.012"))
+        self.assertEqual((rectangle.get("ystart"), rectangle.get("ystep")), ("0.4375", "-0.125"))
+        self.assertEqual(instr.root.find("component").get("idstart"), "100")
+
+    def testRounded(self):
+        # positions written to 5 places are off the grid by up to the rounding
+        instr = makeGeom(precision={"length": 5}, compact_locations=False)
+        bank = instr.addComponent("bank1", idlist="bank1")
+        instr.addLocation(bank, 0., 0., 2.)
+        instr.addNPack("bank1", 3, 1. / 3., 0.)
+        instr.addPixelatedTube("tube", 7, 1.)
+        instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .005, 1. / 7)
+        instr.addDetectorIds("bank1", [1, 21, None])
+        self.assertEqual(instr.root.find("type[@name='tube']/component/location").get("y"), "-0.42857")
+        self.assertEqual(instr.promoteRectangularDetectors(), ["bank1"])
+        rectangle = instr.root.find("type")
+        self.assertEqual((rectangle.get("ystart"), rectangle.get("ypixels")), ("-0.42857", "7"))
+        self.assertAlmostEqual(float(rectangle.get("ystep")), 1. / 7, places=5)
+
+    def testIrregular(self):
+        instr = makeGeom()
+        self.build(instr, [0, 15, None, 20, 35, None])  # gap in the IDs between tubes
+        self.assertEqual(instr.promoteRectangularDetectors(), [])
+        self.assertEqual(len(instr.root.findall("type")), 3)
+
+
+class TestIdCompression(unittest.TestCase):
+    def testRuns(self):
+        self.assertEqual(MantidGeom.compressIds([]), [])
+        self.assertEqual(MantidGeom.compressIds([5]), [(5, 5, 1)])
+        self.assertEqual(MantidGeom.compressIds([1, 2, 3, 4, 10, 12, 14, 20, 30]),
+                         [(1, 4, 1), (10, 14, 2), (20, 20, 1), (30, 30, 1)])
+        self.assertEqual(MantidGeom.compressIds([-1, -2, -3, 7, 7]),
+                         [(-1, -3, -1), (7, 7, 1), (7, 7, 1)])
+        self.assertEqual(MantidGeom.compressIds([1, 3, 4, 5]), [(1, 1, 1), (3, 5, 1)])
+
+    def testIdList(self):
+        instr = makeGeom()
+        instr.addDetectorIds("bank1", [0, 9, None, 10, 19, 1, 30, 40, 5])
+        instr.addMonitorIds(["-1", "-2", "-3"])
+        idlists = instr.root.findall("idlist")
+        self.assertEqual([elem.attrib for elem in idlists[0]],
+                         [{"start": "0", "end": "19"},
+                          {"start": "30", "step": "5", "end": "40"}])
+        self.assertEqual([elem.attrib for elem in idlists[1]],
+                         [{"start": "-1", "step": "-1", "end": "-3"}])
+
+    def testPixelIdList(self):
+        instr = makeGeom()
+        r = np.array([1., np.nan, 1., 1., 1.])
+        instr.addDetectorPixelsIdList("bank1", r=r, names=np.array([1, 2, 3, 4, 8]))
+        self.assertEqual([elem.attrib for elem in instr.root.find("idlist")],
+                         [{"val": "1"}, {"start": "3", "end": "4"}, {"val": "8"}])
+
+
+if __name__ == "__main__":
+    unittest.main(module="helper_test", verbosity=2)
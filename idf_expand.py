@@ -0,0 +1,603 @@
+"""
+Expand an idf_model.InstrumentModel into the absolute positions of its
+detectors and monitors, the numbers that Mantid's LoadEmptyInstrument
+gives, without needing Mantid. The transforms are composed down the type
+DAG for all of the instances of a component at once, so the cost is a
+few numpy operations per component element rather than per pixel.
+"""
+from __future__ import print_function
+
+import numpy as np
+import quaternion
+from helper import MantidGeom
+from idf_model import Placement
+
+_strings = getattr(np, "strings", np.char)  # np.strings is new in numpy 2
+LEAF_KINDS = ("detector", "monitor")
+
+
+class ExpandedInstrument(object):
+    """
+    Every detector and monitor in the order that Mantid builds them: the
+    ids (-1 where there is no idlist), absolute positions (N x 3) and
+    rotations (N x 4 quaternions), whether they are monitors, their paths,
+    the names of the components leading to them joined by "/" without the
+    instrument name (e.g. "bank1/tube3/pixel5"), and the names of their
+    types, which hold the shapes.
+    """
+
+    def __init__(self, ids, positions, rotations, monitors, paths, types):
+        self.ids = ids
+        self.positions = positions
+        self.rotations = rotations
+        self.monitors = monitors
+        self.paths = paths
+        self.types = types
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def parents(self):
+        """
+        Paths of the components the pixels are in.
+        """
+        return np.array([path.rpartition("/")[0] for path in self.paths])
+
+    def detectors(self):
+        """
+        The same without the monitors.
+        """
+        return self[~self.monitors]
+
+    def __getitem__(self, index):
+        return ExpandedInstrument(self.ids[index], self.positions[index], self.rotations[index],
+                                  self.monitors[index], self.paths[index], self.types[index])
+
+    @classmethod
+    def concatenate(cls, parts):
+        return cls(*[np.concatenate(values) for values in
+                     zip(*[(part.ids, part.positions, part.rotations, part.monitors, part.paths,
+                            part.types) for part in parts])])
+
+
+def _join(parents, names):
+    """
+    Paths of the children (K x N) from the parent paths (K) and names (N).
+    """
+    names = np.asarray(names, dtype=str)[np.newaxis, :]
+    if parents is None:
+        return np.broadcast_to(names, (1, names.shape[1]))
+    return _strings.add(_strings.add(parents[:, np.newaxis], "/"), names)
+
+
+def _face(positions, rotations, relative, parent_rotations, facing):
+    """
+    Turn the z axis of the components at positions (K x N x 3) with the
+    absolute rotations given to point away from the facing points (N x 3,
+    nan for none) like Mantid's makeXYplaneFaceComponent does. The
+    rotation is applied to the relative rotations (K x N x 4) and the new
+    absolute rotations are returned.
+    """
+    direction = positions - facing
+    length = np.linalg.norm(direction, axis=-1, keepdims=True)
+    todo = np.isfinite(length[..., 0]) & (length[..., 0] > 0.)
+    if not todo.any():
+        return rotations
+    direction = direction / np.where(todo[..., np.newaxis], length, 1.)
+    inverse = rotations * [1., -1., -1., -1.]
+    direction = quaternion.rotate(inverse, direction)  # into the frame of the component
+    normal = np.cross(direction, [0., 0., 1.])
+    normal_length = np.linalg.norm(normal, axis=-1, keepdims=True)
+    normal = np.where(normal_length > 0., normal / np.where(normal_length > 0., normal_length, 1.),
+                      [0., 1., 0.])  # facing along z turns around y
+    theta = np.degrees(np.arccos(np.clip(direction[..., 2], -1., 1.)))
+    turn = quaternion.fromAxisAngle(-theta, normal)
+    relative = np.where(todo[..., np.newaxis], quaternion.multiply(turn, relative), relative)
+    return quaternion.multiply(parent_rotations, relative)
+
+
+class _Grid(object):
+    """
+    The ids of a rectangular detector, idstart + major * idstepbyrow +
+    minor * idstep where the minor index is y if idfillbyfirst is y.
+    """
+
+    def __init__(self, typedef, attrs):
+        self.xpixels, self.ypixels = int(typedef.attrs["xpixels"]), int(typedef.attrs["ypixels"])
+        self.fill_by_y = attrs.get("idfillbyfirst", "y") == "y"
+        self.idstart = int(attrs.get("idstart", 0))
+        self.idstepbyrow = int(attrs.get("idstepbyrow", self.ypixels if self.fill_by_y else self.xpixels))
+        self.idstep = int(attrs.get("idstep", 1))
+        corners = [self.idFromPixel(ix, iy) for ix in (0, self.xpixels - 1) for iy in (0, self.ypixels - 1)]
+        self.low, self.high = min(corners), max(corners)
+
+    def idFromPixel(self, ix, iy):
+        major, minor = (ix, iy) if self.fill_by_y else (iy, ix)
+        return self.idstart + major * self.idstepbyrow + minor * self.idstep
+
+    def pixelFromId(self, detector_id):
+        """
+        (ix, iy) of the id or None.
+        """
+        num_major, num_minor = (self.xpixels, self.ypixels) if self.fill_by_y \
+            else (self.ypixels, self.xpixels)
+        offset = detector_id - self.idstart
+        if self.idstepbyrow > 0 and self.idstepbyrow >= num_minor * abs(self.idstep):
+            majors = [offset // self.idstepbyrow]  # the rows don't interleave
+        else:
+            majors = range(num_major)
+        for major in majors:
+            minor, remainder = divmod(offset - major * self.idstepbyrow, self.idstep)
+            if remainder == 0 and 0 <= major < num_major and 0 <= minor < num_minor:
+                return (major, minor) if self.fill_by_y else (minor, major)
+        return None
+
+
+def _rectangularPixels(typedef, paths, names, attrs):
+    """
+    Relative positions, paths and ids of the pixels of the rectangular
+    detectors with the given paths (K x N) and names (N), in Mantid's
+    order of x columns of y pixels.
+    """
+    xpixels, ypixels = int(typedef.attrs["xpixels"]), int(typedef.attrs["ypixels"])
+    x = float(typedef.attrs.get("xstart", 0.)) + float(typedef.attrs.get("xstep", 0.)) * np.arange(xpixels)
+    y = float(typedef.attrs.get("ystart", 0.)) + float(typedef.attrs.get("ystep", 0.)) * np.arange(ypixels)
+    ix, iy = np.meshgrid(np.arange(xpixels), np.arange(ypixels), indexing="ij")
+    positions = np.stack([x[ix].ravel(), y[iy].ravel(), np.zeros(ix.size)], axis=-1)
+
+    ids = _Grid(typedef, attrs).idFromPixel(ix, iy)
+
+    names = np.asarray(names, dtype=str)[:, np.newaxis]
+    columns = _strings.add(_strings.add(names, ["(x=%d)/" % i for i in ix.ravel()]), names)
+    pixels = _strings.add(columns, ["(%d,%d)" % (i, j) for i, j in zip(ix.ravel(), iy.ravel())])
+    return positions, _strings.add(_strings.add(paths[..., np.newaxis], "/"), pixels), ids.ravel()
+
+
+def _place(model, placement, positions, rotations, paths):
+    """
+    The type, absolute positions (K x N x 3), rotations (K x N x 4) and
+    paths (K x N) of the N locations of a placement in K components at the
+    positions (K x 3) with rotations (K x 4) and paths (K, None at the top).
+    """
+    try:
+        typedef = model.types[placement.type_name]
+    except KeyError:
+        raise ValueError("Type '%s' is not defined" % placement.type_name)
+    count = len(placement)
+    child_positions = positions[:, np.newaxis] + \
+        quaternion.rotate(rotations[:, np.newaxis], placement.positions[np.newaxis])
+    relative = np.broadcast_to(placement.rotations, (len(positions), count, 4))
+    parent_rotations = rotations[:, np.newaxis]
+    child_rotations = quaternion.multiply(parent_rotations, relative)
+    if np.isfinite(placement.facing).any():
+        child_rotations = _face(child_positions, child_rotations, relative, parent_rotations,
+                                placement.facing)
+    return typedef, child_positions, child_rotations, _join(paths, placement.names)
+
+
+def _idList(model, placement, count):
+    """
+    The first count ids of the idlist of a placement.
+    """
+    idlist = placement.attrs["idlist"]
+    try:
+        ids = model.idlists[idlist]
+    except KeyError:
+        raise ValueError("idlist '%s' is not defined" % idlist)
+    if ids.size < count:
+        raise ValueError("idlist '%s' has %d ids for %d detectors" % (idlist, ids.size, count))
+    return ids[:count]
+
+
+def _expandPlacements(model, placements, positions, rotations, paths):
+    """
+    Expand the placements in the K components at the positions (K x 3)
+    with rotations (K x 4) and paths (K, None at the top). Returns the
+    ids, positions, rotations, monitor flags, paths and type names with a
+    leading dimension of K.
+    """
+    num = len(positions)
+    blocks = []
+    for placement in placements:
+        count = len(placement)
+        if count == 0:
+            continue
+        typedef, child_positions, child_rotations, child_paths = \
+            _place(model, placement, positions, rotations, paths)
+
+        if typedef.kind in LEAF_KINDS:
+            block = [np.full((num, count), -1, dtype=np.int64), child_positions, child_rotations,
+                     np.full((num, count), typedef.isMonitor), child_paths,
+                     np.full((num, count), typedef.name)]
+        elif typedef.isRectangular:
+            pixel_positions, names, ids = _rectangularPixels(typedef, child_paths, placement.names,
+                                                               placement.attrs)
+            flat_rotations = child_rotations.reshape(-1, 1, 4)
+            pixel_positions = child_positions.reshape(-1, 1, 3) + \
+                quaternion.rotate(flat_rotations, pixel_positions[np.newaxis])
+            size = len(ids)
+            block = [np.broadcast_to(ids, (num * count, size)), pixel_positions,
+                     np.broadcast_to(flat_rotations, (num * count, size, 4)),
+                     np.zeros((num * count, size), dtype=bool), names.reshape(-1, size),
+                     np.full((num * count, size), typedef.attrs["type"])]
+        else:
+            block = _expandPlacements(model, typedef.placements, child_positions.reshape(-1, 3),
+                                      child_rotations.reshape(-1, 4), child_paths.ravel())
+        block = [values.reshape((num, -1) + values.shape[2:]) for values in block]
+        if "idlist" in placement.attrs:
+            block[0] = _idList(model, placement, block[0].size).reshape(block[0].shape)
+        blocks.append(block)
+
+    if not blocks:
+        return [np.empty((num, 0), dtype=np.int64), np.empty((num, 0, 3)), np.empty((num, 0, 4)),
+                np.empty((num, 0), dtype=bool), np.empty((num, 0), dtype=str),
+                np.empty((num, 0), dtype=str)]
+    return [np.concatenate(values, axis=1) for values in zip(*blocks)]
+
+
+def _top():
+    """
+    Position, rotation and path of the instrument as a batch of one.
+    """
+    return np.zeros((1, 3)), quaternion.IDENTITY[np.newaxis], None
+
+
+def expand(model):
+    """
+    Return the ExpandedInstrument of an idf_model.InstrumentModel.
+    """
+    values = _expandPlacements(model, model.components, *_top())
+    return ExpandedInstrument(*[value[0] for value in values])
+
+
+def kindPositions(model, kind):
+    """
+    Absolute positions of the components whose type is of the kind, in
+    lower case, e.g. "source" or "samplepos". Only the parts of the
+    instrument that contain such components are walked.
+    """
+    contains = {}
+
+    def has(name):
+        if name not in contains:
+            typedef = model.types.get(name)
+            contains[name] = typedef is not None and (
+                typedef.kind == kind or any(has(placement.type_name) for placement in typedef.placements))
+        return contains[name]
+
+    found = []
+
+    def walk(placements, positions, rotations, paths):
+        for placement in placements:
+            if len(placement) == 0 or not has(placement.type_name):
+                continue
+            typedef, child_positions, child_rotations, child_paths = \
+                _place(model, placement, positions, rotations, paths)
+            if typedef.kind == kind:
+                found.append(child_positions.reshape(-1, 3))
+            walk(typedef.placements, child_positions.reshape(-1, 3), child_rotations.reshape(-1, 4),
+                 child_paths.ravel())
+
+    walk(model.components, *_top())
+    return np.concatenate(found) if found else np.empty((0, 3))
+
+
+def _units(model, placements, positions, rotations, paths, counts, units, chain=()):
+    """
+    Find the placements below which the ids are known, from an idlist or
+    a rectangular detector, and add them to units with their smallest and
+    largest id, their parents and the chain of placements leading to
+    them. Nothing is added for detectors without ids.
+    """
+    for placement in placements:
+        if len(placement) == 0:
+            continue
+        typedef = model.types.get(placement.type_name)
+        if typedef is None:
+            raise ValueError("Type '%s' is not defined" % placement.type_name)
+        if "idlist" in placement.attrs:
+            num = len(positions) * len(placement) * counts[typedef.name]
+            ids = _idList(model, placement, num)
+        elif typedef.isRectangular:
+            ids = _rectangularPixels(typedef, np.empty((0, len(placement)), dtype=str),
+                                     placement.names, placement.attrs)[2]
+        elif typedef.kind not in LEAF_KINDS and counts[typedef.name] > 0:
+            _, child_positions, child_rotations, child_paths = \
+                _place(model, placement, positions, rotations, paths)
+            _units(model, typedef.placements, child_positions.reshape(-1, 3),
+                   child_rotations.reshape(-1, 4), child_paths.ravel(), counts, units,
+                   chain + (placement,))
+            continue
+        else:
+            continue
+        if ids.size:
+            units.append((ids.min(), ids.max(), placement, positions, rotations, paths, chain))
+
+
+def _slicePlacement(placement, start, stop):
+    """
+    The locations start to stop of a placement, without its idlist.
+    """
+    neutronic = None if placement.neutronic is None else placement.neutronic[start:stop]
+    attrs = {key: value for key, value in placement.attrs.items() if key != "idlist"}
+    return Placement(placement.type_name, placement.positions[start:stop], placement.rotations[start:stop],
+                     placement.names[start:stop], placement.facing[start:stop], attrs, neutronic)
+
+
+def _splitUnit(model, placement, positions, rotations, paths, ids, counts, chunk_size, pieces):
+    """
+    Split the placement in the components at the positions, whose pixels
+    have the ids in the order they are expanded, into pieces of about
+    chunk_size pixels along its locations and, for a location with more
+    pixels than that, along the placements of its type. Each piece is
+    added to pieces as a unit of iterPixels with its ids.
+    """
+    typedef = model.types[placement.type_name]
+    size = counts[typedef.name]
+    if len(ids) <= chunk_size or size == 0:
+        pieces.append((ids.min(), ids.max(), placement, positions, rotations, paths, ids))
+        return
+    if size > chunk_size and typedef.placements and not typedef.isRectangular:
+        # one location at a time, each split along the placements of the type
+        _, child_positions, child_rotations, child_paths = _place(model, placement, positions, rotations, paths)
+        offset = 0
+        for position, rotation, path in zip(child_positions.reshape(-1, 3), child_rotations.reshape(-1, 4),
+                                            child_paths.ravel()):
+            for child in typedef.placements:
+                num = len(child) * counts[child.type_name]
+                if num:
+                    _splitUnit(model, child, position[np.newaxis], rotation[np.newaxis],
+                               np.array([path]), ids[offset:offset + num], counts, chunk_size, pieces)
+                offset += num
+        return
+    # runs of locations in each component, the ids of which follow on from each other
+    step = max(chunk_size // size, 1)
+    count = len(placement)
+    for index in range(len(positions)):
+        for start in range(0, count, step):
+            stop = min(start + step, count)
+            piece = ids[(index * count + start) * size:(index * count + stop) * size]
+            pieces.append((piece.min(), piece.max(), _slicePlacement(placement, start, stop),
+                           positions[index:index + 1], rotations[index:index + 1],
+                           None if paths is None else paths[index:index + 1], piece))
+
+
+def iterPixels(model, chunk_size=65536):
+    """
+    Yield ExpandedInstrument chunks of chunk_size detectors and monitors
+    (fewer in the last one) in increasing id order. Only the components
+    that hold the ids of a chunk, e.g. a bank with an idlist, are
+    expanded for it. A component with an idlist of more than chunk_size
+    ids is split into pieces along the components below it, so memory
+    follows the size of the chunks rather than of the instrument even when
+    one idlist covers it all. Components whose id ranges interleave are
+    expanded together and pixels without an id are left out. The model is
+    an idf_model.InstrumentModel from MantidGeom.model or
+    InstrumentModel.fromFile.
+    """
+    counts = model.detectorCounts()
+    found = []
+    _units(model, model.components, *(_top() + (counts, found)))
+    units = []
+    for low, high, placement, positions, rotations, paths, _ in found:
+        num = len(positions) * len(placement) * counts[placement.type_name]
+        if "idlist" in placement.attrs and num > chunk_size:
+            ids = _idList(model, placement, num)
+            _splitUnit(model, placement, positions, rotations, paths, ids, counts, chunk_size, units)
+        else:
+            units.append((low, high, placement, positions, rotations, paths, None))
+    units.sort(key=lambda unit: unit[0])
+
+    pending = []
+    num_pending = 0
+    start = 0
+    while start < len(units):
+        # the group of units whose id ranges overlap
+        last = units[start][1]
+        stop = start + 1
+        while stop < len(units) and units[stop][0] <= last:
+            last = max(last, units[stop][1])
+            stop += 1
+        parts = []
+        for _, _, placement, positions, rotations, paths, ids in units[start:stop]:
+            values = _expandPlacements(model, [placement], positions, rotations, paths)
+            if ids is not None:
+                values[0] = ids.reshape(values[0].shape)
+            parts.append(ExpandedInstrument(*[value.reshape((-1,) + value.shape[2:])
+                                              for value in values]))
+        group = ExpandedInstrument.concatenate(parts)
+        group = group[group.ids >= 0]
+        pending.append(group[np.argsort(group.ids, kind="stable")])
+        num_pending += len(group)
+        start = stop
+
+        while num_pending >= chunk_size:
+            pixels = ExpandedInstrument.concatenate(pending)
+            yield pixels[:chunk_size]
+            pending = [pixels[chunk_size:]]
+            num_pending -= chunk_size
+    if num_pending:
+        yield ExpandedInstrument.concatenate(pending)
+
+
+class DetectorIndex(object):
+    """
+    Map detector ids to the components they are in and back. The ids of
+    each bank are kept as runs of constant step (see
+    MantidGeom.compressIds) in tables sorted by id, so memory follows the
+    number of runs rather than the largest id and a lookup is a binary
+    search. Rectangular detectors are a single range each, numbered from
+    their idstart, idfillbyfirst, idstepbyrow and idstep like Mantid does.
+    """
+
+    def __init__(self, model):
+        self.__model = model
+        self.__counts = model.detectorCounts()
+        self.__cumulative = {}
+        units = []
+        _units(model, model.components, *(_top() + (self.__counts, units)))
+        self.__units = []
+        self.__unit_keys = {}
+        rows = []
+        for index, (low, high, placement, positions, _, _, chain) in enumerate(units):
+            typedef = model.types[placement.type_name]
+            self.__unit_keys[(id(placement),) + tuple(id(parent) for parent in chain)] = index
+            if "idlist" not in placement.attrs:
+                # every rectangular detector of the placement has the same ids
+                self.__units.append((placement, chain, _Grid(typedef, placement.attrs), None))
+                rows.append([[low, high, index, 0, -1]])
+                continue
+            ids = _idList(model, placement,
+                          len(positions) * len(placement) * self.__counts[typedef.name])
+            runs = np.array(MantidGeom.compressIds(ids), dtype=np.int64).reshape(-1, 3)
+            lengths = (runs[:, 1] - runs[:, 0]) // runs[:, 2] + 1
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            self.__units.append((placement, chain, runs, offsets))
+            rows.append(np.column_stack([np.minimum(runs[:, 0], runs[:, 1]),
+                                         np.maximum(runs[:, 0], runs[:, 1]),
+                                         np.full(len(runs), index), offsets, np.arange(len(runs))]))
+        rows = np.concatenate(rows).astype(np.int64) if rows else np.empty((0, 5), dtype=np.int64)
+        rows = rows[np.argsort(rows[:, 0], kind="stable")]
+        self.__lows = rows[:, 0]
+        self.__rows = rows
+        # a tree of the largest high below each node over the rows in order, so that a lookup only
+        # goes down to the rows that hold the id however the ranges overlap or nest
+        size = 1
+        while size < len(rows):
+            size *= 2
+        tree = np.full(2 * size, np.iinfo(np.int64).min, dtype=np.int64)
+        tree[size:size + len(rows)] = rows[:, 1]
+        while size > 1:
+            tree[size // 2:size] = np.maximum(tree[size:2 * size:2], tree[size + 1:2 * size:2])
+            size //= 2
+        self.__highs = tree.tolist()
+
+    def __len__(self):
+        """
+        Number of runs of ids.
+        """
+        return len(self.__rows)
+
+    def __cumulativeCounts(self, typedef):
+        if typedef.name not in self.__cumulative:
+            sizes = [len(placement) * self.__counts[placement.type_name]
+                     for placement in typedef.placements]
+            self.__cumulative[typedef.name] = np.cumsum([0] + sizes)
+        return self.__cumulative[typedef.name]
+
+    def __find(self, detector_id):
+        """
+        The unit and the position of the detector in it.
+        """
+        last = np.searchsorted(self.__lows, detector_id, side="right") - 1
+        size = len(self.__highs) // 2
+        nodes = [(1, 0, size)]  # node of the tree, its first row and number of rows
+        while nodes:
+            node, first, count = nodes.pop()
+            if first > last or self.__highs[node] < detector_id:
+                continue
+            if count > 1:  # the later rows first
+                count //= 2
+                nodes += [(2 * node, first, count), (2 * node + 1, first + count, count)]
+                continue
+            _, _, unit, offset, run = self.__rows[first].tolist()  # whose range holds the id
+            if run < 0:
+                grid = self.__units[unit][2]
+                pixel = grid.pixelFromId(detector_id)
+                if pixel is not None:
+                    return unit, pixel[0] * grid.ypixels + pixel[1]
+            else:
+                start, _, step = self.__units[unit][2][run].tolist()
+                if (detector_id - start) % step == 0:
+                    return unit, offset + (detector_id - start) // step
+        raise KeyError("Detector id %d is not in the instrument" % detector_id)
+
+    def locate(self, detector_id):
+        """
+        The names and location indices of the components from the top of
+        the instrument down to the detector, e.g. bank, tube and pixel.
+        """
+        unit, ordinal = self.__find(int(detector_id))
+        placement, chain = self.__units[unit][:2]
+        per_parent = len(placement) * self.__counts[placement.type_name]
+        parent, ordinal = divmod(int(ordinal), per_parent)
+        levels = []
+        if chain:
+            indices = np.unravel_index(parent, [len(link) for link in chain])
+            levels = [(link.names[index], int(index)) for link, index in zip(chain, indices)]
+        while True:
+            typedef = self.__model.types[placement.type_name]
+            location, ordinal = divmod(ordinal, self.__counts[typedef.name])
+            name = placement.names[location]
+            levels.append((name, location))
+            if typedef.isRectangular:
+                ix, iy = divmod(ordinal, int(typedef.attrs["ypixels"]))
+                levels += [("%s(x=%d)" % (name, ix), ix), ("%s(%d,%d)" % (name, ix, iy), iy)]
+                return levels
+            if typedef.kind in LEAF_KINDS:
+                return levels
+            cumulative = self.__cumulativeCounts(typedef)
+            which = np.searchsorted(cumulative, ordinal, side="right") - 1
+            ordinal -= int(cumulative[which])
+            placement = typedef.placements[which]
+
+    def path(self, detector_id):
+        """
+        Path of the detector like ExpandedInstrument.paths.
+        """
+        return "/".join(name for name, _ in self.locate(detector_id))
+
+    def detectorId(self, path):
+        """
+        Id of the detector with the path. Raises a KeyError if there is none.
+        """
+        names = path.split("/")
+        placements = self.__model.components
+        chain = ()
+        parent = []
+        for depth, name in enumerate(names):
+            found = [(placement, placement.names.index(name)) for placement in placements
+                     if name in placement.names]
+            if not found:
+                raise KeyError("No component '%s' in '%s'" % (name, path))
+            placement, location = found[0]
+            unit = self.__unit_keys.get((id(placement),) + tuple(id(link) for link in chain))
+            if unit is not None:
+                break
+            chain += (placement,)
+            parent.append(location)
+            placements = self.__model.types[placement.type_name].placements
+        else:
+            raise KeyError("'%s' has no detector id" % path)
+
+        per_parent = len(placement) * self.__counts[placement.type_name]
+        ordinal = 0
+        if chain:
+            ordinal = int(np.ravel_multi_index(parent, [len(link) for link in chain])) * per_parent
+        for name in names[depth + 1:] + [None]:
+            typedef = self.__model.types[placement.type_name]
+            ordinal += location * self.__counts[typedef.name]
+            if typedef.isRectangular:
+                ix, iy = [int(value) for value in names[-1].rpartition("(")[2].rstrip(")").split(",")]
+                ordinal += ix * int(typedef.attrs["ypixels"]) + iy
+                break
+            if name is None:
+                break
+            cumulative = self.__cumulativeCounts(typedef)
+            found = [(which, placement.names.index(name))
+                     for which, placement in enumerate(typedef.placements) if name in placement.names]
+            if not found:
+                raise KeyError("No component '%s' in '%s'" % (name, path))
+            which, location = found[0]
+            ordinal += int(cumulative[which])
+            placement = typedef.placements[which]
+        if self.__model.types[placement.type_name].kind not in LEAF_KINDS + ("rectangular_detector",):
+            raise KeyError("'%s' is not a detector" % path)
+        if self.__units[unit][3] is None:
+            grid = self.__units[unit][2]
+            return grid.idFromPixel(*divmod(ordinal % (grid.xpixels * grid.ypixels), grid.ypixels))
+        runs, offsets = self.__units[unit][2:]
+        run = np.searchsorted(offsets, ordinal, side="right") - 1
+        start, _, step = runs[run]
+        return int(start + (ordinal - offsets[run]) * step)
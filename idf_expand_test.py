@@ -0,0 +1,165 @@
+#!/bin/env python
+from helper import MantidGeom
+from idf_expand import DetectorIndex, ExpandedInstrument, expand, iterPixels
+from idf_model import InstrumentModel
+from lxml import etree as le
+from quaternion import axisAngleMatrix, rotate
+import numpy as np
+import unittest
+
+
+def makeTubes(ids=(10, 17, 1)):
+    instr = MantidGeom("TEST")
+    instr.addSnsDefaults()
+    instr.addPixelatedTube("tube", 4, 1.)
+    instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .25)
+    bank = instr.makeTypeElement("bank")
+    component = le.SubElement(bank, "component", type="tube")
+    instr.addLocation(component, .1, 0., 0., name="tube1")
+    instr.addLocation(component, .2, 0., 0., rot_x=30., rot_z=10., name="tube2")
+    component = instr.addComponent("bank", idlist="bank")
+    instr.addLocation(component, 0., 0., 5., rot_y=90., rot_x=20.)
+    instr.addDetectorIds("bank", list(ids))
+    return instr
+
+
+class TestExpand(unittest.TestCase):
+    def testTubes(self):
+        pixels = expand(makeTubes().model())
+        self.assertEqual(pixels.ids.tolist(), list(range(10, 18)))
+        self.assertEqual(pixels.paths[5], "bank/tube2/pixel2")
+        self.assertEqual(pixels.parents[5], "bank/tube2")
+        self.assertFalse(pixels.monitors.any())
+
+        # the same with rotation matrices, outermost rot first
+        bank = axisAngleMatrix(20., (1, 0, 0)).dot(axisAngleMatrix(90., (0, 1, 0)))
+        tube2 = axisAngleMatrix(10., (0, 0, 1)).dot(axisAngleMatrix(30., (1, 0, 0)))
+        pixel = np.array([0., -.125, 0.])
+        expected = [0., 0., 5.] + bank.dot([.2, 0., 0.] + tube2.dot(pixel))
+        self.assertTrue(np.allclose(pixels.positions[5], expected, atol=1e-9))
+        self.assertTrue(np.allclose(rotate(pixels.rotations[5], [0., 0., 1.]),
+                                    bank.dot(tube2).dot([0., 0., 1.])))
+
+    def testRectangular(self):
+        instr = MantidGeom("TEST")
+        instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .1)
+        instr.addRectangularDetector("panel", "pixel", -.1, .1, 3, -.05, .1, 2)
+        instr.addComponentRectangularDetector("panel", 0., 1., 2., idstart="100",
+                                              idfillbyfirst="y", idstepbyrow="10")
+        pixels = expand(instr.model())
+        self.assertEqual(pixels.ids.tolist(), [100, 101, 110, 111, 120, 121])
+        self.assertEqual(pixels.paths[3], "panel/panel(x=1)/panel(1,1)")
+        self.assertTrue(np.allclose(pixels.positions[3], [0., 1.05, 2.]))
+
+    def testFacing(self):
+        root = le.fromstring(
+            '<instrument name="TEST"><defaults><components-are-facing x="0" y="0" z="0"/></defaults>'
+            '<type name="pixel" is="detector"/>'
+            '<component type="pixel" idlist="pixels"><location x="2" y="1"/><location z="-1"/>'
+            '<location x="1"><facing val="none"/></location></component>'
+            '<idlist idname="pixels"><id start="1" end="3"/></idlist></instrument>')
+        pixels = expand(InstrumentModel.fromElement(root))
+        normals = rotate(pixels.rotations, [0., 0., 1.])
+        self.assertTrue(np.allclose(normals[0], np.array([2., 1., 0.]) / np.sqrt(5.)))
+        self.assertTrue(np.allclose(normals[1], [0., 0., -1.]))
+        self.assertTrue(np.allclose(normals[2], [0., 0., 1.]))
+
+    def testErrors(self):
+        instr = makeTubes()
+        instr.addComponent("missing")
+        instr.addLocation(instr.root[-1], 0., 0., 0.)
+        self.assertRaises(ValueError, expand, instr.model())
+
+
+class TestIterPixels(unittest.TestCase):
+    def testOrder(self):
+        instr = makeTubes(ids=(10, 24, 2))
+        instr.addRectangularDetector("panel", "pixel", -.1, .1, 3, -.05, .1, 2)
+        instr.addComponentRectangularDetector("panel", "0", "1", "2", idstart="11",
+                                              idfillbyfirst="x", idstepbyrow="6")
+        instr.root[-1].set("idstep", "2")  # odd ids between the even ones of the bank
+        component = instr.addComponent("bank", idlist="reversed")
+        instr.addLocation(component, 1., 0., 5.)
+        instr.addDetectorIds("reversed", [100, 93, -1])
+        model = instr.model()
+        chunks = list(iterPixels(model, chunk_size=5))
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 5, 5, 2])
+
+        pixels = ExpandedInstrument.concatenate(chunks)
+        self.assertEqual(pixels.ids.tolist(), list(range(10, 23)) + [24] + list(range(93, 101)))
+        expected = expand(model)
+        order = np.argsort(expected.ids, kind="stable")
+        self.assertEqual(pixels.paths.tolist(), expected.paths[order].tolist())
+        self.assertTrue(np.allclose(pixels.positions, expected.positions[order]))
+        self.assertEqual(set(pixels.types), {"pixel"})
+
+    def testSplit(self):
+        # one idlist for more pixels than a chunk is expanded a piece at a time
+        instr = makeTubes(ids=(10, 17, 1))
+        component = instr.addComponent("bank", idlist="reversed")
+        instr.addLocation(component, 1., 0., 5.)
+        instr.addLocation(component, 2., 0., 5.)
+        instr.addDetectorIds("reversed", [115, 100, -1])
+        model = instr.model()
+        expected = expand(model)
+        order = np.argsort(expected.ids, kind="stable")
+        for chunk_size in (3, 5, 8):
+            chunks = list(iterPixels(model, chunk_size=chunk_size))
+            self.assertTrue(all(len(chunk) == chunk_size for chunk in chunks[:-1]))
+            pixels = ExpandedInstrument.concatenate(chunks)
+            self.assertEqual(pixels.ids.tolist(), expected.ids[order].tolist())
+            self.assertEqual(pixels.paths.tolist(), expected.paths[order].tolist())
+            self.assertTrue(np.allclose(pixels.positions, expected.positions[order]))
+            self.assertTrue(np.allclose(pixels.rotations, expected.rotations[order]))
+
+
+class TestDetectorIndex(unittest.TestCase):
+    def testRoundTrip(self):
+        instr = makeTubes(ids=(10, 24, 2))
+        for i, fill in enumerate("xy"):
+            instr.addRectangularDetector("panel" + fill, "pixel", -.1, .1, 3, -.05, .1, 2)
+            instr.addComponentRectangularDetector("panel" + fill, "0", "1", "2",
+                                                  idstart=str(65536 * (i + 1)), idfillbyfirst=fill,
+                                                  idstepbyrow="100")
+        pair = instr.makeTypeElement("pair")  # tubes with an idlist in a type used twice
+        component = le.SubElement(pair, "component", type="tube", idlist="pairs")
+        instr.addLocation(component, 0., 0., 0., name="front")
+        instr.addLocation(component, 0., 0., .1, name="back")
+        component = instr.addComponent("pair")
+        instr.addLocation(component, 1., 0., 0., name="left")
+        instr.addLocation(component, -1., 0., 0., name="right")
+        instr.addDetectorIds("pairs", [1000, 1014, 1, 2000, 2000, 1])
+        model = instr.model()
+        self.assertEqual(instr.checkIds(), [])
+
+        index = DetectorIndex(model)
+        self.assertEqual(len(index), 1 + 1 + 1 + 2)
+        pixels = expand(model)
+        for detector_id, path in zip(pixels.ids.tolist(), pixels.paths.tolist()):
+            self.assertEqual(index.path(detector_id), path)
+            self.assertEqual(index.detectorId(path), detector_id)
+        self.assertEqual(index.locate(65536 * 2 + 101), [("panely", 0), ("panely(x=1)", 1), ("panely(1,1)", 1)])
+        self.assertEqual(index.locate(1013), [("right", 1), ("back", 1), ("pixel2", 1)])
+
+        self.assertRaises(KeyError, index.path, 11)
+        self.assertRaises(KeyError, index.detectorId, "bank/tube1")
+        self.assertRaises(KeyError, index.detectorId, "bank/tube9/pixel1")
+
+    def testNested(self):
+        # runs of ids inside the range of the bank's single run
+        instr = makeTubes(ids=(0, 70, 10))
+        component = instr.addComponent("pixel", idlist="inside")
+        for i in range(63):
+            instr.addLocation(component, 0., .01 * i, 1.)
+        instr.addDetectorIds("inside", sum([[start, start + 8, 1] for start in range(1, 70, 10)], []))
+        index = DetectorIndex(instr.model())
+        self.assertEqual(len(index), 1 + 7)
+        pixels = expand(instr.model())
+        self.assertEqual(sorted(pixels.ids.tolist()), list(range(71)))
+        for detector_id, path in zip(pixels.ids.tolist(), pixels.paths.tolist()):
+            self.assertEqual(index.path(detector_id), path)
+        self.assertRaises(KeyError, index.path, 71)
+
+
+if __name__ == "__main__":
+    unittest.main(module="idf_expand_test", verbosity=2)
@@ -0,0 +1,585 @@
+"""
+Array-backed model of an instrument definition. The types form a DAG in
+which each type places other types through ``Placement`` tables of the
+positions, rotations (quaternions) and names of their locations relative
+to it. The model is built from the XML of a ``MantidGeom`` (see
+``MantidGeom.model``) or read from an existing file with
+``InstrumentModel.fromFile`` so that questions about a geometry can be
+answered with numpy rather than by walking the XML again.
+
+The locations are read the way Mantid reads them: ``x/y/z`` or ``r/t/p``
+positions, the ``rot`` attribute followed by nested ``rot`` and ``trans``
+elements, ``locations`` ranges and ``facing``.
+"""
+from __future__ import print_function
+
+import copy
+import math
+import numpy as np
+from lxml import etree as le
+import quaternion
+
+# children of a type that describe its components rather than its shape
+COMPONENT_TAGS = ("component", "properties")
+# location(s) children of a component, found by libxml2 as there can be one per pixel
+_NAMESPACES = {"idf": "http://www.mantidproject.org/IDF/1.0"}
+_countLocations = le.XPath("count(location | idf:location)", namespaces=_NAMESPACES)
+_findLocations = le.XPath("locations | idf:locations", namespaces=_NAMESPACES)
+
+
+def _localName(element):
+    """
+    Tag of an element without the namespace.
+    """
+    return element.tag.rpartition("}")[2]
+
+
+def _children(element, name=None):
+    """
+    Child elements (no comments) with the given tag, ignoring namespaces.
+    """
+    return [child for child in element.iterchildren(le.Element)
+            if name is None or _localName(child) == name]
+
+
+def _readPosition(attrs, scale=1., suffix=""):
+    """
+    Position from x/y/z or, if any of them are there, r/t/p attributes.
+    Angles are multiplied by scale to make them degrees.
+    """
+    if "r" + suffix in attrs or "t" + suffix in attrs or "p" + suffix in attrs:
+        r = float(attrs.get("r" + suffix, 0.))
+        t = math.radians(float(attrs.get("t" + suffix, 0.)) * scale)
+        p = math.radians(float(attrs.get("p" + suffix, 0.)) * scale)
+        return (r * math.sin(t) * math.cos(p), r * math.sin(t) * math.sin(p), r * math.cos(t))
+    return (float(attrs.get("x" + suffix, 0.)), float(attrs.get("y" + suffix, 0.)),
+            float(attrs.get("z" + suffix, 0.)))
+
+
+def _readRotation(attrs, scale=1., key="rot"):
+    """
+    Quaternion of the rotation by the ``key`` attribute around the axis of
+    the axis-x/y/z attributes, z if they are missing.
+    """
+    axis = [float(attrs.get("axis-x", 0.)), float(attrs.get("axis-y", 0.)),
+            float(attrs.get("axis-z", 1.))]
+    return quaternion.fromAxisAngle(float(attrs[key]) * scale, axis)
+
+
+def _readLocation(attrs, element=None, scale=1.):
+    """
+    Position and rotation of a location (or neutronic) element: the rot
+    attribute followed by the nested rot and trans elements, where a trans
+    is in the rotated frame. attrs are the attributes of the element, which
+    is None for one of a locations element.
+    """
+    position = _readPosition(attrs, scale)
+    rotation = (1., 0., 0., 0.)  # quaternion.IDENTITY
+    if "rot" in attrs:
+        rotation = _readRotation(attrs, scale)
+    while element is not None and len(element):
+        element = next((child for child in _children(element)
+                        if _localName(child) in ("rot", "trans")), None)
+        if element is None:
+            break
+        if _localName(element) == "trans":
+            position = np.add(position, quaternion.rotate(rotation, _readPosition(element.attrib, scale)))
+        else:
+            rotation = quaternion.multiply(_readRotation(element.attrib, scale, "val"), rotation)
+    return position, rotation
+
+
+def _readLocations(locations, scale=1.):
+    """
+    Positions, rotations and names of the location elements that a
+    locations element stands for. Every attribute with an -end is stepped
+    in n-elements steps.
+    """
+    attrs = locations.attrib
+    num = int(attrs["n-elements"])
+    values = {}
+    for key in ("x", "y", "z", "r", "t", "p", "rot"):
+        start = float(attrs.get(key, 0.))
+        end = attrs.get(key + "-end")
+        values[key] = start if end is None else np.linspace(start, float(end), num)
+
+    if any(key in attrs for key in "rtp"):
+        t = np.radians(values["t"] * scale)
+        p = np.radians(values["p"] * scale)
+        r = values["r"]
+        xyz = [r * np.sin(t) * np.cos(p), r * np.sin(t) * np.sin(p), r * np.cos(t)]
+    else:
+        xyz = [values[axis] for axis in "xyz"]
+    positions = np.stack([np.broadcast_to(column, (num,)) for column in xyz], axis=-1)
+    rotations = np.tile(quaternion.IDENTITY, (num, 1))
+    if "rot" in attrs:
+        axis = [float(attrs.get("axis-x", 0.)), float(attrs.get("axis-y", 0.)),
+                float(attrs.get("axis-z", 1.))]
+        rotations[:] = quaternion.fromAxisAngle(values["rot"] * scale, axis)
+
+    name = attrs.get("name")
+    if name is None:
+        names = [None] * num
+    else:
+        start = int(attrs.get("name-count-start", 0))
+        step = int(attrs.get("name-count-increment", 1))
+        names = [name + str(start + i * step) for i in range(num)]
+    return positions, rotations, names
+
+
+class Placement(object):
+    """
+    The locations of one component element: the type that is placed, the
+    positions (N x 3), rotations (N x 4 quaternions) and names of the
+    locations relative to the enclosing type, and the points they face
+    (N x 3, nan for none). ``attrs`` are the other attributes of the
+    component element such as idlist or idstart. ``neutronic`` are the
+    neutronic positions (N x 3, nan where there is none) or None.
+    """
+
+    def __init__(self, type_name, positions, rotations, names, facing=None, attrs=None,
+                 neutronic=None):
+        self.type_name = type_name
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        self.rotations = np.asarray(rotations, dtype=float).reshape(-1, 4)
+        self.names = list(names)
+        if facing is None:
+            facing = np.full(self.positions.shape, np.nan)
+        self.facing = np.asarray(facing, dtype=float).reshape(-1, 3)
+        self.attrs = dict(attrs or {})
+        self.neutronic = None
+        if neutronic is not None:
+            self.neutronic = np.asarray(neutronic, dtype=float).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @classmethod
+    def fromElement(cls, component, defaults):
+        """
+        Read a component element, the defaults are those of InstrumentModel.
+        """
+        scale = defaults["angle_scale"]
+        attrs = dict(component.attrib)
+        type_name = attrs.pop("type")
+        default_name = attrs.get("name", type_name)
+        positions, rotations, facing, neutronic, names = [], [], [], [], []
+        nowhere = (np.nan, np.nan, np.nan)
+        default_facing = tuple(defaults["facing"])
+        for child in _children(component):
+            tag = _localName(child)
+            if tag == "locations":
+                block = _readLocations(child, scale)
+                positions.extend(block[0].tolist())
+                rotations.extend(block[1].tolist())
+                names.extend([default_name if name is None else name for name in block[2]])
+                facing.extend([default_facing] * len(block[0]))
+                neutronic.extend([nowhere] * len(block[0]))
+                continue
+            elif tag != "location":
+                continue
+            names.append(child.get("name", default_name))
+            position, rotation = _readLocation(child.attrib, child, scale)
+            neutronic_position = nowhere
+            facing_position = default_facing
+            for elem in (_children(child) if len(child) else ()):
+                if _localName(elem) == "neutronic":
+                    neutronic_position = _readLocation(elem.attrib, elem, scale)[0]
+                elif _localName(elem) == "facing":
+                    if "rot" in elem.attrib:  # around z before facing
+                        angle = float(elem.get("rot")) * scale
+                        rotation = quaternion.multiply(quaternion.fromAxisAngle(angle, (0., 0., 1.)),
+                                                       rotation)
+                    if "val" in elem.attrib:  # val="none" turns the default off
+                        facing_position = nowhere
+                    else:
+                        facing_position = _readPosition(elem.attrib, scale)
+            positions.append(position)
+            rotations.append(rotation)
+            facing.append(facing_position)
+            neutronic.append(neutronic_position)
+
+        if not positions:  # Mantid places a component without locations at the origin
+            names.append(default_name)
+            positions.append((0., 0., 0.))
+            rotations.append((1., 0., 0., 0.))
+            facing.append(default_facing)
+        neutronic = np.array(neutronic, dtype=float).reshape(-1, 3)
+        if np.isnan(neutronic).all():
+            neutronic = None
+        return cls(type_name, positions, rotations, names, facing, attrs, neutronic)
+
+
+class PlacementCount(object):
+    """
+    The type and attributes of a component element and the number of
+    locations it has, read without working out where they are. This is all
+    that counting the detectors needs (see InstrumentModel.checkIdLists).
+    """
+
+    def __init__(self, type_name, count, attrs=None):
+        self.type_name = type_name
+        self.count = count
+        self.attrs = dict(attrs or {})
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def fromElement(cls, component, defaults=None):
+        attrs = dict(component.attrib)
+        type_name = attrs.pop("type")
+        count = int(_countLocations(component))
+        for locations in _findLocations(component):
+            count += int(locations.get("n-elements"))
+        return cls(type_name, max(count, 1), attrs)  # no locations is one at the origin
+
+
+class TypeDef(object):
+    """
+    A type element: its name, what it ``is`` in lower case (None for an
+    assembly), its other attributes, the placements of the types it is
+    made of and copies of the elements describing its shape.
+    """
+
+    def __init__(self, name, kind=None, attrs=None, placements=None, shapes=None):
+        self.name = name
+        self.kind = kind
+        self.attrs = dict(attrs or {})
+        self.placements = list(placements or [])
+        self.shapes = list(shapes or [])
+
+    @property
+    def isDetector(self):
+        return self.kind == "detector"
+
+    @property
+    def isMonitor(self):
+        return self.kind == "monitor"
+
+    @property
+    def isRectangular(self):
+        return self.kind == "rectangular_detector"
+
+    @property
+    def primitive(self):
+        """
+        (tag, parameters) of the first cylinder, cuboid or sphere of the
+        shape and (None, None) if there isn't one. The parameters are
+        numpy arrays and floats in the frame of the type: ``base``,
+        ``axis`` (a unit vector), ``radius`` and ``height`` for a
+        cylinder, ``origin`` (the left-front-bottom point) and ``edges``
+        (the rows are the edges to the right, top and back points) for a
+        cuboid and ``centre`` and ``radius`` for a sphere.
+        """
+        for shape in self.shapes:
+            tag = _localName(shape)
+            if tag == "cylinder":
+                axis = np.array(_readPosition(_children(shape, "axis")[0].attrib))
+                bases = _children(shape, "centre-of-bottom-base")
+                return tag, {"base": np.array(_readPosition(bases[0].attrib) if bases else (0., 0., 0.)),
+                             "axis": axis / np.linalg.norm(axis),
+                             "radius": float(_children(shape, "radius")[0].get("val")),
+                             "height": float(_children(shape, "height")[0].get("val"))}
+            elif tag == "cuboid":
+                corners = {_localName(point): np.array(_readPosition(point.attrib))
+                           for point in _children(shape)}
+                origin = corners["left-front-bottom-point"]
+                edges = [corners[name] - origin for name in
+                         ("right-front-bottom-point", "left-front-top-point", "left-back-bottom-point")]
+                return tag, {"origin": origin, "edges": np.array(edges)}
+            elif tag == "sphere":
+                centres = _children(shape, "centre")
+                return tag, {"centre": np.array(_readPosition(centres[0].attrib) if centres else (0., 0., 0.)),
+                             "radius": float(_children(shape, "radius")[0].get("val"))}
+        return None, None
+
+    def projectedArea(self, directions):
+        """
+        Area of the shape seen from the directions (N x 3, unit vectors in
+        the frame of the type). Cylinders, cuboids and spheres are
+        understood, the area is nan for other shapes.
+        """
+        directions = np.asarray(directions, dtype=float)
+        tag, shape = self.primitive
+        if tag == "cylinder":
+            radius, height = shape["radius"], shape["height"]
+            cosine = np.abs(directions.dot(shape["axis"]))
+            sine = np.sqrt(np.maximum(1. - cosine * cosine, 0.))
+            return 2. * radius * height * sine + np.pi * radius * radius * cosine
+        elif tag == "cuboid":
+            edges = shape["edges"]
+            # opposite faces hide each other
+            faces = [np.cross(edges[1], edges[2]), np.cross(edges[0], edges[2]),
+                     np.cross(edges[0], edges[1])]
+            return sum(np.abs(directions.dot(face)) for face in faces)
+        elif tag == "sphere":
+            return np.full(len(directions), np.pi * shape["radius"] ** 2)
+        return np.full(len(directions), np.nan)
+
+    def boundingBox(self):
+        """
+        Lowest and highest corners of the box around the shape in the
+        frame of the type, None if the shape isn't understood.
+        """
+        tag, shape = self.primitive
+        if tag == "cylinder":
+            axis = shape["axis"]
+            ends = np.array([shape["base"], shape["base"] + shape["height"] * axis])
+            extent = shape["radius"] * np.sqrt(np.maximum(1. - axis * axis, 0.))
+            return ends.min(axis=0) - extent, ends.max(axis=0) + extent
+        elif tag == "cuboid":
+            corners = shape["origin"] + np.array([[i, j, k] for i in (0, 1) for j in (0, 1)
+                                                  for k in (0, 1)]).dot(shape["edges"])
+            return corners.min(axis=0), corners.max(axis=0)
+        elif tag == "sphere":
+            return shape["centre"] - shape["radius"], shape["centre"] + shape["radius"]
+        return None
+
+    @classmethod
+    def fromElement(cls, type_element, defaults, positions=True):
+        """
+        Read a type element. Without positions the placements are
+        PlacementCounts and the shape is left out.
+        """
+        attrs = dict(type_element.attrib)
+        name = attrs.pop("name")
+        kind = attrs.pop("is", None)
+        placements = []
+        shapes = []
+        for child in _children(type_element):
+            if _localName(child) == "component":
+                placements.append((Placement if positions else PlacementCount).fromElement(child, defaults))
+            elif positions and _localName(child) not in COMPONENT_TAGS:
+                shapes.append(copy.deepcopy(child))
+        return cls(name, kind.lower() if kind else None, attrs, placements, shapes)
+
+
+def readIdList(idlist):
+    """
+    All of the IDs of an idlist element in order.
+    """
+    ids = []
+    for elem in _children(idlist, "id"):
+        if elem.get("val") is not None:
+            ids.append([int(elem.get("val"))])
+        else:
+            step = int(elem.get("step", 1))
+            ids.append(np.arange(int(elem.get("start")), int(elem.get("end")) + step, step))
+    return np.concatenate(ids).astype(np.int64) if ids else np.empty(0, dtype=np.int64)
+
+
+def readDefaults(defaults_element=None):
+    """
+    The settings of a defaults element that matter for the positions.
+    """
+    defaults = {"angle_scale": 1., "facing": np.full(3, np.nan), "indirect": False,
+                "along_beam": "z", "pointing_up": "y"}
+    if defaults_element is None:
+        return defaults
+    for child in _children(defaults_element):
+        tag = _localName(child)
+        if tag == "angle" and child.get("unit") == "radian":
+            defaults["angle_scale"] = 180. / math.pi
+        elif tag == "components-are-facing":
+            defaults["facing"] = _readPosition(child.attrib, defaults["angle_scale"])
+        elif tag == "indirect-neutronic-positions":
+            defaults["indirect"] = True
+        elif tag == "reference-frame":
+            for axis in _children(child):
+                if _localName(axis) in ("along-beam", "pointing-up"):
+                    defaults[_localName(axis).replace("-", "_")] = axis.get("axis")
+    return defaults
+
+
+def _leafCount(typedef, counts, types):
+    """
+    Number of detectors and monitors in one instance of the type.
+    """
+    if typedef.name in counts:
+        return counts[typedef.name]
+    counts[typedef.name] = None  # to spot cycles
+    if typedef.kind in ("detector", "monitor"):
+        count = 1
+    elif typedef.isRectangular:
+        count = int(typedef.attrs["xpixels"]) * int(typedef.attrs["ypixels"])
+    else:
+        count = 0
+        for placement in typedef.placements:
+            count += len(placement) * _placedCount(placement, counts, types)
+    counts[typedef.name] = count
+    return count
+
+
+def _placedCount(placement, counts, types):
+    try:
+        typedef = types[placement.type_name]
+    except KeyError:
+        raise ValueError("Type '%s' is not defined" % placement.type_name)
+    if counts.get(typedef.name, 0) is None:
+        raise ValueError("Type '%s' contains itself" % typedef.name)
+    return _leafCount(typedef, counts, types)
+
+
+class InstrumentModel(object):
+    """
+    Types by name, the top-level component placements, the idlists as
+    arrays of IDs and the defaults (see readDefaults).
+    """
+
+    def __init__(self, name, defaults=None):
+        self.name = name
+        self.defaults = readDefaults() if defaults is None else defaults
+        self.types = {}
+        self.components = []
+        self.idlists = {}
+
+    def addType(self, typedef):
+        self.types[typedef.name] = typedef
+
+    def addComponent(self, placement):
+        self.components.append(placement)
+
+    def addIdList(self, name, ids):
+        self.idlists[name] = np.asarray(ids, dtype=np.int64)
+
+    def detectorCounts(self):
+        """
+        Number of detectors and monitors in one instance of each type. Each
+        type is counted once, so this is cheap however many pixels there are.
+        """
+        counts = {}
+        for typedef in self.types.values():
+            _leafCount(typedef, counts, self.types)
+        return counts
+
+    def instanceCounts(self):
+        """
+        Number of times each type appears in the instrument.
+        """
+        users = {name: [] for name in self.types}
+        for typedef in self.types.values():
+            for placement in typedef.placements:
+                users.setdefault(placement.type_name, []).append((typedef.name, len(placement)))
+        for placement in self.components:
+            users.setdefault(placement.type_name, []).append((None, len(placement)))
+
+        instances = {None: 1}
+
+        def count(name):
+            if name not in instances:
+                instances[name] = sum(count(user) * num for user, num in users.get(name, []))
+            return instances[name]
+        for name in self.types:
+            count(name)
+        del instances[None]
+        return instances
+
+    def checkIdLists(self):
+        """
+        Compare the idlists with the number of detectors under the
+        components that use them and look for ids that are in more than
+        one idlist or repeated in one. Returns a list of the problems found.
+        """
+        owners = [(None, placement) for placement in self.components]
+        owners += [(typedef.name, placement) for typedef in self.types.values()
+                   for placement in typedef.placements]
+        missing = sorted(set(placement.type_name for _, placement in owners) - set(self.types))
+        if missing:  # nothing can be counted
+            return ["type '%s' is not defined" % name for name in missing]
+        counts = self.detectorCounts()
+        instances = self.instanceCounts()
+        problems = []
+        for owner, placement in owners:
+            idname = placement.attrs.get("idlist")
+            if idname is None:
+                continue
+            where = "component '%s'" % placement.type_name
+            if owner is not None:
+                where += " in type '%s'" % owner
+            if idname not in self.idlists:
+                problems.append("%s uses idlist '%s' which is not defined" % (where, idname))
+                continue
+            expected = (1 if owner is None else instances[owner]) * len(placement) \
+                * _placedCount(placement, counts, self.types)
+            size = len(self.idlists[idname])
+            if size != expected:
+                problems.append("idlist '%s' has %d ids but %s has %d detectors"
+                                % (idname, size, where, expected))
+
+        # ids that are in more than one idlist
+        names = sorted(self.idlists)
+        if names:
+            ids = np.concatenate([self.idlists[name] for name in names])
+            which = np.repeat(np.arange(len(names)), [len(self.idlists[name]) for name in names])
+            order = np.argsort(ids, kind="stable")
+            ids, which = ids[order], which[order]
+            overlaps = {}
+            for index in np.flatnonzero(ids[1:] == ids[:-1]):
+                pair = (names[which[index]], names[which[index + 1]])
+                overlaps.setdefault(pair, []).append(ids[index])
+            for (first, second), shared in sorted(overlaps.items()):
+                if first == second:
+                    problems.append("idlist '%s' repeats %d ids starting at %d"
+                                    % (first, len(shared), min(shared)))
+                else:
+                    problems.append("idlists '%s' and '%s' share %d ids starting at %d"
+                                    % (first, second, len(shared), min(shared)))
+        return problems
+
+    def addElement(self, element, positions=True):
+        """
+        Add a child element of the instrument element to the model.
+        """
+        tag = _localName(element)
+        if tag == "defaults":
+            self.defaults = readDefaults(element)
+        elif tag == "type":
+            self.addType(TypeDef.fromElement(element, self.defaults, positions))
+        elif tag == "component":
+            self.addComponent((Placement if positions else PlacementCount).fromElement(element, self.defaults))
+        elif tag == "idlist":
+            self.addIdList(element.get("idname"), readIdList(element))
+
+    @classmethod
+    def fromElement(cls, root, positions=True):
+        """
+        Build the model of an instrument element. Without positions only
+        the number of locations of each component is read (see
+        PlacementCount), which is enough for checkIdLists and takes time
+        in proportion to the number of elements rather than of pixels.
+        """
+        model = cls(root.get("name"))
+        for element in _children(root):
+            model.addElement(element, positions)
+        return model
+
+    @classmethod
+    def fromFile(cls, filename):
+        """
+        Build the model of an instrument definition file. The file is parsed
+        incrementally and each top-level element is released once it is in
+        the model, so only one type or component is in memory at a time.
+        """
+        model = None
+        depth = 0
+        for event, element in le.iterparse(filename, events=("start", "end"),
+                                           remove_comments=True, huge_tree=True):
+            if event == "start":
+                if depth == 0:
+                    model = cls(element.get("name"))
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                model.addElement(element)
+                for child in element:  # much faster than clearing a big subtree at once
+                    child.clear()
+                element.clear()
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+        if model is None:
+            raise RuntimeError("No instrument in '%s'" % filename)
+        return model
+
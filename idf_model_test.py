@@ -0,0 +1,137 @@
+#!/bin/env python
+from helper import MantidGeom
+from idf_model import InstrumentModel
+from lxml import etree as le
+from quaternion import fromAxisAngle
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestInstrumentModel(unittest.TestCase):
+    def build(self):
+        instr = MantidGeom("TEST")
+        instr.addSnsDefaults()
+        instr.addPixelatedTube("tube", 4, 1.)
+        instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .25)
+        bank = instr.makeTypeElement("bank")
+        component = le.SubElement(bank, "component", type="tube")
+        instr.addLocation(component, .1, 0., 0., rot_y=90., name="tube1")
+        instr.addLocationPolar(component, 2., 90., 0., name="tube2")
+        component = instr.addComponent("bank", idlist="bank")
+        instr.addLocation(component, 0., 0., 5.)
+        instr.addDetectorIds("bank", [0, 7, 1])
+        return instr
+
+    def testModel(self):
+        model = self.build().model()
+        self.assertEqual(sorted(model.types), ["bank", "pixel", "tube"])
+        self.assertTrue(model.types["pixel"].isDetector)
+        self.assertEqual(len(model.types["pixel"].shapes), 2)  # cylinder and algebra
+
+        tube = model.types["tube"].placements[0]
+        self.assertEqual(tube.names, ["pixel1", "pixel2", "pixel3", "pixel4"])
+        self.assertTrue(np.allclose(tube.positions[:, 1], [-.375, -.125, .125, .375]))
+        self.assertTrue(np.isnan(tube.facing).all())
+
+        tubes = model.types["bank"].placements[0]
+        self.assertEqual(tubes.names, ["tube1", "tube2"])
+        self.assertTrue(np.allclose(tubes.positions, [[.1, 0., 0.], [2., 0., 0.]]))
+        self.assertTrue(np.allclose(abs(tubes.rotations[0]).dot(fromAxisAngle(90., (0, 1, 0))), 1.))
+        self.assertTrue(np.allclose(tubes.rotations[1], [1., 0., 0., 0.]))
+
+        self.assertEqual(model.components[0].attrs, {"idlist": "bank"})
+        self.assertEqual(model.idlists["bank"].tolist(), list(range(8)))
+
+    def testNamespaced(self):
+        root = le.fromstring(le.tostring(self.build().root))
+        self.assertTrue(root.tag.startswith("{"))
+        model = InstrumentModel.fromElement(root)
+        self.assertEqual(sorted(model.types), ["bank", "pixel", "tube"])
+        self.assertEqual(len(model.types["tube"].placements[0]), 4)
+
+    def testNestedAndFacing(self):
+        root = le.fromstring(
+            '<instrument name="TEST"><defaults><angle unit="radian"/>'
+            '<components-are-facing x="0" y="0" z="0"/></defaults>'
+            '<component type="a"><location x="1" rot="1.5707963267948966" axis-x="0" axis-y="1" axis-z="0">'
+            '<trans x="1"/></location><location><facing val="none"/></location></component>'
+            '</instrument>')
+        placement = InstrumentModel.fromElement(root).components[0]
+        self.assertTrue(np.allclose(placement.positions[0], [1., 0., -1.]))  # trans is rotated
+        self.assertTrue(np.allclose(placement.facing[0], 0.))
+        self.assertTrue(np.isnan(placement.facing[1]).all())
+
+    def testBoundingBox(self):
+        instr = self.build()
+        instr.addCuboidPixel("square", (-.01, -.01, 0.), (-.01, .01, 0.), (-.01, -.01, .005), (.01, -.01, 0.))
+        model = instr.model()
+        low, high = model.types["pixel"].boundingBox()
+        self.assertTrue(np.allclose(low, [-.01, 0., -.01]))
+        self.assertTrue(np.allclose(high, [.01, .25, .01]))
+        low, high = model.types["square"].boundingBox()
+        self.assertTrue(np.allclose(low, [-.01, -.01, 0.]))
+        self.assertTrue(np.allclose(high, [.01, .01, .005]))
+        self.assertIsNone(model.types["tube"].boundingBox())
+
+
+class TestCheckIds(unittest.TestCase):
+    def testCounts(self):
+        instr = TestInstrumentModel().build()
+        model = instr.model()
+        self.assertEqual(model.detectorCounts(), {"pixel": 1, "tube": 4, "bank": 8})
+        self.assertEqual(model.instanceCounts(), {"pixel": 8, "tube": 2, "bank": 1})
+        self.assertEqual(instr.checkIds(), [])
+
+    def testCountOnly(self):
+        instr = TestInstrumentModel().build()
+        instr.addPixelatedTube("compact", 5, 1.)
+        for root in (instr.root, le.fromstring(le.tostring(instr.root))):  # without and with namespace
+            full = InstrumentModel.fromElement(root)
+            counted = InstrumentModel.fromElement(root, positions=False)
+            self.assertEqual(counted.detectorCounts(), full.detectorCounts())
+            self.assertEqual(counted.instanceCounts(), full.instanceCounts())
+            self.assertEqual(len(counted.types["compact"].placements[0]), 5)
+            self.assertEqual(counted.types["pixel"].shapes, [])
+
+    def testProblems(self):
+        instr = TestInstrumentModel().build()
+        instr.addComponent("tube", idlist="tube")
+        instr.addDetectorIds("tube", [5, 9, 1])
+        instr.addComponent("pixel", idlist="missing")
+        self.assertEqual(instr.checkIds(),
+                         ["idlist 'tube' has 5 ids but component 'tube' has 4 detectors",
+                          "component 'pixel' uses idlist 'missing' which is not defined",
+                          "idlists 'bank' and 'tube' share 3 ids starting at 5"])
+
+
+class TestFromFile(unittest.TestCase):
+    def setUp(self):
+        self.direc = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.direc)
+
+    def testMatchesModel(self):
+        instr = TestInstrumentModel().build()
+        instr.addPixelatedTube("ntube", 3, .3, neutronic=True, neutronicIsPhysical=True)
+        filename = os.path.join(self.direc, "TEST_Definition.xml")
+        instr.writeGeom(filename)
+        model = InstrumentModel.fromFile(filename)
+        expected = instr.model()
+        self.assertEqual(sorted(model.types), sorted(expected.types))
+        for name, typedef in expected.types.items():
+            for placement, other in zip(typedef.placements, model.types[name].placements):
+                self.assertEqual(placement.names, other.names)
+                self.assertTrue(np.allclose(placement.positions, other.positions))
+                self.assertTrue(np.allclose(placement.rotations, other.rotations))
+        self.assertEqual(model.idlists["bank"].tolist(), list(range(8)))
+        neutronic = model.types["ntube"].placements[0].neutronic
+        self.assertTrue(np.allclose(neutronic[:, 1], [-.1, 0., .1]))
+        self.assertIsNone(model.types["tube"].placements[0].neutronic)
+
+
+if __name__ == "__main__":
+    unittest.main(module="idf_model_test", verbosity=2)
@@ -0,0 +1,163 @@
+"""
+Neighbours of the pixels of an instrument, for peak finding and
+smoothing. ``topological`` uses the tube and pack structure that
+addPixelatedTube, addNPack and friends build (or the columns of a
+rectangular detector) and ``metric`` the distance between the absolute
+positions. Both return a ``NeighbourIndex`` of CSR arrays keyed by
+detector id.
+"""
+from __future__ import print_function
+
+import numpy as np
+from idf_expand import expand
+
+HAS_SCIPY = True
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    HAS_SCIPY = False
+
+
+class NeighbourIndex(object):
+    """
+    The neighbours of each detector as CSR arrays: the sorted detector
+    ``ids``, ``offsets`` into ``neighbours`` (one longer than ids) and the
+    ``neighbours`` ids themselves, sorted for each detector.
+    """
+
+    def __init__(self, ids, offsets, neighbours):
+        self.ids = ids
+        self.offsets = offsets
+        self.neighbours = neighbours
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, detector_id):
+        """
+        The neighbours of a detector.
+        """
+        index = np.searchsorted(self.ids, detector_id)
+        if index == len(self.ids) or self.ids[index] != detector_id:
+            raise KeyError("Detector id %d is not in the index" % detector_id)
+        return self.neighbours[self.offsets[index]:self.offsets[index + 1]]
+
+    @classmethod
+    def fromPairs(cls, ids, first, second):
+        """
+        Build the index of the detectors with the ids from the pairs of
+        neighbours given as indices into ids, in either or both directions.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        first, second = ids[np.concatenate((first, second))], ids[np.concatenate((second, first))]
+        order = np.lexsort((second, first))
+        first, second = first[order], second[order]
+        keep = np.concatenate(([True], (first[1:] != first[:-1]) | (second[1:] != second[:-1])))
+        keep &= first != second
+        first, second = first[keep], second[keep]
+        unique_ids = np.unique(ids)
+        offsets = np.append(np.searchsorted(first, unique_ids), len(first))
+        return cls(unique_ids, offsets, second)
+
+
+def _pixels(source):
+    """
+    Detectors with ids from an ExpandedInstrument or InstrumentModel.
+    """
+    pixels = source if hasattr(source, "positions") else expand(source)
+    return pixels[(pixels.ids >= 0) & ~pixels.monitors]
+
+
+def _runs(labels):
+    """
+    Number of each run of equal labels and the position in the run.
+    """
+    starts = np.flatnonzero(np.concatenate(([True], labels[1:] != labels[:-1])))
+    lengths = np.diff(np.append(starts, len(labels)))
+    run = np.repeat(np.arange(len(starts)), lengths)
+    return run, np.arange(len(labels)) - starts[run], starts, lengths
+
+
+def topological(source, along=1, across=1):
+    """
+    Neighbours within along pixels in the same tube and in the tubes up to
+    across away in the same pack (at up to along pixels from the same
+    place in them). A tube is the component the pixels are in and a pack
+    the one the tubes are in, so the columns of a rectangular detector are
+    tubes and the detector the pack. source is an ExpandedInstrument or
+    InstrumentModel.
+    """
+    pixels = _pixels(source)
+    parents = pixels.parents
+    tube, pixel, tube_starts, tube_lengths = _runs(parents)
+    packs = np.array([path.rpartition("/")[0] for path in parents[tube_starts]])
+    pack = _runs(packs)[0]
+
+    first, second = [], []
+    for tube_step in range(0, across + 1):
+        for pixel_step in range(-along, along + 1):
+            if tube_step == 0 and pixel_step <= 0:
+                continue  # each pair once
+            other_tube = tube + tube_step
+            other_pixel = pixel + pixel_step
+            valid = other_tube < len(tube_starts)
+            other_tube = np.where(valid, other_tube, 0)
+            valid &= pack[other_tube] == pack[tube]
+            valid &= (other_pixel >= 0) & (other_pixel < tube_lengths[other_tube])
+            first.append(np.flatnonzero(valid))
+            second.append(tube_starts[other_tube[valid]] + other_pixel[valid])
+    return NeighbourIndex.fromPairs(pixels.ids, np.concatenate(first), np.concatenate(second))
+
+
+def _gridPairs(positions, radius):
+    """
+    Pairs of points closer than radius, by binning them into cubes with
+    sides of radius and comparing each cube with itself and the
+    neighbouring ones.
+    """
+    cells = np.floor((positions - positions.min(axis=0)) / radius).astype(np.int64) + 1
+    if cells.max() >= 2**20:
+        raise ValueError("radius %g is too small for the size of the instrument" % radius)
+    keys = (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+    order = np.argsort(keys, kind="stable")
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    cell_coords = np.stack([cell_keys >> 42, (cell_keys >> 21) & (2**21 - 1), cell_keys & (2**21 - 1)], axis=-1)
+
+    first, second = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                if (dx, dy, dz) < (0, 0, 0):
+                    continue  # each pair of cells once
+                other = cell_coords + (dx, dy, dz)
+                other_keys = (other[:, 0] << 42) | (other[:, 1] << 21) | other[:, 2]
+                match = np.searchsorted(cell_keys, other_keys)
+                match = np.minimum(match, len(cell_keys) - 1)
+                cell = np.flatnonzero(cell_keys[match] == other_keys)
+                match = match[cell]
+                sizes = counts[cell] * counts[match]
+                pair = np.repeat(np.arange(len(cell)), sizes)
+                local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+                a = order[starts[cell][pair] + local // counts[match][pair]]
+                b = order[starts[match][pair] + local % counts[match][pair]]
+                keep = np.linalg.norm(positions[a] - positions[b], axis=-1) <= radius
+                if (dx, dy, dz) == (0, 0, 0):
+                    keep &= a < b
+                first.append(a[keep])
+                second.append(b[keep])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def metric(source, radius):
+    """
+    Neighbours within the radius (metres) of the absolute positions, with
+    a KD-tree if scipy is installed. source is an ExpandedInstrument or
+    InstrumentModel.
+    """
+    pixels = _pixels(source)
+    if HAS_SCIPY:
+        pairs = cKDTree(pixels.positions).query_pairs(radius, output_type="ndarray")
+        first, second = pairs[:, 0], pairs[:, 1]
+    else:
+        first, second = _gridPairs(pixels.positions, radius)
+    return NeighbourIndex.fromPairs(pixels.ids, first, second)
@@ -0,0 +1,53 @@
+#!/bin/env python
+from helper import MantidGeom
+from idf_expand import expand
+import idf_neighbours
+from idf_neighbours import NeighbourIndex, metric, topological
+import numpy as np
+import unittest
+
+
+def makePacks():
+    instr = MantidGeom("TEST")
+    instr.addSnsDefaults()
+    instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .1)
+    instr.addPixelatedTube("tube", 4, .4)
+    instr.addNPack("pack", 3, .02, .001)
+    component = instr.addComponent("pack", idlist="packs")
+    instr.addLocation(component, 0., 0., 2., name="left")
+    instr.addLocation(component, .0625, 0., 2., name="right")  # touching the left pack
+    instr.addDetectorIds("packs", [1, 24, 1])
+    return instr
+
+
+class TestNeighbours(unittest.TestCase):
+    def testTopological(self):
+        index = topological(makePacks().model())
+        self.assertEqual(len(index), 24)
+        self.assertEqual(index[1].tolist(), [2, 5, 6])
+        self.assertEqual(index[6].tolist(), [1, 2, 3, 5, 7, 9, 10, 11])
+        self.assertEqual(index[12].tolist(), [7, 8, 11])  # not the right pack
+        self.assertEqual(topological(makePacks().model(), along=2, across=0)[1].tolist(), [2, 3])
+        self.assertRaises(KeyError, index.__getitem__, 25)
+
+    def testMetric(self):
+        pixels = expand(makePacks().model())
+        scipy = idf_neighbours.HAS_SCIPY
+        try:
+            for has_scipy in sorted({False, scipy}):
+                idf_neighbours.HAS_SCIPY = has_scipy
+                index = metric(pixels, .021)
+                self.assertEqual(index[6].tolist(), [2, 10])
+                self.assertEqual(index[12].tolist(), [8, 16])  # across the gap between the packs
+        finally:
+            idf_neighbours.HAS_SCIPY = scipy
+
+    def testFromPairs(self):
+        index = NeighbourIndex.fromPairs([7, 3, 5], [0, 0, 1, 0], [1, 2, 0, 1])
+        self.assertEqual(index.ids.tolist(), [3, 5, 7])
+        self.assertEqual(index.offsets.tolist(), [0, 1, 2, 4])
+        self.assertEqual(index.neighbours.tolist(), [7, 7, 3, 5])
+
+
+if __name__ == "__main__":
+    unittest.main(module="idf_neighbours_test", verbosity=2)
@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+"""
+Spatial queries on the pixels of an instrument. ``RayCaster`` finds the
+pixel that each of a batch of directions from the sample hits, for
+mapping scattered directions (from a UB matrix and hkl for instance) to
+detector ids without searching all of the pixels. ``checkOverlaps``
+finds the tubes or banks that overlap each other, which can be run on
+a written file with
+
+    python idf_spatial.py VULCAN_Definition.xml --depth 2
+"""
+from __future__ import print_function
+
+import argparse
+import numpy as np
+from idf_expand import expand, kindPositions
+from idf_model import InstrumentModel
+import quaternion
+
+
+def _matrices(rotations):
+    """
+    Rotation matrices (N x 3 x 3) of quaternions.
+    """
+    return np.stack([quaternion.rotate(rotations, axis) for axis in np.eye(3)], axis=-1)
+
+
+def _inverse(directions):
+    """
+    Reciprocals of the components of directions for the slab test, with
+    the tiny ones made 1e-30 so that they don't give nan or overflow
+    single precision.
+    """
+    return 1. / np.where(np.abs(directions) < 1e-30, 1e-30, directions)
+
+
+def _slabRange(origins, inverse, low, high):
+    """
+    Distances along the rays to where they enter and leave the boxes from
+    low to high, the entry is more than the exit where they miss them.
+    """
+    low, high = np.broadcast_to(low, origins.shape), np.broadcast_to(high, origins.shape)
+    enter = np.zeros(len(origins))
+    leave = np.full(len(origins), np.inf)
+    for axis in range(3):  # a column at a time is much faster than reducing over rows of 3
+        near = (low[:, axis] - origins[:, axis]) * inverse[:, axis]
+        far = (high[:, axis] - origins[:, axis]) * inverse[:, axis]
+        enter = np.maximum(enter, np.minimum(near, far))
+        leave = np.minimum(leave, np.maximum(near, far))
+    return enter, leave
+
+
+def _slab(origins, inverse, low, high):
+    """
+    Distances along the rays to where they enter the boxes from low to
+    high, inf where they miss them.
+    """
+    enter, leave = _slabRange(origins, inverse, low, high)
+    return np.where(enter <= leave, enter, np.inf)
+
+
+def _cubeCells(directions, resolution):
+    """
+    Index of the cell of a grid of resolution x resolution on each face of
+    a cube around the origin that each direction goes through. The faces
+    are +x, -x, +y, -y, +z and -z, where the component along the axis is
+    the largest, and the cells are in steps of the other two over it.
+    """
+    rows = np.arange(len(directions))
+    axis = np.argmax(np.abs(directions), axis=1)
+    major = directions[rows, axis]
+    cells = 2 * axis + (major < 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for other in (1, 2):
+            steps = directions[rows, (axis + other) % 3] / np.abs(major)
+            steps = np.nan_to_num((steps + 1.) * (.5 * resolution))  # nan for no direction
+            cells = cells * resolution + np.clip(steps.astype(np.int64), 0, resolution - 1)
+    return cells
+
+
+def _cubeGrid(low, high, resolution):
+    """
+    The boxes from low to high (relative to the origin) that can be seen
+    through each cell of _cubeCells, as an index into the boxes for each
+    cell and where the ones of each cell start (like a CSR matrix). A box
+    takes the cells of the rectangle around its corners projected onto a
+    face after cutting off the part of it that is outside of that face,
+    which may be more cells than it covers but never less.
+    """
+    def nearest(low, high):  # closest to zero of each range
+        return np.where((low <= 0.) & (high >= 0.), 0., np.minimum(np.abs(low), np.abs(high)))
+
+    boxes, cells = [], []
+    for axis in range(3):
+        first, second = (axis + 1) % 3, (axis + 2) % 3
+        for face, sign in ((2 * axis, 1.), (2 * axis + 1, -1.)):
+            near, far = (low[:, axis], high[:, axis]) if sign > 0. else (-high[:, axis], -low[:, axis])
+            # the points seen through the face are at least as far along the axis as across it
+            near = np.maximum(near, np.maximum(nearest(low[:, first], high[:, first]),
+                                               nearest(low[:, second], high[:, second])))
+            seen = np.flatnonzero((far >= near) & (far > 0.))
+            near, far = near[seen], far[seen]
+            around = near <= 0.  # the box is around the origin
+            near = np.where(around, 1., near)
+            ranges = []
+            for other in (first, second):
+                steps = np.array([low[seen, other] / near, low[seen, other] / far,
+                                  high[seen, other] / near, high[seen, other] / far])
+                steps = np.where(around, [[-1.], [1.]], [steps.min(axis=0), steps.max(axis=0)])
+                steps = np.floor((np.clip(steps, -1., 1.) + 1.) * (.5 * resolution)).astype(np.int64)
+                ranges.append(np.clip(steps, 0, resolution - 1))
+            (u_start, u_end), (v_start, v_end) = ranges
+            widths = v_end - v_start + 1
+            counts = (u_end - u_start + 1) * widths
+            which = np.repeat(np.arange(len(seen)), counts)
+            offsets = np.arange(len(which)) - np.repeat(np.cumsum(counts) - counts, counts)
+            boxes.append(seen[which])
+            cells.append((face * resolution + u_start[which] + offsets // widths[which]) * resolution
+                         + v_start[which] + offsets % widths[which])
+
+    boxes, cells = np.concatenate(boxes), np.concatenate(cells)
+    order = np.argsort(cells, kind="stable")
+    starts = np.searchsorted(cells[order], np.arange(6 * resolution * resolution + 1))
+    return boxes[order], starts
+
+
+def _splitOrder(centres):
+    """
+    Order of the points in which each aligned block of 2**k of them is
+    split in half along the longest side of the box around them, so that
+    joining neighbours in pairs level by level builds a balanced tree.
+    """
+    count = len(centres)
+    order = np.arange(count)
+    size = 1
+    while size < count:
+        size *= 2
+    while size > 2:
+        block = np.arange(count) // size
+        points = centres[order]
+        starts = np.arange(0, count, size)
+        sides = np.maximum.reduceat(points, starts) - np.minimum.reduceat(points, starts)
+        key = points[np.arange(count), np.argmax(sides, axis=1)[block]]
+        order = order[np.lexsort((key, block))]
+        size //= 2
+    return order
+
+
+def _levels(low, high):
+    """
+    Corners of the boxes of a tree from the leaves (in the order of
+    _splitOrder) to the root, each level around pairs of boxes of the one
+    below it. Levels with an odd number of boxes get one of nan that
+    nothing overlaps, so that the children of box i are 2i and 2i + 1.
+    """
+    levels = []
+    while True:
+        if len(low) % 2 and len(low) > 1:
+            low, high = np.append(low, [[np.nan] * 3], axis=0), np.append(high, [[np.nan] * 3], axis=0)
+        levels.append((low, high))
+        if len(low) == 1:
+            return levels
+        low, high = np.fmin(low[0::2], low[1::2]), np.fmax(high[0::2], high[1::2])
+
+
+def _axisFrame(axis):
+    """
+    Rows of an orthonormal frame whose last axis is the unit vector axis.
+    """
+    other = np.eye(3)[np.argmin(np.abs(axis))]
+    first = np.cross(axis, other)
+    first /= np.linalg.norm(first)
+    return np.array([first, np.cross(axis, first), axis])
+
+
+def _shapeFrame(tag, shape):
+    """
+    (offset, matrix) taking points p in the frame of a primitive (see
+    TypeDef.primitive) to (p - offset).dot(matrix) in the one _hitShape
+    works in: fractions of the edges of a cuboid, from the centre of a
+    sphere and with the axis of a cylinder last.
+    """
+    if tag == "cuboid":
+        return shape["origin"], np.linalg.inv(shape["edges"])
+    elif tag == "sphere":
+        return shape["centre"], np.eye(3)
+    return shape["base"], _axisFrame(shape["axis"]).T
+
+
+def _hitShape(tag, shape, origins, directions):
+    """
+    Distances along the rays to where they hit the primitive, inf where
+    they miss it. The origins and directions are in the frame of
+    _shapeFrame as rows of x, y and z (3 x N).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if tag == "cuboid":
+            return _slab(origins.T, _inverse(directions.T), 0., 1.)
+        x, y, along = origins
+        dx, dy, step = directions
+        if tag == "sphere":
+            b = x * dx + y * dy + along * step
+            a = dx * dx + dy * dy + step * step
+            disc = b * b - a * (x * x + y * y + along * along - shape["radius"] ** 2)
+            distance = (-b - np.sqrt(disc)) / a
+            return np.where((disc >= 0.) & (distance >= 0.), distance, np.inf)
+
+        # cylinder: the side then the two ends
+        radius = shape["radius"]
+        a = dx * dx + dy * dy
+        b = x * dx + y * dy
+        disc = b * b - a * (x * x + y * y - radius * radius)
+        distance = (-b - np.sqrt(disc)) / a
+        height = along + distance * step
+        best = np.where((disc >= 0.) & (distance >= 0.) & (height >= 0.) & (height <= shape["height"]),
+                        distance, np.inf)
+        for level in (0., shape["height"]):
+            distance = (level - along) / step
+            end_x, end_y = x + distance * dx, y + distance * dy
+            hit = (distance >= 0.) & (end_x * end_x + end_y * end_y <= radius * radius)
+            best = np.where(hit & (distance < best), distance, best)
+        return best
+
+
+def _pixelBoxes(model):
+    """
+    The detectors with ids whose shape is understood (see
+    TypeDef.boundingBox) and the boxes around them: the centres in the
+    frame of the instrument, rotation matrices and half the sides.
+    """
+    pixels = expand(model)
+    pixels = pixels[(pixels.ids >= 0) & ~pixels.monitors]
+    select = np.zeros(len(pixels), dtype=bool)
+    centres = np.zeros((len(pixels), 3))
+    sizes = np.zeros((len(pixels), 3))
+    for name in np.unique(pixels.types):
+        box = model.types[name].boundingBox()
+        if box is None:
+            print("WARNING: pixels of type '{}' have no shape".format(name))
+            continue
+        of_type = pixels.types == name
+        select |= of_type
+        centres[of_type] = (box[0] + box[1]) / 2.
+        sizes[of_type] = (box[1] - box[0]) / 2.
+    pixels = pixels[select]
+    matrices = _matrices(pixels.rotations)
+    centres = pixels.positions + np.einsum("nij,nj->ni", matrices, centres[select])
+    return pixels, centres, matrices, sizes[select]
+
+
+class RayCaster(object):
+    """
+    Pixels hit by rays from a point, the sample by default. The components
+    one level above the pixels (tubes, or the rows of rectangular
+    detectors) are found first: the directions from the point are split
+    into cells on the faces of a cube around it, each with the components
+    whose boxes can be seen through it, and the rays are tested against
+    the oriented boxes of the components of their cells. The pixels of a
+    component are sorted along its longest side, so the ones between
+    where a ray goes in and out of its box are found from their spacing
+    (or by binary search where it isn't even) and tested exactly. Pixels whose shape isn't a cylinder, cuboid or sphere
+    are left out.
+    """
+
+    def __init__(self, model, origin=None, resolution=None):
+        """
+        The grid on each face of the cube is resolution cells square, by
+        default about the size of the components seen from the origin.
+        """
+        if origin is None:
+            samples = kindPositions(model, "samplepos")
+            origin = samples[0] if len(samples) else np.zeros(3)
+        self.origin = np.asarray(origin, dtype=float)
+        pixels, centres, matrices, sizes = _pixelBoxes(model)
+        names, types = np.unique(pixels.types, return_inverse=True)
+        self.__shapes = [model.types[name].primitive for name in names]
+        self.__shape_frames = [_shapeFrame(*primitive) for primitive in self.__shapes]
+        _, starts, frames, low, high, pixel_low, pixel_high = _componentFrames(pixels, centres, matrices, sizes)
+        counts = np.diff(np.append(starts, len(pixels)))
+        group = np.repeat(np.arange(len(starts)), counts)
+        corners = centres[starts]  # of the frames of the components
+
+        # the pixels of each component in order along its longest side
+        axis = np.argmax(high - low, axis=1)
+        along_low = pixel_low[np.arange(len(pixels)), axis[group]]
+        along_high = pixel_high[np.arange(len(pixels)), axis[group]]
+        order = np.lexsort((along_low, group))
+        self.pixels = pixels[order]
+        self.__types = types[order]
+        group, along_low, along_high = group[order], along_low[order], along_high[order]
+        # most components have evenly spaced pixels of one length, whose range takes no search
+        self.__starts, self.__counts = starts, counts
+        self.__first_low = along_low[starts]
+        self.__length = along_high[starts] - along_low[starts]
+        self.__pitch = np.ones(len(starts))
+        several = counts > 1
+        self.__pitch[several] = along_low[starts[several] + 1] - along_low[starts[several]]
+        expected = self.__first_low[group] + self.__pitch[group] * (np.arange(len(group)) - starts[group])
+        uneven = (np.abs(along_low - expected) > 1e-9) \
+            | (np.abs(along_high - along_low - self.__length[group]) > 1e-9)
+        self.__even = (self.__pitch > 0.) & (np.bincount(group, uneven, len(starts)) == 0)
+        for begin, count in zip(starts, counts):  # the furthest any pixel before reaches
+            along_high[begin:begin + count] = np.maximum.accumulate(along_high[begin:begin + count])
+        # where the origin is in the frame of the shape of each pixel, as rows of x, y and z, and
+        # how the pixels are turned in their component
+        matrices = matrices[order]
+        origins = np.einsum("nji,nj->ni", matrices, self.origin - self.pixels.positions)
+        for index, (offset, matrix) in enumerate(self.__shape_frames):
+            of_type = self.__types == index
+            origins[of_type] = (origins[of_type] - offset).dot(matrix)
+        self.__origins = np.ascontiguousarray(origins.T)
+        self.__relative = np.einsum("nji,njk->nik", frames[group], matrices)
+        self.__turned = np.abs(self.__relative - np.eye(3)).max(axis=(1, 2)) > 1e-9
+
+        # the boxes of the components padded to cover the rounding
+        pad = 1e-5 * (np.abs(corners - self.origin).max(axis=1) + (high - low).max(axis=1)) + 1e-9
+        low, high = low - pad[:, np.newaxis], high + pad[:, np.newaxis]
+        self.__frames = frames
+        self.__component_origins = np.einsum("nji,nj->ni", frames, self.origin - corners)
+        self.__low, self.__high = low, high
+        self.__axis = axis
+        self.__pad = pad
+        rows = np.arange(len(starts))
+        self.__key_start = low[rows, axis]
+        self.__key_scale = .5 / (high[rows, axis] - low[rows, axis])
+        self.__low_keys = self.__keys(group, along_low)
+        self.__reach_keys = self.__keys(group, along_high)
+
+        # the cells each component can be seen through
+        middles = corners + np.einsum("nij,nj->ni", frames, (low + high) / 2.) - self.origin
+        extents = np.einsum("nij,nj->ni", np.abs(frames), (high - low) / 2.)
+        if resolution is None:
+            sizes = extents.min(axis=1) / np.maximum(np.linalg.norm(middles, axis=1), 1e-9)
+            resolution = int(np.clip(1. / np.median(sizes), 8, 512)) if len(sizes) else 8
+        self.resolution = resolution
+        self.__components, self.__cells = _cubeGrid(middles - extents, middles + extents, resolution)
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def __keys(self, group, along):
+        """
+        Positions along the longest side of the components as one sorted
+        array: the index of the component plus the fraction of the way
+        along it, halved so that the components don't touch.
+        """
+        return group + np.clip((along - self.__key_start[group]) * self.__key_scale[group], 0., .5)
+
+    def cast(self, directions, chunk_size=16384):
+        """
+        Ids of the detectors hit first by rays in the directions (N x 3),
+        -1 for the rays that miss. The rays are cast chunk_size at a time.
+        """
+        directions = np.atleast_2d(np.asarray(directions, dtype=float))
+        if len(directions) > chunk_size:
+            return np.concatenate([self.cast(directions[start:start + chunk_size], chunk_size)
+                                   for start in range(0, len(directions), chunk_size)])
+        result = np.full(len(directions), -1, dtype=self.pixels.ids.dtype)
+        if not len(self.pixels):
+            return result
+
+        # the components seen through the cell of each ray
+        cells = _cubeCells(directions, self.resolution)
+        first = self.__cells[cells]
+        counts = self.__cells[cells + 1] - first
+        rays = np.repeat(np.arange(len(directions)), counts)
+        groups = self.__components[first[rays] + np.arange(len(rays)) - (np.cumsum(counts) - counts)[rays]]
+
+        # through the box of each component, in its frame (take is much faster than indexing rows)
+        local = np.einsum("nj,nji->ni", np.take(directions, rays, axis=0), np.take(self.__frames, groups, axis=0))
+        origins = np.take(self.__component_origins, groups, axis=0)
+        enter, leave = _slabRange(origins, _inverse(local), np.take(self.__low, groups, axis=0),
+                                  np.take(self.__high, groups, axis=0))
+        hit = np.flatnonzero(enter <= leave)
+        rays, groups = rays[hit], groups[hit]
+        local, origins = np.take(local, hit, axis=0), np.take(origins, hit, axis=0)
+        rows = np.arange(len(rays))
+        axis = self.__axis[groups]
+        ends = origins[rows, axis] + np.array((enter[hit], leave[hit])) * local[rows, axis]
+        pad = self.__pad[groups]
+        start, end = ends.min(axis=0) - pad, ends.max(axis=0) + pad
+
+        # the pixels of the component between them, pixel k of evenly spaced ones starting k pitches along
+        first_low, pitch, counts = self.__first_low[groups], self.__pitch[groups], self.__counts[groups]
+        first = np.clip(np.ceil((start - self.__length[groups] - first_low) / pitch), 0, counts)
+        last = np.clip(np.floor((end - first_low) / pitch) + 1., 0, counts)
+        first = first.astype(np.int64) + self.__starts[groups]
+        last = last.astype(np.int64) + self.__starts[groups]
+        uneven = np.flatnonzero(~self.__even[groups])
+        if len(uneven):
+            first[uneven] = np.searchsorted(self.__reach_keys, self.__keys(groups[uneven], start[uneven]), "left")
+            last[uneven] = np.searchsorted(self.__low_keys, self.__keys(groups[uneven], end[uneven]), "right")
+        counts = np.maximum(last - first, 0)
+        pairs = np.repeat(rows, counts)
+        nodes = first[pairs] + np.arange(len(pairs)) - (np.cumsum(counts) - counts)[pairs]
+        rays = rays[pairs]
+
+        # exactly, in the frame of each pixel
+        local = np.take(local, pairs, axis=0)
+        turned = np.flatnonzero(self.__turned[nodes])
+        if len(turned):
+            local[turned] = np.einsum("nji,nj->ni", self.__relative[nodes[turned]], local[turned])
+        origins = np.take(self.__origins, nodes, axis=1)
+        distances = np.full(len(rays), np.inf)
+        types = self.__types[nodes] if len(self.__shapes) > 1 else None
+        for index, (tag, shape) in enumerate(self.__shapes):
+            of_type = slice(None) if types is None else types == index
+            matrix = self.__shape_frames[index][1]
+            distances[of_type] = _hitShape(tag, shape, origins[:, of_type], matrix.T.dot(local[of_type].T))
+        hit = np.isfinite(distances)
+        rays, nodes, distances = rays[hit], nodes[hit], distances[hit]
+        if not len(rays):
+            return result
+        # the nearest hit of each ray first, sorting one key being much faster than lexsort
+        order = np.argsort(rays + distances / (2. * distances.max() + 1.))
+        first = order[np.concatenate(([True], rays[order][1:] != rays[order][:-1]))]
+        result[rays[first]] = self.pixels.ids[nodes[first]]
+        return result
+
+
+class OrientedBoxes(object):
+    """
+    Boxes with the names of what they are around, their ``centres``, the
+    ``axes`` (N x 3 x 3, the columns are the directions of the sides of
+    each box) and ``halves`` of the lengths of the sides (N x 3).
+    """
+
+    def __init__(self, names, centres, axes, halves):
+        self.names = np.asarray(names)
+        self.centres = centres
+        self.axes = axes
+        self.halves = halves
+
+    def __len__(self):
+        return len(self.names)
+
+    def extents(self):
+        """
+        Half the sides of the boxes around the boxes along x, y and z.
+        """
+        return np.einsum("nij,nj->ni", np.abs(self.axes), self.halves)
+
+
+def _componentFrames(pixels, centres, matrices, sizes, depth=1):
+    """
+    Group the pixels (from _pixelBoxes) by the component depth levels
+    above them. Returns the names of the components, the index of the
+    first pixel of each, the frames of those pixels (the columns are the
+    axes), the corners of the boxes around the components in them and the
+    corners of the boxes around each pixel in the frame of its component,
+    all relative to the centre of the first pixel.
+    """
+    names = pixels.paths
+    for _ in range(depth):
+        names = np.array([path.rpartition("/")[0] for path in names])
+    starts = np.flatnonzero(np.concatenate(([True], names[1:] != names[:-1])))
+    group = np.cumsum(np.concatenate(([False], names[1:] != names[:-1])))
+
+    frames = matrices[starts]
+    relative = np.einsum("nji,njk->nik", frames[group], matrices)
+    local = np.einsum("nji,nj->ni", frames[group], centres - centres[starts][group])
+    extent = np.einsum("nij,nj->ni", np.abs(relative), sizes)
+    low = np.minimum.reduceat(local - extent, starts)
+    high = np.maximum.reduceat(local + extent, starts)
+    return names[starts], starts, frames, low, high, local - extent, local + extent
+
+
+def componentBoxes(model, depth=1):
+    """
+    OrientedBoxes around the pixels of each component depth levels above
+    them: the tubes for 1 and their packs or the rectangular detectors
+    for 2. The boxes are in the frame of the first pixel of the
+    component, which is the frame of a tube or a pack when the pixels
+    aren't turned in it.
+    """
+    pixels, centres, matrices, sizes = _pixelBoxes(model)
+    names, starts, frames, low, high, _, _ = _componentFrames(pixels, centres, matrices, sizes, depth)
+    boxes = centres[starts] + np.einsum("nij,nj->ni", frames, (low + high) / 2.)
+    return OrientedBoxes(names, boxes, frames, (high - low) / 2.)
+
+
+def _treePairs(low, high):
+    """
+    Pairs of boxes (as indices) that overlap along all of the axes, by
+    going down a tree of them (see _levels) together with itself one
+    level at a time, keeping the pairs of children whose boxes overlap.
+    """
+    order = _splitOrder((low + high) / 2.)
+    levels = _levels(low[order], high[order])
+    first = second = np.zeros(1, dtype=np.int64)
+    for level, (low, high) in enumerate(reversed(levels)):
+        if level:  # the children of the pairs above, once each for the pairs of a box with itself
+            same = first == second
+            first, second = (np.concatenate([2 * first, 2 * first, 2 * first + 1, 2 * first + 1]),
+                             np.concatenate([2 * second, 2 * second + 1, 2 * second, 2 * second + 1]))
+            keep = ~np.tile(same, 4) | (first <= second)
+            first, second = first[keep], second[keep]
+        keep = ((low[first] <= high[second]) & (low[second] <= high[first])).all(axis=1)
+        first, second = first[keep], second[keep]
+    keep = first != second
+    return order[first[keep]], order[second[keep]]
+
+
+def _separation(boxes, first, second):
+    """
+    How far pairs of boxes overlap along the axis that separates them the
+    most (negative when they are apart) by the separating axis theorem:
+    the axes of both boxes and the cross products of them.
+    """
+    axes_a, axes_b = boxes.axes[first], boxes.axes[second]
+    halves_a, halves_b = boxes.halves[first], boxes.halves[second]
+    offsets = boxes.centres[second] - boxes.centres[first]
+    candidates = [axes_a[:, :, i] for i in range(3)] + [axes_b[:, :, j] for j in range(3)]
+    candidates += [np.cross(axes_a[:, :, i], axes_b[:, :, j]) for i in range(3) for j in range(3)]
+    depth = np.full(len(first), np.inf)
+    for axis in candidates:
+        length = np.linalg.norm(axis, axis=-1)
+        parallel = length < 1e-9  # cross products of parallel sides test nothing new
+        axis = axis / np.where(parallel, 1., length)[:, np.newaxis]
+        reach = (np.abs(np.einsum("ni,nij->nj", axis, axes_a)) * halves_a).sum(axis=-1) \
+            + (np.abs(np.einsum("ni,nij->nj", axis, axes_b)) * halves_b).sum(axis=-1)
+        overlap = reach - np.abs((axis * offsets).sum(axis=-1))
+        depth = np.where(parallel, depth, np.minimum(depth, overlap))
+    return depth
+
+
+def findOverlaps(boxes, tolerance=0.):
+    """
+    Return (first, second, depth) for the pairs of OrientedBoxes that
+    overlap by more than tolerance, as indices into boxes and the depth
+    along the axis they overlap the least, deepest first.
+    """
+    extents = boxes.extents()
+    first, second = _treePairs(boxes.centres - extents, boxes.centres + extents)
+    depth = _separation(boxes, first, second)
+    keep = depth > tolerance
+    order = np.argsort(-depth[keep], kind="stable")
+    return first[keep][order], second[keep][order], depth[keep][order]
+
+
+def checkOverlaps(model, depth=1, tolerance=1e-5):
+    """
+    Return the pairs of components (tubes for depth 1, see
+    componentBoxes) whose boxes overlap by more than tolerance (metres),
+    which covers lengths rounded to the 5 decimals they are written with.
+    Components placed by log values are all where the logs are missing.
+    """
+    boxes = componentBoxes(model, depth)
+    return ["'{}' and '{}' overlap by {:.6f} m".format(boxes.names[i], boxes.names[j], overlap)
+            for i, j, overlap in zip(*findOverlaps(boxes, tolerance))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the components of an instrument definition that overlap")
+    parser.add_argument("filename", help="instrument definition file")
+    parser.add_argument("-d", "--depth", type=int, default=1,
+                        help="levels above the pixels of the components to check, 1 (tubes) by default")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-5,
+                        help="overlap to ignore in metres, %(default)s by default")
+    args = parser.parse_args()
+    problems = checkOverlaps(InstrumentModel.fromFile(args.filename), args.depth, args.tolerance)
+    for problem in problems:
+        print('WARNING: ' + problem)
+    print('{} overlapping pairs'.format(len(problems)))
@@ -0,0 +1,103 @@
+#!/bin/env python
+from helper import MantidGeom
+from idf_spatial import OrientedBoxes, RayCaster, checkOverlaps, componentBoxes, findOverlaps
+from quaternion import axisAngleMatrix
+import numpy as np
+import unittest
+
+
+def makeGeom():
+    instr = MantidGeom("TEST")
+    instr.addSnsDefaults()
+    instr.addSamplePosition()
+    instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .25)
+    instr.addCuboidPixel("square", (-.01, -.01, 0.), (-.01, .01, 0.), (-.01, -.01, .005), (.01, -.01, 0.))
+    instr.addPixelatedTube("tube", 4, 1.)
+    component = instr.addComponent("tube", idlist="front")
+    instr.addLocation(component, 0., 0., 2.)
+    component = instr.addComponent("tube", idlist="back")
+    instr.addLocation(component, .015, 0., 3.)
+    component = instr.addComponent("square", idlist="square")
+    instr.addLocation(component, 1., 0., 0., rot_y=90.)
+    instr.addDetectorIds("front", [1, 4, 1])
+    instr.addDetectorIds("back", [11, 14, 1])
+    instr.addDetectorIds("square", [20, 20, 1])
+    return instr
+
+
+class TestRayCaster(unittest.TestCase):
+    def testCast(self):
+        caster = RayCaster(makeGeom().model())
+        self.assertEqual(len(caster), 9)
+        directions = [(0., -.25, 2.),  # bottom pixel of the front tube
+                      (0., .1, 2.),
+                      (0., .2, 2.),
+                      (.005, 0., 3.),  # the front tube hides the back one
+                      (.017, 0., 3.),  # just past the front tube
+                      (.03, 0., 2.),  # between the tubes
+                      (1., .005, 0.),
+                      (0., 0., -1.)]
+        expected = [1, 2, 3, 2, 12, -1, 20, -1]
+        self.assertEqual(caster.cast(directions).tolist(), expected)
+        self.assertEqual(caster.cast(directions, chunk_size=3).tolist(), expected)
+        self.assertEqual(caster.cast(np.array(directions) * 5.).tolist(), expected)
+
+    def testOrigin(self):
+        caster = RayCaster(makeGeom().model(), origin=(0., -1., 2.))
+        self.assertEqual(caster.cast([(0., 1., 0.), (0., -1., 0.)]).tolist(), [1, -1])  # into the end of the tube
+
+    def testTurned(self):
+        instr = MantidGeom("TEST")
+        instr.addSamplePosition()
+        instr.addCuboidPixel("plate", (-.01, -.01, 0.), (-.01, .01, 0.), (-.01, -.01, .005), (.01, -.01, 0.))
+        row = instr.makeTypeElement("row")
+        component = instr.addComponent("plate", root=row)
+        instr.addLocation(component, 0., 0., 0., rot_y=90.)  # edge on to the sample
+        instr.addLocation(component, .05, 0., 0.)
+        component = instr.addComponent("row", idlist="row")
+        instr.addLocation(component, 0., 0., 2.)
+        instr.addDetectorIds("row", [1, 2, 1])
+        directions = [(.002, 0., 2.), (.006, 0., 2.), (.056, 0., 2.)]
+        for resolution in (None, 8):
+            caster = RayCaster(instr.model(), resolution=resolution)
+            self.assertEqual(caster.cast(directions).tolist(), [1, -1, 2])
+
+
+class TestOverlaps(unittest.TestCase):
+    def makePacks(self, spacing):
+        instr = MantidGeom("TEST")
+        instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .1)
+        instr.addPixelatedTube("tube", 4, .4)
+        instr.addNPack("pack", 3, .02, .001)
+        component = instr.addComponent("pack", idlist="packs")
+        instr.addLocation(component, 0., 0., 2., name="left")
+        instr.addLocation(component, spacing, 0., 2., name="right")
+        instr.addDetectorIds("packs", [1, 24, 1])
+        return instr
+
+    def testBoxes(self):
+        boxes = componentBoxes(self.makePacks(1.).model())
+        self.assertEqual(boxes.names.tolist(), ["left/tube1", "left/tube2", "left/tube3",
+                                                "right/tube1", "right/tube2", "right/tube3"])
+        self.assertTrue(np.allclose(boxes.centres[0], [-.021, .05, 2.]))  # the pixels start at their positions
+        self.assertTrue(np.allclose(boxes.halves, [.01, .2, .01]))
+        packs = componentBoxes(self.makePacks(1.).model(), depth=2)
+        self.assertTrue(np.allclose(packs.halves, [.031, .2, .01]))
+
+    def testOverlaps(self):
+        self.assertEqual(self.makePacks(.063).checkOverlaps(), [])  # touching
+        self.assertEqual(self.makePacks(.05).checkOverlaps(),
+                         ["'left/tube3' and 'right/tube1' overlap by 0.012000 m"])
+        self.assertEqual(len(checkOverlaps(self.makePacks(.05).model(), depth=2)), 1)
+
+    def testSeparatingAxis(self):
+        axes = np.array([np.eye(3), axisAngleMatrix(45., (0., 0., 1.))])
+        for centre, expected in (((2.2, 0., 0.), [.2142]), ((2.2, 2.2, 0.), [])):  # corners of the boxes overlap
+            boxes = OrientedBoxes(["a", "b"], np.array([(0., 0., 0.), centre]), axes, np.ones((2, 3)))
+            first, second, depth = findOverlaps(boxes)
+            self.assertEqual(sorted(first.tolist() + second.tolist()), [0, 1] * len(expected))
+            self.assertTrue(np.allclose(depth, expected, atol=1e-4))
+
+
+if __name__ == "__main__":
+    unittest.main(module="idf_spatial_test", verbosity=2)
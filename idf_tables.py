@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Write the per-pixel quantities that reductions derive from an instrument
+(L2, two theta, azimuth and solid angle) as .npy files, so that they can
+be opened with ``np.load(filename, mmap_mode="r")`` instead of building
+the instrument again:
+
+    python idf_tables.py VULCAN_Definition.xml
+
+writes VULCAN_tables/ with ids.npy, l2.npy, two_theta.npy, azimuth.npy
+and solid_angle.npy for the detectors (not monitors) in id order, and
+info.json with the format version, L1 and the checksum of the IDF they
+were made from. Angles are in radians.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+from idf_expand import expand, kindPositions
+from idf_model import InstrumentModel
+import quaternion
+
+FORMAT_VERSION = 1
+COLUMNS = ("ids", "l2", "two_theta", "azimuth", "solid_angle")
+AXES = {"x": (1., 0., 0.), "y": (0., 1., 0.), "z": (0., 0., 1.)}
+
+
+def computeTables(model):
+    """
+    Return L1 and a dict of the COLUMNS arrays for the detectors in id order.
+    """
+    pixels = expand(model).detectors()
+    pixels = pixels[np.argsort(pixels.ids, kind="stable")]
+    sources = kindPositions(model, "source")
+    samples = kindPositions(model, "samplepos")
+    sample = samples[0] if len(samples) else np.zeros(3)
+    up = np.array(AXES[model.defaults["pointing_up"]])
+    if len(sources):
+        beam = sample - sources[0]
+        l1 = float(np.linalg.norm(beam))
+        beam /= l1
+    else:
+        l1 = np.nan
+        beam = np.array(AXES[model.defaults["along_beam"]])
+    horizontal = np.cross(up, beam)
+
+    scattered = pixels.positions - sample
+    l2 = np.linalg.norm(scattered, axis=-1)
+    directions = scattered / np.where(l2 > 0., l2, 1.)[:, np.newaxis]
+    two_theta = np.arccos(np.clip(directions.dot(beam), -1., 1.))
+    azimuth = np.arctan2(directions.dot(up), directions.dot(horizontal))
+
+    # area seen from the sample in the frame of each pixel over L2 squared
+    inverse = pixels.rotations * [1., -1., -1., -1.]
+    local = quaternion.rotate(inverse, directions)
+    area = np.full(len(pixels), np.nan)
+    for name in np.unique(pixels.types):
+        select = pixels.types == name
+        area[select] = model.types[name].projectedArea(local[select])
+    solid_angle = area / np.where(l2 > 0., l2 * l2, np.nan)
+
+    return l1, dict(zip(COLUMNS, (pixels.ids, l2, two_theta, azimuth, solid_angle)))
+
+
+def writeTables(filename, directory=None):
+    """
+    Write the tables of an IDF file to the directory, <instrument>_tables
+    next to the file if it isn't given. Returns the directory.
+    """
+    model = InstrumentModel.fromFile(filename)
+    if directory is None:
+        directory = os.path.join(os.path.dirname(filename), model.name + "_tables")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    l1, columns = computeTables(model)
+    for name in COLUMNS:
+        np.save(os.path.join(directory, name + ".npy"), columns[name])
+
+    with open(filename, "rb") as handle:
+        checksum = hashlib.sha256(handle.read()).hexdigest()
+    info = {"format": FORMAT_VERSION,
+            "instrument": model.name,
+            "source": os.path.basename(filename),
+            "sha256": checksum,
+            "l1": l1 if np.isfinite(l1) else None,
+            "pixels": len(columns["ids"]),
+            "columns": list(COLUMNS)}
+    with open(os.path.join(directory, "info.json"), "w") as handle:
+        json.dump(info, handle, indent=2)
+    print('wrote {} pixels to {}'.format(info["pixels"], directory))
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the per-pixel tables of an instrument definition")
+    parser.add_argument("filename", help="instrument definition file")
+    parser.add_argument("-o", "--output", help="directory to write to, <instrument>_tables by default")
+    args = parser.parse_args()
+    writeTables(args.filename, args.output)
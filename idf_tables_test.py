@@ -0,0 +1,56 @@
+#!/bin/env python
+from helper import MantidGeom
+from idf_tables import computeTables, writeTables
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def makeGeom():
+    instr = MantidGeom("TEST")
+    instr.addSnsDefaults()
+    instr.addModerator(-10.)
+    instr.addSamplePosition()
+    instr.addCuboidPixel("square", (-.01, -.01, 0.), (-.01, .01, 0.), (-.01, -.01, .005), (.01, -.01, 0.))
+    instr.addCylinderPixel("pixel", (0., 0., 0.), (0., 1., 0.), .01, .02)
+    component = instr.addComponent("square", idlist="square")
+    instr.addLocation(component, 0., 2., 0., rot_x=90.)  # facing the sample
+    component = instr.addComponent("pixel", idlist="pixel")
+    instr.addLocation(component, -1., 0., 1.)
+    instr.addDetectorIds("pixel", [1, 1, 1])
+    instr.addDetectorIds("square", [2, 2, 1])
+    return instr
+
+
+class TestTables(unittest.TestCase):
+    def testCompute(self):
+        l1, columns = computeTables(makeGeom().model())
+        self.assertAlmostEqual(l1, 10.)
+        self.assertEqual(columns["ids"].tolist(), [1, 2])
+        self.assertTrue(np.allclose(columns["l2"], [np.sqrt(2.), 2.]))
+        self.assertTrue(np.allclose(columns["two_theta"], [np.pi / 4., np.pi / 2.]))
+        self.assertTrue(np.allclose(columns["azimuth"], [np.pi, np.pi / 2.]))
+        self.assertTrue(np.allclose(columns["solid_angle"], [2. * .01 * .02 / 2., .02 * .02 / 4.]))
+
+    def testWrite(self):
+        direc = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(direc, "TEST_Definition.xml")
+            makeGeom().writeGeom(filename)
+            output = writeTables(filename)
+            self.assertEqual(output, os.path.join(direc, "TEST_tables"))
+            with open(os.path.join(output, "info.json")) as handle:
+                info = json.load(handle)
+            self.assertEqual((info["format"], info["pixels"], info["l1"]), (1, 2, 10.))
+            l2 = np.load(os.path.join(output, "l2.npy"), mmap_mode="r")
+            self.assertIsInstance(l2, np.memmap)
+            self.assertAlmostEqual(l2[1], 2.)
+        finally:
+            shutil.rmtree(direc)
+
+
+if __name__ == "__main__":
+    unittest.main(module="idf_tables_test", verbosity=2)
@@ -3,7 +3,7 @@
 # liberally ported from
 # https://flathead.ornl.gov/trac/TranslationService/browser/calibration/geometry/NOM.py
 from helper import INCH_TO_METRE, DEG_TO_RAD, MantidGeom
-from rectangle import Rectangle, Vector
+from rectangle import Rectangle, Vector, VectorArray, fitRectangles
 from lxml import etree as le # python-lxml on rpm based systems
 from math import cos, sin, radians, pi
 import numpy as np
@@ -44,44 +44,84 @@ def getCornersSpecial(banknum):
     corners = [tube0 + 0, tube0 + 58, tube15 + 58, tube15 + 0]
     return corners
 
-def getRectangle(bank_num, positions, corners, tolerance_len=0.006):
-    # TODO for some reason tolerance is bigger than the default
-    try:
-        one = positions[corners[0]]
-        two = positions[corners[1]]
-        three = positions[corners[2]]
-        four = positions[corners[3]]
-        if bank_num in (90,91):
-            if bank_num == 90: # .046875 -> 0.148
-                y_offset = 0.10113
-            elif bank_num == 91: # -.0390625 -> -0.148
-                y_offset = -0.1089375
-            one = Vector(one.x, one.y+y_offset, one.z)
-            two = Vector(two.x, two.y+y_offset, two.z)
-            three = Vector(three.x, three.y+y_offset, three.z)
-            four = Vector(four.x, four.y+y_offset, four.z)
-        return Rectangle(one, two, three, four, tolerance_len=tolerance_len)
-    except RuntimeError as e:
-        print 'bank', bank_num, corners
-        raise e
+# The engineering positions of the short tubes above and below the beam
+# are wrong in y, not noisy: the survey (NOMAD_survey_20180530_group6.csv)
+# puts the edges of banks 90 and 91 nearest the beam at +-0.148, about
+# 0.1 further out than the engineering file, so the whole banks are moved.
+Y_OFFSETS = {90: 0.10113,     # .046875 -> 0.148
+             91: -0.1089375}  # -.0390625 -> -0.148
+
+# Largest rms distance of a bank's pixels from the rectangle fit to them.
+# Fitting the survey corners of group 6 leaves 0.25 to 6.6 mm rms (bank 94
+# is the worst), so real banks pass with some margin. getRectangles prints
+# the largest residual of each group so the margin can be checked.
+TOLERANCE_LEN = 0.01
+
+def getBankPixels(corners):
+    """
+    The ids of all of the pixels of the bank with the corners (from
+    getCorners, possibly reordered) and the fractions of the way across
+    and up the bank of each of them, for fitRectangles.
+    """
+    tube, pixel = np.divmod(np.asarray(corners), 128)
+    tubes, pixels = np.meshgrid(np.arange(tube.min(), tube.max()+1),
+                                np.arange(pixel.min(), pixel.max()+1), indexing='ij')
+    tubes, pixels = tubes.flatten(), pixels.flatten()
+
+    # from the (tube, pixel) offsets from the lower-left corner, with the
+    # lower-right corner at (1, 0) and the upper-left one at (0, 1)
+    edges = np.array([[tube[3]-tube[0], tube[1]-tube[0]],
+                      [pixel[3]-pixel[0], pixel[1]-pixel[0]]], dtype=float)
+    fractions = np.linalg.solve(edges, [tubes-tube[0], pixels-pixel[0]]).T
+    return tubes*128 + pixels, fractions
+
+def getRectangles(bank_nums, positions, corners, tolerance_len=TOLERANCE_LEN):
+    """
+    Fit rectangles to all of the pixels of the banks at once. corners are
+    the corners of each bank as for getRectangle. Returns the RectangleArray
+    and the rms distance of the pixels of each bank from it, raising a
+    RuntimeError for the first bank that can't be fit or whose pixels are
+    further than tolerance_len (rms) from the fit.
+    """
+    banks = [getBankPixels(bank_corners) for bank_corners in corners]
+    size = max(len(ids) for ids, _ in banks)
+    points = np.full((len(banks), size, 3), np.nan)
+    local = np.zeros((len(banks), size, 2))
+    for i, (bank_num, (ids, fractions)) in enumerate(zip(bank_nums, banks)):
+        found = np.isin(ids, positions.ids)
+        points[i, :len(ids)][found] = positions[ids[found]].data
+        points[i, :len(ids), 1] += Y_OFFSETS.get(bank_num, 0.)
+        local[i, :len(ids)] = fractions
+    rects, residuals = fitRectangles(points, local)
+
+    for i, bank_num in enumerate(bank_nums):
+        if not rects.valid[i] or residuals[i] > tolerance_len:
+            print 'bank', bank_num, corners[i]
+            raise RuntimeError(rects.errors[i] or "Pixels are %f from the rectangle fit to them" % residuals[i])
+    worst = np.argmax(residuals)
+    print 'banks %d-%d are at most %.4f (rms, bank %d) from the rectangles fit to them' \
+        % (min(bank_nums), max(bank_nums), residuals[worst], bank_nums[worst])
+    return rects, residuals
+
+def getRectangle(bank_num, positions, corners, tolerance_len=TOLERANCE_LEN):
+    """
+    The Rectangle fit to all of the pixels of one bank (see getRectangles).
+    tolerance_len is the largest rms distance of the pixels from the fit.
+    """
+    rects, _ = getRectangles([bank_num], positions, [corners], tolerance_len)
+    return Rectangle(*rects.points[0])
 
 def readEngineeringPositions(filename):
-    positions = readFile(filename, hasLabels=False)
+    """
+    The positions of the pixels as a VectorArray keyed by id.
+    """
+    tube, pixel, y, x, z = np.loadtxt(filename, usecols=(0, 1, 5, 6, 7), unpack=True)
+    id = tube.astype(int)*128 + pixel.astype(int)
 
-    tube = np.array(map(int, positions[0]))
-    pixel = np.array(map(int, positions[1]))
-    id = tube*128+pixel
-
-    x = -1. * np.array(map(float, positions[6]))
+    x = -1. * x
     x[x == -0.] = 0.
-    y = np.array(map(float, positions[5]))
-    z = np.array(map(float, positions[7]))
-
-    positions = {}
-    for i, x_i,y_i,z_i in zip(id, x,y,z):
-        positions[i] = Vector(x_i, y_i, z_i)
 
-    return positions
+    return VectorArray(np.column_stack((x, y, z)), ids=id)
 
 def readSurveyPositions(filename):
     # label1, label2, z, x, y
@@ -165,72 +205,58 @@ if __name__ == "__main__":
     # group 1 is banks 1-14 (inclusive)
     bank_offset = 0
     group = instr.makeTypeElement('Group1')
-    for i in range(num_banks[0]):
-        bank_num = bank_offset + i + 1
-        bank = "bank%d" % bank_num
-        corners = getCorners(bank_num)
-        rect = getRectangle(bank_num, positions, corners)
-       	det = instr.makeDetectorElement('pack', root=group)
-       	rect.makeLocation(instr, det, bank)
+    bank_nums = [bank_offset + i + 1 for i in range(num_banks[0])]
+    rects, _ = getRectangles(bank_nums, positions, [getCorners(bank_num) for bank_num in bank_nums])
+    for i, bank_num in enumerate(bank_nums):
+        det = instr.makeDetectorElement('pack', root=group)
+        rects.makeLocation(i, instr, det, "bank%d" % bank_num)
 
     # group 2 is banks 15-37 (inclusive)
     bank_offset += num_banks[0]
     group = instr.makeTypeElement('Group2')
-    for i in range(num_banks[1]):
-        bank_num = bank_offset+i+1
-        bank = "bank%d" % bank_num
-        corners = getCorners(bank_num)
-        # appears to be backwards!!!!!!!!!!!!!!!!
-        corners = [corners[1], corners[0], corners[3], corners[2]]
-        rect = getRectangle(bank_num, positions, corners)
-       	det = instr.makeDetectorElement('pack', root=group)
-       	rect.makeLocation(instr, det, bank)
+    bank_nums = [bank_offset + i + 1 for i in range(num_banks[1])]
+    corners = [getCorners(bank_num) for bank_num in bank_nums]
+    # appears to be backwards!!!!!!!!!!!!!!!!
+    corners = [[c[1], c[0], c[3], c[2]] for c in corners]
+    rects, _ = getRectangles(bank_nums, positions, corners)
+    for i, bank_num in enumerate(bank_nums):
+        det = instr.makeDetectorElement('pack', root=group)
+        rects.makeLocation(i, instr, det, "bank%d" % bank_num)
 
     # group 3 is banks 38-51 (inclusive)
     bank_offset += num_banks[1]
     group = instr.makeTypeElement('Group3')
-    for i in range(num_banks[2]):
-        bank_num = bank_offset+i+1
-        bank = "bank%d" % bank_num
-        corners = getCorners(bank_num)
-        rect = getRectangle(bank_num, positions, corners)
-       	det = instr.makeDetectorElement('pack', root=group)
-       	rect.makeLocation(instr, det, bank)
+    bank_nums = [bank_offset + i + 1 for i in range(num_banks[2])]
+    rects, _ = getRectangles(bank_nums, positions, [getCorners(bank_num) for bank_num in bank_nums])
+    for i, bank_num in enumerate(bank_nums):
+        det = instr.makeDetectorElement('pack', root=group)
+        rects.makeLocation(i, instr, det, "bank%d" % bank_num)
 
     # group 4 is banks 52-63 (inclusive)
     bank_offset += num_banks[2]
     group = instr.makeTypeElement('Group4')
-    for i in range(num_banks[3]):
-        bank_num = bank_offset+i+1
-        bank = "bank%d" % bank_num
-        corners = getCorners(bank_num)
-
-        rect = getRectangle(bank_num, positions, corners)
-
-       	det = instr.makeDetectorElement('pack', root=group)
-       	rect.makeLocation(instr, det, bank)
+    bank_nums = [bank_offset + i + 1 for i in range(num_banks[3])]
+    rects, _ = getRectangles(bank_nums, positions, [getCorners(bank_num) for bank_num in bank_nums])
+    for i, bank_num in enumerate(bank_nums):
+        det = instr.makeDetectorElement('pack', root=group)
+        rects.makeLocation(i, instr, det, "bank%d" % bank_num)
 
     # group 5 is banks 64-81 (inclusive) - 72 and 73 are special
     bank_offset += num_banks[3]
     group = instr.makeTypeElement('Group5')
     special = [72, 73]
-    for i in range(num_banks[4]):
-        bank_num = bank_offset+i+1
-        bank = "bank%d" % bank_num
+    bank_nums = [bank_offset + i + 1 for i in range(num_banks[4])]
+    corners = [getCornersSpecial(bank_num) if bank_num in special else getCorners(bank_num)
+               for bank_num in bank_nums]
+    # flipy
+    corners = [[c[2], c[3], c[0], c[1]] for c in corners]
+    rects, _ = getRectangles(bank_nums, positions, corners)
+    for i, bank_num in enumerate(bank_nums):
         if bank_num in special:
-            corners = getCornersSpecial(bank_num)
+            det = instr.makeDetectorElement('packhalfshort', root=group)
         else:
-            corners = getCorners(bank_num)
-
-        # flipy
-        corners = [corners[2], corners[3], corners[0], corners[1]]
-        rect = getRectangle(bank_num, positions, corners)
-
-        if bank_num in special:
-       	    det = instr.makeDetectorElement('packhalfshort', root=group)
-        else:
-       	    det = instr.makeDetectorElement('packhalf', root=group)
-       	rect.makeLocation(instr, det, bank)
+            det = instr.makeDetectorElement('packhalf', root=group)
+        rects.makeLocation(i, instr, det, "bank%d" % bank_num)
 
 
     # group 6 is banks 81-99 (inclusive) - 90 and 91 are special
@@ -242,31 +268,30 @@ if __name__ == "__main__":
     # handles shuffling those around and should be removed for the next run
     # cycle
     shuffled = {94:92, 95:93, 96:94, 92:95, 93:96}
-    for i in range(num_banks[5]):
-        bank_num = bank_offset+i+1
-        bank = "bank%d" % bank_num
+    bank_nums = [bank_offset + i + 1 for i in range(num_banks[5])]
+    corners = []
+    for bank_num in bank_nums:
         if bank_num in special:
-            corners = getCornersSpecial(bank_num)
+            bank_corners = getCornersSpecial(bank_num)
         else:
-            corners = getCorners(shuffled.get(bank_num, bank_num))
+            bank_corners = getCorners(shuffled.get(bank_num, bank_num))
 
         # corners are mixed up
         if bank_num == 91:
             # flipx
-            corners = [corners[3], corners[2], corners[1], corners[0]]
-        elif bank_num == 90:
-            # flipy
-            corners = [corners[2], corners[3], corners[0], corners[1]]
+            bank_corners = [bank_corners[3], bank_corners[2], bank_corners[1], bank_corners[0]]
         else:
-            corners = [corners[2], corners[3], corners[0], corners[1]]
-
-        rect = getRectangle(bank_num, positions, corners)
+            # flipy
+            bank_corners = [bank_corners[2], bank_corners[3], bank_corners[0], bank_corners[1]]
+        corners.append(bank_corners)
 
+    rects, _ = getRectangles(bank_nums, positions, corners)
+    for i, bank_num in enumerate(bank_nums):
         if bank_num in special:
-       	    det = instr.makeDetectorElement('packhalfshort', root=group)
+            det = instr.makeDetectorElement('packhalfshort', root=group)
         else:
-       	    det = instr.makeDetectorElement('packhalf', root=group)
-       	rect.makeLocation(instr, det, bank)
+            det = instr.makeDetectorElement('packhalf', root=group)
+        rects.makeLocation(i, instr, det, "bank%d" % bank_num)
 
     ####################
     # define various "packs" of detectors
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 from helper import INCH_TO_METRE, DEG_TO_RAD, MantidGeom
-from rectangle import Rectangle, Vector, getEuler, makeLocation
+from rectangle import Rectangle, VectorArray, getEuler, makeLocation
 from lxml import etree as le # python-lxml on rpm based systems
 from math import cos, sin, radians, pi
 import numpy as np
@@ -23,14 +23,12 @@ def readPositionsRight(filename):
     del positions['Position']
     del positions['DetectorNum']
 
-    x = np.array(map(float, positions['X']))
-    y = np.array(map(float, positions['Elevation']))
-    z = np.array(map(float, positions['Z'])) - 60.
-    positions['bank'] = np.array(map(int, positions['bank']))
+    x = np.array(positions['X'], dtype=float)
+    y = np.array(positions['Elevation'], dtype=float)
+    z = np.array(positions['Z'], dtype=float) - 60.
+    positions['bank'] = np.array(positions['bank'], dtype=int)
 
-    positions['position'] = []
-    for x_i,y_i,z_i in zip(x,y,z):
-        positions['position'].append(Vector(x_i, y_i, z_i))
+    positions['position'] = VectorArray(np.column_stack((x, y, z)))
 
     del positions['X']
     del positions['Elevation']
@@ -61,12 +59,10 @@ def readPositionsRight(filename):
 
 def readPositionsLeft(filename):
     positions = readFile(filename)
-    x = np.array(map(float, positions['X']))
-    y = np.array(map(float, positions['Elevation']))
-    z = np.array(map(float, positions['Z']))
-    positions['position'] = []
-    for x_i,y_i,z_i in zip(x,y,z):
-        positions['position'].append(Vector(x_i, y_i, z_i))
+    x = np.array(positions['X'], dtype=float)
+    y = np.array(positions['Elevation'], dtype=float)
+    z = np.array(positions['Z'], dtype=float)
+    positions['position'] = VectorArray(np.column_stack((x, y, z)))
 
     del positions['X']
     del positions['Elevation']
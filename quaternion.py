@@ -0,0 +1,184 @@
+"""
+Quaternions for composing the rotations of a location. A quaternion is a
+numpy array ``[w, x, y, z]`` and a rotation is an ``(angle, axis)`` pair
+with the angle in degrees, the same as a ``rot`` element. The functions
+also work on arrays of them, with the quaternion, axis or matrix
+components in the last dimensions, so many rotations are composed
+(``multiply``), applied (``rotate``), inverted (``inverse``) or turned into
+and from matrices (``toMatrix`` and ``fromMatrix``) at once.
+"""
+from __future__ import print_function
+
+import math
+import numpy as np
+
+TOLERANCE = .0001  # same as rectangle.TOLERANCE
+IDENTITY = np.array([1., 0., 0., 0.])
+
+
+def fromAxisAngle(angle, axis):
+    """
+    Quaternion of a rotation by angle degrees around the axis.
+    """
+    axis = np.asarray(axis, dtype=float)
+    half = .5 * np.radians(np.asarray(angle, dtype=float))[..., np.newaxis]
+    vector = np.sin(half) * axis / np.linalg.norm(axis, axis=-1)[..., np.newaxis]
+    scalar = np.broadcast_to(np.cos(half), vector.shape[:-1] + (1,))
+    return np.concatenate((scalar, vector), axis=-1)
+
+
+def multiply(left, right):
+    """
+    Hamilton product, the rotation ``right`` followed by ``left``.
+    """
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(left, dtype=float), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(right, dtype=float), -1, 0)
+    return np.stack([w1*w2 - x1*x2 - y1*y2 - z1*z2,
+                     w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                     w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                     w1*z2 + x1*y2 - y1*x2 + z1*w2], axis=-1)
+
+
+def inverse(quat):
+    """
+    The opposite rotations of unit quaternions.
+    """
+    return np.asarray(quat, dtype=float) * [1., -1., -1., -1.]
+
+
+_AXES = {}
+
+
+def aboutAxis(angle, axis):
+    """
+    Quaternion of a rotation by angle degrees around x, y or z (0, 1 or 2),
+    which are kept for the next time they are asked for since there are
+    few of them in a generator. The elements of multiples of 180 degrees
+    are exact. The result is read-only.
+    """
+    key = (float(angle), int(axis))
+    quat = _AXES.get(key)
+    if quat is None:
+        half = .5 * math.radians(key[0])
+        quat = np.zeros(4)
+        quat[0], quat[key[1] + 1] = math.cos(half), math.sin(half)
+        quat[np.abs(quat) < 1.e-15] = 0.
+        quat.flags.writeable = False
+        if len(_AXES) > 1024:
+            _AXES.clear()
+        _AXES[key] = quat
+    return quat
+
+
+def toAxisAngle(quat):
+    """
+    Convert a quaternion to an (angle, axis) pair with the angle between 0
+    and 180 degrees and a unit axis. The axis is z for no rotation.
+    """
+    quat = np.asarray(quat, dtype=float)
+    quat = quat / np.linalg.norm(quat, axis=-1)[..., np.newaxis]
+    quat = np.where(quat[..., :1] < 0., -quat, quat)  # same rotation
+    sine = np.linalg.norm(quat[..., 1:], axis=-1)
+    angle = np.degrees(2. * np.arctan2(sine, quat[..., 0]))
+    axis = np.where((sine > 0.)[..., np.newaxis],
+                    quat[..., 1:] / np.where(sine > 0., sine, 1.)[..., np.newaxis],
+                    [0., 0., 1.])
+    if angle.ndim == 0:
+        return float(angle), axis
+    return angle, axis
+
+
+def rotate(quat, vectors):
+    """
+    Rotate the vectors by the quaternions.
+    """
+    quat = np.asarray(quat, dtype=float)
+    vectors = np.asarray(vectors, dtype=float)
+    w = quat[..., :1]
+    u = quat[..., 1:]
+    # v + 2w(u x v) + 2u x (u x v) for a unit quaternion
+    cross = np.cross(u, vectors)
+    return vectors + 2. * w * cross + 2. * np.cross(u, cross)
+
+
+def toMatrix(quat):
+    """
+    Rotation matrices of unit quaternions, in the last two dimensions.
+    """
+    w, x, y, z = np.moveaxis(np.asarray(quat, dtype=float), -1, 0)
+    return np.stack([np.stack([1. - 2.*(y*y + z*z), 2.*(x*y - w*z), 2.*(x*z + w*y)], axis=-1),
+                     np.stack([2.*(x*y + w*z), 1. - 2.*(x*x + z*z), 2.*(y*z - w*x)], axis=-1),
+                     np.stack([2.*(x*z - w*y), 2.*(y*z + w*x), 1. - 2.*(x*x + y*y)], axis=-1)], axis=-2)
+
+
+def fromMatrix(matrices):
+    """
+    Unit quaternions (with w >= 0) of rotation matrices. Each is found from
+    its largest element, which comes from the largest of the combinations
+    of the diagonal, so that none lose precision.
+    """
+    m = np.asarray(matrices, dtype=float)
+    shape = m.shape[:-2]
+    m = m.reshape(-1, 3, 3)
+    diagonal = np.stack([m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2],
+                         m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2],
+                         m[:, 1, 1] - m[:, 0, 0] - m[:, 2, 2],
+                         m[:, 2, 2] - m[:, 0, 0] - m[:, 1, 1]], axis=-1)
+    largest = np.argmax(diagonal, axis=-1)
+    # 4 * the products of pairs of elements: wx, wy, wz, xy, xz and yz
+    pairs = [m[:, 2, 1] - m[:, 1, 2], m[:, 0, 2] - m[:, 2, 0], m[:, 1, 0] - m[:, 0, 1],
+             m[:, 0, 1] + m[:, 1, 0], m[:, 0, 2] + m[:, 2, 0], m[:, 1, 2] + m[:, 2, 1]]
+    others = {0: (None, 0, 1, 2), 1: (0, None, 3, 4), 2: (1, 3, None, 5), 3: (2, 4, 5, None)}
+    quat = np.empty((len(m), 4))
+    for element, columns in others.items():
+        rows = np.flatnonzero(largest == element)
+        twice = np.sqrt(1. + diagonal[rows, element])  # 2 * the element
+        for column, pair in enumerate(columns):
+            quat[rows, column] = .5 * twice if pair is None else pairs[pair][rows] / (2. * twice)
+    quat = np.where(quat[:, :1] < 0., -quat, quat)
+    return quat.reshape(shape + (4,))
+
+
+def axisAngleMatrix(angle, axis):
+    """
+    Rotation matrix of a rotation by angle degrees around the axis.
+    """
+    axis = np.asarray(axis, dtype=float)
+    x, y, z = np.moveaxis(axis / np.linalg.norm(axis, axis=-1)[..., np.newaxis], -1, 0)
+    zero = np.zeros_like(x)
+    cross = np.moveaxis(np.array([[zero, -z, y],
+                                  [z, zero, -x],
+                                  [-y, x, zero]]), (0, 1), (-2, -1))
+    angle = np.radians(np.asarray(angle, dtype=float))[..., np.newaxis, np.newaxis]
+    return np.identity(3) + np.sin(angle) * cross + (1. - np.cos(angle)) * np.matmul(cross, cross)
+
+
+def fuseRotationArrays(rotations, tolerance=TOLERANCE):
+    """
+    Array version of fuseRotations. The angles of each (angles, axis) may be
+    arrays and the combined angles are zero where there is no rotation.
+    """
+    quat = IDENTITY
+    nested = np.identity(3)
+    for angle, axis in rotations:
+        quat = multiply(fromAxisAngle(angle, axis), quat)
+        nested = np.matmul(axisAngleMatrix(angle, axis), nested)
+
+    angle, axis = toAxisAngle(quat)
+    difference = np.abs(axisAngleMatrix(angle, axis) - nested).max()
+    if difference > tolerance:
+        raise RuntimeError("Fused rotation differs from the nested rotations by %g" % difference)
+    return np.where(angle < tolerance, 0., angle), axis
+
+
+def fuseRotations(rotations, tolerance=TOLERANCE):
+    """
+    Combine the rotations of nested rot elements, outermost first, into a
+    single (angle, axis). Mantid applies the outermost rotation first.
+    Returns None if the combination is no rotation within the tolerance
+    and raises a RuntimeError if it doesn't match the nested rotations.
+    """
+    angle, axis = fuseRotationArrays(rotations, tolerance)
+    if angle == 0.:
+        return None
+    return float(angle), axis
@@ -0,0 +1,83 @@
+#!/bin/env python
+from quaternion import aboutAxis, axisAngleMatrix, fromAxisAngle, fromMatrix, fuseRotations, inverse, multiply, \
+    rotate, toAxisAngle, toMatrix
+from helper import MantidGeom
+import numpy as np
+import unittest
+
+
+class TestQuaternion(unittest.TestCase):
+    def testAxisAngle(self):
+        quat = fromAxisAngle(90., (0., 2., 0.))
+        self.assertTrue(np.allclose(quat, [np.sqrt(.5), 0., np.sqrt(.5), 0.]))
+        angle, axis = toAxisAngle(-quat)  # same rotation
+        self.assertAlmostEqual(angle, 90.)
+        self.assertTrue(np.allclose(axis, [0., 1., 0.]))
+        self.assertEqual(toAxisAngle([1., 0., 0., 0.])[0], 0.)
+
+    def testMultiply(self):
+        # rotating around x then y maps y onto z onto x
+        quat = multiply(fromAxisAngle(90., (0, 1, 0)), fromAxisAngle(90., (1, 0, 0)))
+        matrix = axisAngleMatrix(*toAxisAngle(quat))
+        self.assertTrue(np.allclose(matrix.dot([0., 1., 0.]), [1., 0., 0.]))
+        self.assertTrue(np.allclose(matrix.dot([1., 0., 0.]), [0., 0., -1.]))
+
+    def testRotate(self):
+        quat = fromAxisAngle([90., 180.], [(0, 0, 1), (1, 0, 0)])
+        self.assertTrue(np.allclose(rotate(quat, [1., 0., 1.]), [[0., 1., 1.], [1., 0., -1.]]))
+
+    def testMatrix(self):
+        angles = [0., 30., 90., 180., 270., 359.]
+        axes = [(1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 2, 3), (-1, 0, 1)]
+        quats = np.array([fromAxisAngle(angle, axis) for angle in angles for axis in axes])
+        matrices = toMatrix(quats)
+        self.assertEqual(matrices.shape, (len(quats), 3, 3))
+        self.assertTrue(np.allclose(matrices, [axisAngleMatrix(angle, axis) for angle in angles for axis in axes]))
+        self.assertTrue(np.allclose(np.einsum("nij,nj->ni", matrices, np.ones((len(quats), 3))),
+                                    rotate(quats, [1., 1., 1.])))
+        # the same rotations, with w >= 0
+        self.assertTrue(np.allclose(fromMatrix(matrices), np.where(quats[:, :1] < 0., -quats, quats)))
+        self.assertTrue(np.allclose(fromMatrix(np.identity(3)), [1., 0., 0., 0.]))
+
+    def testInverse(self):
+        quats = fromAxisAngle([30., 120.], [(1, 2, 3), (0, 1, 0)])
+        self.assertTrue(np.allclose(multiply(quats, inverse(quats)), [1., 0., 0., 0.]))
+        self.assertTrue(np.allclose(rotate(inverse(quats), rotate(quats, [1., 2., 3.])), [1., 2., 3.]))
+
+    def testAboutAxis(self):
+        self.assertTrue(aboutAxis(90., 1) is aboutAxis(90, 1))
+        self.assertEqual(aboutAxis(180., 2).tolist(), [0., 0., 0., 1.])
+        self.assertTrue(np.allclose(aboutAxis(-30., 0), fromAxisAngle(-30., (1, 0, 0))))
+        self.assertRaises(ValueError, aboutAxis(90., 0).__setitem__, 0, 1.)
+
+    def testFuse(self):
+        rotations = [(30., (0, 1, 0)), (-45., (0, 0, 1)), (10., (0, 1, 0))]
+        angle, axis = fuseRotations(rotations)
+        nested = np.identity(3)
+        for rot in rotations:
+            nested = axisAngleMatrix(*rot).dot(nested)
+        self.assertTrue(np.allclose(axisAngleMatrix(angle, axis), nested))
+        self.assertIsNone(fuseRotations([(30., (0, 1, 0)), (-30., (0, 1, 0))]))
+        self.assertIsNone(fuseRotations([]))
+
+
+class TestFusedLocation(unittest.TestCase):
+    def testFused(self):
+        instr = MantidGeom("TEST", fuse_rotations=True)
+        instr.addLocation(instr.root, 0., 0., 1., rot_x=0., rot_y=90.)
+        location = instr.root.find("location")
+        self.assertEqual(len(location), 1)
+        self.assertEqual(location[0].attrib, {"val": "90", "axis-x": "0", "axis-y": "1", "axis-z": "0"})
+
+        instr.addLocation(instr.root, 0., 0., 1., rot_x=0., rot_y=0., rot_z=0.)
+        self.assertEqual(len(instr.root.findall("location")[1]), 0)  # identity is dropped
+
+    def testNested(self):
+        instr = MantidGeom("TEST")
+        innermost = instr.addLocation(instr.root, 0., 0., 1., rot_x=0., rot_y=90.)
+        self.assertEqual(innermost.get("val"), "0")
+        self.assertEqual(innermost.getparent().get("val"), "90")
+
+
+if __name__ == "__main__":
+    unittest.main(module="quaternion_test", verbosity=2)
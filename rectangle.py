@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import math
 import numpy as np
+import quaternion
 try:
     from string import maketrans  # python2
 except ImportError:
@@ -28,7 +29,7 @@ class Vector:
     LENGTH = 3
 
     def __init__(self, *values):
-        self.data = np.array(values, dtype=np.float).flatten()
+        self.data = np.array(values, dtype=float).flatten()
 
         # check the length
         if self.data.size != Vector.LENGTH:
@@ -96,7 +97,7 @@ class Vector:
 
     def __eq__(self, other):
         try:
-            return np.alltrue(self.data == other.data)
+            return np.all(self.data == other.data)
         except AttributeError:
             other = Vector(other)
             return self == other
@@ -131,6 +132,118 @@ UNIT_X = Vector(1.,0.,0.)
 UNIT_Y = Vector(0.,1.,0.)
 UNIT_Z = Vector(0.,0.,1.)
 
+class VectorArray(object):
+    """
+    Many vectors stored together as the rows of an (N,3) array ``data``,
+    rather than a list or dict of Vectors. With ``ids`` (detector ids or
+    labels, one for each vector) indexing is by id as for a dict of
+    Vectors, otherwise it is by position. A slice is always by position.
+    An int gives a Vector, anything else a VectorArray.
+    """
+    __slots__ = ("data", "ids", "_order")
+
+    def __init__(self, data, ids=None):
+        self.data = np.array(data, dtype=float).reshape(-1, Vector.LENGTH)
+        if np.any(np.isnan(self.data)):
+            raise RuntimeError("Encountered NaN")
+        self.ids = None
+        self._order = None
+        if ids is not None:
+            self.ids = np.asarray(ids)
+            if self.ids.shape != (len(self.data),):
+                raise RuntimeError("Expected %d ids, found %d" % (len(self.data), self.ids.size))
+            self._order = np.argsort(self.ids, kind="stable")
+
+    x = property(lambda self: self.data[:, 0])
+    y = property(lambda self: self.data[:, 1])
+    z = property(lambda self: self.data[:, 2])
+    length = property(lambda self: np.sqrt((self.data * self.data).sum(axis=-1)))
+
+    @staticmethod
+    def _rows(other):
+        return other.data if isinstance(other, (Vector, VectorArray)) else np.asarray(other, dtype=float)
+
+    def index(self, ids):
+        """
+        Positions of the vectors with the ids, the first where one is
+        repeated.
+        """
+        if self.ids is None or not len(self.ids):
+            raise KeyError("There are no ids to look up")
+        ids = np.asarray(ids)
+        found = np.searchsorted(self.ids, ids, sorter=self._order)
+        positions = self._order[np.minimum(found, len(self.ids) - 1)]
+        missing = self.ids[positions] != ids
+        if np.any(missing):
+            raise KeyError("Id %s is not in the array" % ids[missing].flatten()[0])
+        return positions
+
+    def cross(self, other):
+        """
+        Calculate the cross products of these with other vectors, or one.
+        """
+        return VectorArray(np.cross(self.data, VectorArray._rows(other)), self.ids)
+
+    def dot(self, other):
+        """
+        Calculate the dot products of these with other vectors, or one.
+        """
+        return (self.data * VectorArray._rows(other)).sum(axis=-1)
+
+    def normalize(self):
+        """
+        Set the unit lengths to one, as Vector.normalize does
+        """
+        data = _normalizeArray(self.data)
+        if np.any(np.isnan(data)):
+            raise RuntimeError("Zero vector of zero length")
+        self.data = data
+        return self
+
+    def __getitem__(self, key):
+        if self.ids is not None and not isinstance(key, slice):
+            key = self.index(key)
+        if np.ndim(key) == 0 and not isinstance(key, slice):
+            return Vector(self.data[key])
+        return VectorArray(self.data[key], None if self.ids is None else self.ids[key])
+
+    def __contains__(self, key):
+        try:
+            self.index(key)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        for row in self.data:
+            yield Vector(row)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __add__(self, other):
+        return VectorArray(self.data + VectorArray._rows(other), self.ids)
+
+    def __sub__(self, other):
+        return VectorArray(self.data - VectorArray._rows(other), self.ids)
+
+    def __truediv__(self, other):
+        return VectorArray(self.data / other, self.ids) # only allow divide by a scalar
+
+    __div__ = __truediv__
+
+    def __mul__(self, other):
+        return VectorArray(self.data * other, self.ids) # only allow multiply by a scalar
+
+    def __rmul__(self, other):
+        return self * other
+
+    def __repr__(self):
+        return "VectorArray(%s)" % self.data.__repr__()
+
 def getAngle(y, x, debug=False, onlyPositive=True):
     """
     Returns the angle in radians using atan2 (y=sin, x=cos)
@@ -220,72 +333,24 @@ def __genRotationDict(rotation):
         result["axis-z"] = axis[2]
     return result
 
-ATOL_ORIENTATION = 1.e-15
-def checkRotation(rotation):
-    '''Determine if the supplied matrix adheres to the rules of a rotation matrix'''
-    # determinant mush be +/- 1
-    determinant = np.abs(np.linalg.det(rotation))
-    if np.abs(determinant) - 1. > 1.e-15:
-        raise RuntimeError('Determinant must be +-1. Found %f' % determinant)
-
-    # rotation matrix is orthogonal (inverse == transpose)
-    inverse = np.linalg.inv(rotation)
-    transpose = np.transpose(rotation)
-    if not np.allclose(inverse, transpose, atol=ATOL_ORIENTATION):
-        raise RuntimeError(str(inverse) + ' != ' + str(transpose))
-
 def generateRotation(axis, angle, radians=True):
+    """
+    The rotation matrix around the axis. Nothing here uses it anymore, it
+    is kept for scripts as a thin wrapper of quaternion.toMatrix with the
+    rounding errors of the axis rotations cleaned up.
+    """
     if not radians:
-        angle = np.radian(angle)
-
-    sqr_a = axis.x*axis.x
-    sqr_b = axis.y*axis.y
-    sqr_c = axis.z*axis.z
-    len2  = sqr_a+sqr_b+sqr_c
-
-    k2    = math.cos(angle)
-    k1    = (1.0-k2)/len2
-    k3    = math.sin(angle)/math.sqrt(len2)
-    k1ab  = k1*axis.x*axis.y
-    k1ac  = k1*axis.x*axis.z
-    k1bc  = k1*axis.y*axis.z
-    k3a   = k3*axis.x
-    k3b   = k3*axis.y
-    k3c   = k3*axis.z
-
-    rotation = np.matrix([[k1*sqr_a+k2, k1ab-k3c, k1ac+k3b],
-                          [k1ab+k3c, k1*sqr_b+k2, k1bc-k3a],
-                          [k1ac-k3b, k1bc+k3a, k1*sqr_c+k2]],
-                         dtype=np.float)
+        angle = np.radians(angle)
+    rotation = np.matrix(quaternion.toMatrix(quaternion.fromAxisAngle(math.degrees(angle), Vector(axis).data)))
     rotation[np.abs(rotation) < 1.e-15] = 0.
-
-    checkRotation(rotation)
     return rotation
 
 def calcEuler(rotation, convention):
-    R=rotation
-    angles = np.zeros(3, dtype=np.float)
-    XYZ=np.array([[1,0,0],[0,1,0],[0,0,1]], dtype=np.float) # identity matrix
-    #decode the convention: code X=0, Y=1, Z=2
-    convention=convention.upper().translate(maketrans("XYZ","012"))
-    first,second,last=int(convention[0]),int(convention[1]),int(convention[2])
-    tb = 1 if (first+second+last==3) else 0
-    par12 = 1 if ((last-second)%3 ==1) else -1
-    par01 = 1 if ((second-first)%3 ==1) else -1
-    s3=(1-tb-tb*par12)*R[(last+tb*par12)%3,(last-par12)%3]
-    c3=(tb-(1-tb)*par12)*R[(last+tb*par12)%3,(last+par12)%3]
-    angles[2]=getAngle(s3,c3)
-    R1R2=np.dot(R, generateRotation(Vector(XYZ[last]),-1.*angles[2]))
-    s1=par01*R1R2[(first-par01)%3,(first+par01)%3]
-    c1=R1R2[second,second]
-    s2=par01*R1R2[first,3-first-second]
-    c2=R1R2[first,first]
-    angles[1]=getAngle(s2,c2)
-    angles[0]=getAngle(s1,c1)
-    #note equivalent solution o1-180,-o2,o3-180 for ABA
-    #note equivalent solution o1-180,180-o2,o3-180 for ABC
-    angles[abs(angles) < 1.e-5] = 0.
-    return angles
+    """
+    The Euler angles in radians of the rotation matrix in the convention,
+    see calcEulerArray.
+    """
+    return calcEulerArray(np.asarray(rotation)[np.newaxis], convention)[0]
 
 #https://en.wikipedia.org/wiki/Euler_angles
 def getYZY(rotation):
@@ -316,15 +381,109 @@ def getZYZ(rotation):
 
     return angles
 
-def makeLocation(instr, det, name, center, rotations, tol_ang=TOLERANCE):
+def _getAngles(y, x):
+    """
+    getAngle for arrays
+    """
+    angles = np.arctan2(y, x)
+    return np.where(angles < 0., angles + 2. * np.pi, angles)
+
+def calcEulerArray(rotations, convention):
     """
-    Make a location appropriate for an instrument component.
+    calcEuler for an (N,3,3) array of rotation matrices, returning an (N,3)
+    array of angles in radians. Rather than multiplying by the rotation of
+    the last angle, only the four elements of the product that are needed
+    are calculated, from the sine and cosine of the angle.
+    """
+    R = np.asarray(rotations, dtype=float).reshape(-1, 3, 3)
+    angles = np.zeros((len(R), 3), dtype=float)
+    convention = convention.upper().translate(maketrans("XYZ", "012"))
+    first, second, last = int(convention[0]), int(convention[1]), int(convention[2])
+    tb = 1 if (first+second+last == 3) else 0
+    par12 = 1 if ((last-second) % 3 == 1) else -1
+    par01 = 1 if ((second-first) % 3 == 1) else -1
+    s3 = (1-tb-tb*par12)*R[:, (last+tb*par12) % 3, (last-par12) % 3]
+    c3 = (tb-(1-tb)*par12)*R[:, (last+tb*par12) % 3, (last+par12) % 3]
+
+    # gimbal lock: the middle rotation lines the first and last axes up and
+    # only their sum is known. s3 and c3 are then rounding, so the last angle
+    # is made 0 or 180 degrees as calcEuler gets from exact zeros.
+    norm = np.hypot(s3, c3)
+    locked = norm < 1.e-12
+    s3 = np.where(locked, np.copysign(0., s3), s3)
+    c3 = np.where(locked, np.copysign(0., c3), c3)
+    angles[:, 2] = _getAngles(s3, c3)
+    norm[locked] = 1.
+    sin3 = s3 / norm
+    cos3 = np.where(locked, np.where(angles[:, 2] == 0., 1., -1.), c3 / norm)
+
+    # elements of R times the rotation by -angles[:, 2] around the last axis
+    after, before = (last + 1) % 3, (last + 2) % 3
+    def R1R2(row, column):
+        if column == after:
+            return R[:, row, after]*cos3 - R[:, row, before]*sin3
+        elif column == before:
+            return R[:, row, after]*sin3 + R[:, row, before]*cos3
+        return R[:, row, column]
+
+    s1 = par01*R1R2((first-par01) % 3, (first+par01) % 3)
+    c1 = R1R2(second, second)
+    s2 = par01*R1R2(first, 3-first-second)
+    c2 = R1R2(first, first)
+    angles[:, 1] = _getAngles(s2, c2)
+    angles[:, 0] = _getAngles(s1, c1)
+    angles[np.abs(angles) < 1.e-5] = 0.
+    return angles
+
+def __foldAngles(angles):
+    """
+    The end of getYZY and getZYZ for (N,3) arrays of angles: everything in
+    the last rotation where the middle one is missing and in [0, 2pi)
+    """
+    missing = angles[:, 1] == 0.
+    angles[missing, 2] += angles[missing, 0]
+    angles[missing, 0] = 0.
+    angles = angles % (2. * np.pi)
+    angles[np.abs(angles) < 1.e-15] = 0.
+    return angles
+
+def getYZYArray(rotations):
+    """
+    getYZY for an (N,3,3) array of rotation matrices
+    """
+    return __foldAngles(calcEulerArray(rotations, 'YZY'))
+
+def getZYZArray(rotations):
+    """
+    getZYZ for an (N,3,3) array of rotation matrices
+    """
+    return __foldAngles(calcEulerArray(rotations, 'ZYZ'))
+
+def getYXZArray(rotations):
+    """
+    The angles around y, x then z for an (N,3,3) array of rotation matrices,
+    the convention of Quat.getEulerAngles("YXZ") in mantid. Where the
+    x-rotation is +/-90 degrees the z-rotation is 0 or 180 degrees (see
+    calcEulerArray).
+    """
+    return calcEulerArray(rotations, 'YXZ')
+
+def makeLocation(instr, det, name, center, rotations, tol_ang=TOLERANCE, fuse=None):
+    """
+    Make a location appropriate for an instrument component. The rotations
+    are fused into a single one if fuse is True, or None and the instrument
+    fuses rotations.
     """
     # set angles to zero if they aren' already
     for i, rot in enumerate(rotations):
         if abs(rot[0]) < 1.e-15:
             rotations[i] = [0., rot[1]]
 
+    if fuse or (fuse is None and instr.fuse_rotations):
+        sub = instr.addLocation(det, x=center[0], y=center[1], z=center[2], name=name)
+        instr.addRotations(sub, rotations, fuse=True, tolerance=tol_ang)
+        return
+
     # location includes first rotation
     sub = instr.addLocation(det,
                             x=center[0], y=center[1], z=center[2],
@@ -342,10 +501,13 @@ class Rectangle:
     TOPRIGHT = 3
     BOTTOMRIGHT = 4
 
-    def __init__(self, p1, p2, p3, p4, tolerance_len=TOLERANCE, tolerance_ang=TOLERANCE):
+    def __init__(self, p1, p2=None, p3=None, p4=None, tolerance_len=TOLERANCE, tolerance_ang=TOLERANCE):
         """
-        The points should be specified as lower-left (p1) in a clockwise order.
+        The points should be specified as lower-left (p1) in a clockwise order,
+        or all four as a VectorArray (or 4x3 array) in p1.
         """
+        if p2 is None:
+            p1, p2, p3, p4 = VectorArray(p1)
         p1 = Vector(p1)
         p2 = Vector(p2)
         p3 = Vector(p3)
@@ -436,7 +598,7 @@ class Rectangle:
 
         # xvec should change most in x direction
         self.__orient = np.array([xvec.data,yvec.data,zvec.data],
-                                 dtype=np.float)
+                                 dtype=float)
 
     def __euler_rotations_zyz(self):
         angles = np.degrees(getZYZ(self.__orient))
@@ -476,11 +638,12 @@ class Rectangle:
     points = property(lambda self: self.__points[:],
                       doc="The four corners originally supplied in the constructor")
 
-    def makeLocation(self, instr, det, name, technique="orientation"):
+    def makeLocation(self, instr, det, name, technique="orientation", fuse=None):
         """
         @param instr The root instrument that does most of the work.
         @param det   The detector component.
         @param name  The name of the bank.
+        @param fuse  Combine the rotations into one, see makeLocation.
         """
         if not HAS_LXML:
             raise RuntimeError("lxml is not loaded")
@@ -502,4 +665,203 @@ class Rectangle:
 
         rotations.reverse() # may need this
 
-        makeLocation(instr, det, name, self.__center, rotations, self._tol_ang)
+        makeLocation(instr, det, name, self.__center, rotations, self._tol_ang, fuse)
+
+def _normalizeArray(vectors):
+    """
+    Vector.normalize for the rows of an (N,3) array, with rows of zero
+    length left as nan
+    """
+    lengths = np.sqrt((vectors * vectors).sum(axis=-1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = vectors / np.where(lengths < TOLERANCE, np.nan, lengths)[:, np.newaxis]
+    result[np.abs(result) < TOLERANCE] = 0.
+
+    # cardinal vectors are set to exactly the unit vector
+    units = np.eye(Vector.LENGTH)
+    for unit in units:
+        cardinal = (np.abs(lengths - 1.) <= TOLERANCE) \
+            & np.isclose(vectors, unit, atol=TOLERANCE).all(axis=-1)
+        result[cardinal] = unit
+    return result
+
+class RectangleArray:
+    """
+    Many Rectangles at once from an (N,4,3) array of their corners (or a
+    VectorArray of 4N of them), each specified as for Rectangle. Rather
+    than raising, the banks that fail the checks are False in ``valid``
+    and the reason is in ``errors``.
+    """
+
+    def __init__(self, corners, tolerance_len=TOLERANCE, tolerance_ang=TOLERANCE):
+        self.__points = np.array(corners, dtype=float).reshape(-1, Rectangle.NPOINTS, Vector.LENGTH)
+        self._tol_len = tolerance_len
+        self._tol_ang = tolerance_ang
+        p1, p2, p3, p4 = [self.__points[:, i] for i in range(Rectangle.NPOINTS)]
+        self.__errors = [""] * len(self.__points)
+
+        self.__fail(np.isnan(self.__points).any(axis=(1, 2)), lambda i: "Encountered NaN")
+
+        # Are they 4 edges of a 2D plane arrange so consecutive
+        # points with wrap are edges
+        d1 = ((p1 - p2)**2).sum(axis=-1)
+        d2 = ((p1 - p3)**2).sum(axis=-1)
+        d3 = ((p1 - p4)**2).sum(axis=-1)
+        self.__fail((d1 > d2) | (d3 > d2), lambda i: "The Points are in the incorrect order" + (
+            " (d3=|p1-p4|=%f > d2=|p1-p3|=%f)" % (d3[i], d2[i]) if d3[i] > d2[i]
+            else " (d1=|p1-p2|=%f > d2=|p1-p3|=%f)" % (d1[i], d2[i])))
+
+        # Parallelogram opposite side from p1 to p4 is parallel and
+        # equal lengths.
+        left = p2 - p1
+        right = p4 - p3
+        left_len = np.sqrt((left**2).sum(axis=-1))
+        right_len = np.sqrt((right**2).sum(axis=-1))
+        self.__fail(np.abs(left_len - right_len) > self._tol_len,
+                    lambda i: "Left and right sides are not equal length: "
+                    + "left=%f != right=%f (diff=%f)"
+                    % (left_len[i], right_len[i], abs(left_len[i]-right_len[i])))
+
+        top = p2 - p3
+        bottom = p4 - p1
+        top_len = np.sqrt((top**2).sum(axis=-1))
+        bottom_len = np.sqrt((bottom**2).sum(axis=-1))
+        self.__fail(np.abs(top_len - bottom_len) > self._tol_len,
+                    lambda i: "Top and bottom sides are not equal length: "
+                    + "top=%f != bottom=%f (diff=%f)"
+                    % (top_len[i], bottom_len[i], abs(top_len[i]-bottom_len[i])))
+
+        # opposite sides should add up to zero length vector
+        total = np.abs(left + right)
+
+        def notCorners(i):
+            axis = np.argmax(total[i] > self._tol_len)  # the first one that is too long
+            return "Points not rectangle corners (num[%s]=%f > %f)" \
+                % ('xyz'[axis], (left + right)[i, axis], self._tol_len)
+
+        self.__fail((total > self._tol_len).any(axis=-1), notCorners)
+
+        # Make sure the points are at right angles. Eliminates collinear
+        # case too
+        dotProd = (left * bottom).sum(axis=-1)
+        self.__fail(np.abs(dotProd) > self._tol_len,
+                    lambda i: " This is not a rectangle (p2-p1)dot(p4-p1) = %f > %f"
+                    % (dotProd[i], self._tol_len))
+
+        self.__center = (p1 + p2 + p3 + p4) / float(Rectangle.NPOINTS)
+        self.__calcOrientation(p1, p2, p3, p4)
+        self.__fail(np.isnan(self.__orient).any(axis=(1, 2)), lambda i: "Zero vector of zero length")
+        self.__widths = bottom_len
+        self.__heights = left_len
+        self.__valid = np.array([not error for error in self.__errors], dtype=bool)
+
+        # output for each: rotation angles in degrees, nan if not valid
+        self.__zyz = np.full((len(self), 3), np.nan)
+        self.__zyz[self.__valid] = np.degrees(getZYZArray(self.__orient[self.__valid]))
+        self.__yzy = np.full((len(self), 3), np.nan)
+        self.__yzy[self.__valid] = -1.*np.degrees(getYZYArray(self.__orient[self.__valid]))
+
+    def __fail(self, mask, message):
+        """
+        Record the error for the banks in the mask that passed the checks
+        so far. message gives the text for the index of a bank.
+        """
+        for i in np.flatnonzero(mask):
+            if not self.__errors[i]:
+                self.__errors[i] = message(i)
+
+    def __calcOrientation(self, p1, p2, p3, p4):
+        """
+        Calculates the orientation matrices for these points.
+        """
+        # calculate the direction vectors
+        xvec = .5*(p4 + p3) - self.__center
+        yvec = -.5*(p1 + p4) + self.__center
+
+        # normalize the vectors
+        zvec = np.cross(xvec, yvec)
+        self.__orient = np.stack([_normalizeArray(xvec), _normalizeArray(yvec), _normalizeArray(zvec)],
+                                 axis=1)
+
+    def __len__(self):
+        return len(self.__points)
+
+    valid = property(lambda self: self.__valid.copy(), doc="Whether each bank passed the checks")
+    errors = property(lambda self: self.__errors[:], doc="Why each bank failed the checks, empty if it didn't")
+    width = property(lambda self: self.__widths.copy(), doc="Widths of the rectangles")
+    height = property(lambda self: self.__heights.copy(), doc="Heights of the rectangles")
+    center = property(lambda self: self.__center.copy(), doc="Centers of the rectangles (N,3)")
+    orientation = property(lambda self: self.__orient.copy(),
+                           doc="Orientations as sets of three basis vectors (N,3,3)")
+    euler_rot = property(lambda self: self.__zyz.copy(),
+                         doc="Angles of Rectangle.euler_rot in degrees (N,3), nan if not valid")
+    euler_rot_yzy = property(lambda self: self.__yzy.copy(),
+                             doc="Angles of Rectangle.euler_rot_yzy in degrees (N,3), nan if not valid")
+    points = property(lambda self: self.__points.copy(),
+                      doc="The corners originally supplied in the constructor (N,4,3)")
+
+    def makeLocation(self, index, instr, det, name, fuse=None):
+        """
+        Rectangle.makeLocation with the "orientation" technique for one of
+        the banks.
+        @param index The index of the bank.
+        """
+        if not HAS_LXML:
+            raise RuntimeError("lxml is not loaded")
+        if not self.__valid[index]:
+            raise RuntimeError(self.__errors[index])
+
+        angles = self.__yzy[index]
+        rotations = [[angles[0], (0., 1., 0.)],
+                     [angles[1], (0., 0., 1.)],
+                     [angles[2], (0., 1., 0.)]]
+        rotations.reverse() # may need this
+
+        makeLocation(instr, det, name, self.__center[index], rotations, self._tol_ang, fuse)
+
+def fitRectangles(points, local, tolerance_len=TOLERANCE, tolerance_ang=TOLERANCE):
+    """
+    Least squares fit of rectangles to all of the pixels of many banks at
+    once, rather than to the four corner pixels. points (N,P,3) are the
+    positions of the pixels of each bank, with nan for the ones that are
+    missing, and local (P,2) or (N,P,2) the fractions of the way across
+    (p1 to p4 in Rectangle) and up (p1 to p2) the bank for each of them.
+    The edge vectors from a linear fit are replaced by the closest
+    orthonormal pair (the Procrustes solution from their SVD) and the
+    width and height fit along them. Returns the RectangleArray of the
+    corners of the fits and the rms distances (N,) of the pixels from them.
+    """
+    points = np.asarray(points, dtype=float)
+    local = np.broadcast_to(np.asarray(local, dtype=float), points.shape[:2] + (2,))
+    weights = (~np.isnan(points).any(axis=-1)).astype(float)
+    counts = weights.sum(axis=1)
+    points = np.where(weights[..., np.newaxis] > 0., points, 0.)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        center = (weights[..., np.newaxis] * points).sum(axis=1) / counts[:, np.newaxis]
+        middle = (weights[..., np.newaxis] * local).sum(axis=1) / counts[:, np.newaxis]
+        offsets = (points - center[:, np.newaxis]) * weights[..., np.newaxis]
+        steps = (local - middle[:, np.newaxis]) * weights[..., np.newaxis]
+
+        # linear fit of the offsets to the steps, then the nearest orthonormal edges
+        moments = np.einsum("npi,npj->nij", steps, steps)
+        adjugate = np.stack([np.stack([moments[:, 1, 1], -moments[:, 0, 1]], axis=-1),
+                             np.stack([-moments[:, 1, 0], moments[:, 0, 0]], axis=-1)], axis=1)
+        determinant = np.linalg.det(moments)
+        determinant[determinant <= 1.e-12 * np.trace(moments, axis1=1, axis2=2)**2] = np.nan  # in a line
+        edges = np.matmul(np.einsum("npi,npj->nij", offsets, steps), adjugate) \
+            / determinant[:, np.newaxis, np.newaxis]
+        usable = np.isfinite(edges).all(axis=(1, 2))
+        axes = np.full(edges.shape, np.nan)
+        if usable.any():
+            u, _, vt = np.linalg.svd(edges[usable], full_matrices=False)
+            axes[usable] = np.matmul(u, vt)
+
+        # the width and height along them
+        sizes = np.einsum("npi,nij,npj->nj", offsets, axes, steps) / np.einsum("npj,npj->nj", steps, steps)
+        fitted = np.einsum("nij,npj->npi", axes, sizes[:, np.newaxis] * steps)
+        residuals = np.sqrt(((offsets - fitted)**2).sum(axis=(1, 2)) / counts)
+
+    corners = np.array([[0., 0.], [0., 1.], [1., 1.], [1., 0.]])
+    corners = center[:, np.newaxis] + np.einsum("nij,nkj->nki", axes,
+                                                sizes[:, np.newaxis] * (corners - middle[:, np.newaxis]))
+    return RectangleArray(corners, tolerance_len, tolerance_ang), residuals
@@ -1,7 +1,7 @@
 #!/bin/env python
-from rectangle import Rectangle, calcEuler, checkRotation, generateRotation, \
-    getAngle, getYZY, getZYZ
-from rectangle import Vector, UNIT_X, UNIT_Y, UNIT_Z
+from rectangle import Rectangle, RectangleArray, calcEuler, calcEulerArray, fitRectangles, \
+    generateRotation, getAngle, getYXZArray, getYZY, getYZYArray, getZYZ, getZYZArray
+from rectangle import Vector, VectorArray, UNIT_X, UNIT_Y, UNIT_Z
 import math
 import numpy as np
 import unittest
@@ -63,6 +63,58 @@ class TestRectangle(unittest.TestCase):
         #                             (0.0, 0.0, -1.0)))
         #self.checkRotation(rect, 90., 180., 0.)
 
+class TestRectangleArray(unittest.TestCase):
+    CORNERS = [((0,0,0), (1,0,0), (1,1,0), (0,1,0)),
+               ((0,1,0), (1,1,0), (1,0,0), (0,0,0)),
+               ((1,1,0), (0,1,0), (0,0,0), (1,0,0)),
+               ((0,0,0), (0,1,0), (1,1,0), (1,0,0)),
+               ((0,0,0), (0,2,0), (1,1,0), (1,0,0)),  # not a rectangle
+               ((0,0,1), (0,2,1), (2,2,3), (2,0,3)),
+               ((0,0,-.01), (0,1,.01), (1,1,-.01), (1,0,.01))]  # twisted
+
+    def testMatchesRectangle(self):
+        rects = RectangleArray(self.CORNERS)
+        self.assertEqual(len(rects), 7)
+        self.assertEqual(rects.valid.tolist(), [True, True, True, True, False, True, False])
+        self.assertEqual(rects.errors[6], "Points not rectangle corners (num[z]=0.040000 > 0.000100)")
+        for i, corners in enumerate(self.CORNERS):
+            try:
+                rect = Rectangle(*corners)
+            except RuntimeError as e:
+                self.assertEqual(rects.errors[i], str(e))
+                self.assertTrue(np.isnan(rects.euler_rot[i]).all())
+                continue
+            self.assertEqual(rects.errors[i], "")
+            assertAllClose(rects.center[i], rect.center.data, 0.)
+            assertAllClose(rects.orientation[i], rect.orientation, 1.e-15)
+            assertAllClose(rects.euler_rot[i], [item[0] for item in rect.euler_rot], 1.e-9)
+            assertAllClose(rects.euler_rot_yzy[i], [item[0] for item in rect.euler_rot_yzy], 1.e-9)
+            self.assertAlmostEqual(rects.width[i], rect.width)
+            self.assertAlmostEqual(rects.height[i], rect.height)
+
+class TestFitRectangles(unittest.TestCase):
+    def testFit(self):
+        # 4 tubes of 16 pixels, turned and moved
+        tubes, pixels = np.meshgrid(np.arange(4.), np.arange(16.), indexing='ij')
+        local = np.column_stack((tubes.flatten() / 3., pixels.flatten() / 15.))
+        rotation = generateRotation(UNIT_X + UNIT_Y, np.radians(30.))
+        flat = np.column_stack((.3 * local[:, 0], .9 * local[:, 1], np.zeros(len(local))))
+        points = np.asarray(flat.dot(np.asarray(rotation).T)) + (1., 2., 3.)
+        noisy = points + .001 * np.sin(np.arange(points.size)).reshape(points.shape)
+        missing = points.copy()
+        missing[5] = np.nan
+        rects, residuals = fitRectangles([points, noisy, missing, np.full(points.shape, np.nan)], local)
+        self.assertEqual(rects.valid.tolist(), [True, True, True, False])
+        assertAllClose(residuals[[0, 2]], 0., 1.e-12)
+        self.assertTrue(0. < residuals[1] < .002)
+
+        expected = Rectangle(*points[[0, 15, 63, 48]])
+        for i in range(3):
+            atol = .001 if i == 1 else 1.e-12
+            assertAllClose(rects.center[i], expected.center.data, atol)
+            assertAllClose(rects.orientation[i], expected.orientation, atol)
+            assertAllClose([rects.width[i], rects.height[i]], [.3, .9], atol)
+
 class TestGetAngle(unittest.TestCase):
     def check(self, y, x, angle):
         self.assertEqual(math.degrees(getAngle(y,x)), angle)
@@ -73,16 +125,10 @@ class TestGetAngle(unittest.TestCase):
         self.check(0., -1., 180.)
         self.check(-1., 0., 270.)
 
-IDENTITY = np.array([[1,0,0],[0,1,0],[0,0,1]], dtype=np.float)
+IDENTITY = np.array([[1,0,0],[0,1,0],[0,0,1]], dtype=float)
 ATOL_ROTATION = 1.e-15
 
 class TestOrientation(unittest.TestCase):
-    def checkOrientation(self, rotation):
-        try:
-            checkRotation(rotation)
-        except RuntimeError, e:
-            raise AssertionError(e)
-
     def checkRotation(self, axis, angle, exp):
         obs = generateRotation(axis, angle)
         assertAllClose(obs,exp, atol=ATOL_ROTATION)
@@ -96,7 +142,7 @@ class TestOrientation(unittest.TestCase):
         assertAllClose(np.degrees(getZYZ(IDENTITY)), [0., 0., 0.], 0.)
 
     def testRotationX(self):
-        exp = np.array([[1,0,0],[0,0,-1],[0,1,0]], dtype=np.float)
+        exp = np.array([[1,0,0],[0,0,-1],[0,1,0]], dtype=float)
         obs = self.checkRotation(UNIT_X, .5*np.pi, exp)
         assertAllClose(np.degrees(getYZY(obs)), np.degrees(calcEuler(obs, 'YZY')), 0.)
         assertAllClose(np.degrees(getYZY(obs)), [90., 90., 270.], 0.) # TODO verify
@@ -104,27 +150,89 @@ class TestOrientation(unittest.TestCase):
         assertAllClose(np.degrees(getZYZ(obs)), np.degrees(calcEuler(obs, 'ZYZ')), 0.)
         assertAllClose(np.degrees(getZYZ(obs)), [270., 90., 90.], 0.) # TODO verify
 
-        exp = np.array([[1,0,0],[0,-1,0],[0,0,-1]], dtype=np.float)
+        exp = np.array([[1,0,0],[0,-1,0],[0,0,-1]], dtype=float)
         obs = self.checkRotation(UNIT_X, np.pi, exp)
         assertAllClose(np.degrees(getYZY(obs)), [180., 180., 0.], 0.) # TODO verify
         assertAllClose(np.degrees(getZYZ(obs)), [0., 180., 180.], 0.) # TODO verify
 
+    def testArrays(self):
+        rotations = [generateRotation(axis, angle) for axis in (UNIT_X, UNIT_Y, UNIT_Z, UNIT_X + UNIT_Z)
+                     for angle in np.radians([0., 30., 90., 180., 270.])]
+        for convention in ('YZY', 'ZYZ', 'YXZ', 'XYZ', 'ZXY'):
+            assertAllClose(calcEulerArray(np.array(rotations), convention),
+                           [calcEuler(rotation, convention) for rotation in rotations], 1.e-12)
+        assertAllClose(getYZYArray(np.array(rotations)), [getYZY(rotation) for rotation in rotations], 1.e-12)
+        assertAllClose(getZYZArray(np.array(rotations)), [getZYZ(rotation) for rotation in rotations], 1.e-12)
+        assertAllClose(getYXZArray(np.array(rotations)),
+                       [calcEuler(rotation, 'YXZ') for rotation in rotations], 1.e-12)
+
+    def testGimbalLock(self):
+        # x-rotation of 90 degrees for YXZ, no y-rotation for ZYZ, and just off them
+        for convention, middle in (('YXZ', .5*np.pi), ('ZYZ', 0.)):
+            axes = [{'X': UNIT_X, 'Y': UNIT_Y, 'Z': UNIT_Z}[name] for name in convention]
+            rotations = [generateRotation(axes[0], np.radians(a)).dot(generateRotation(axes[1], middle + step))
+                         .dot(generateRotation(axes[2], np.radians(c)))
+                         for a, c in ((40., 25.), (10., 55.)) for step in (0., 1.e-14)]
+            angles = calcEulerArray(np.array(rotations), convention)
+            assertAllClose(np.sin(angles[:, 2]), 0., 1.e-12)
+            for rotation, (a, b, c) in zip(rotations, angles):
+                remade = generateRotation(axes[0], a).dot(generateRotation(axes[1], b)) \
+                    .dot(generateRotation(axes[2], c))
+                assertAllClose(remade, rotation, 1.e-9)
+
     def testRotationY(self):
-        exp = np.array([[0,0,1],[0,1,0],[-1,0,0]], dtype=np.float)
+        exp = np.array([[0,0,1],[0,1,0],[-1,0,0]], dtype=float)
         obs = self.checkRotation(UNIT_Y, .5*np.pi, exp)
 
-        exp = np.array([[-1,0,0],[0,1,0],[0,0,-1]], dtype=np.float)
+        exp = np.array([[-1,0,0],[0,1,0],[0,0,-1]], dtype=float)
         obs = self.checkRotation(UNIT_Y, np.pi, exp)
 
     def testRotationZ(self):
-        exp = np.array([[0,-1,0],[1,0,0],[0,0,1]], dtype=np.float)
+        exp = np.array([[0,-1,0],[1,0,0],[0,0,1]], dtype=float)
         obs = self.checkRotation(UNIT_Z, .5*np.pi, exp)
 
-        exp = np.array([[-1,0,0],[0,-1,0],[0,0,1]], dtype=np.float)
+        exp = np.array([[-1,0,0],[0,-1,0],[0,0,1]], dtype=float)
         obs = self.checkRotation(UNIT_Z, np.pi, exp)
 
         # https://en.wikipedia.org/wiki/Rotation_matrix
 
+class TestVectorArray(unittest.TestCase):
+    def testMath(self):
+        vectors = VectorArray([[1., 0., 0.], [3., 4., 0.]])
+        assertAllClose(vectors.length, [1., 5.], 0.)
+        assertAllClose(vectors.dot(UNIT_Y), [0., 4.], 0.)
+        assertAllClose(vectors.dot(vectors), [1., 25.], 0.)
+        assertAllClose(vectors.cross(UNIT_Z).data, [[0., -1., 0.], [4., -3., 0.]], 0.)
+        assertAllClose((2. * vectors - vectors).data, vectors.data, 0.)
+        vectors.normalize()
+        assertAllClose(vectors.data, [[1., 0., 0.], [.6, .8, 0.]], 1.e-12)
+        self.assertTrue(vectors[0] == UNIT_X)
+        self.assertRaises(RuntimeError, VectorArray([0., 0., 0.]).normalize)
+        self.assertRaises(RuntimeError, VectorArray, [np.nan, 0., 0.])
+
+    def testIds(self):
+        vectors = VectorArray(np.arange(12.).reshape(4, 3), ids=[7, 3, 5, 3])
+        self.assertTrue(isinstance(vectors[5], Vector))
+        assertAllClose(vectors[5].data, [6., 7., 8.], 0.)
+        assertAllClose(vectors[3].data, [3., 4., 5.], 0.)  # the first of repeated ids
+        selected = vectors[[5, 7]]
+        self.assertEqual(selected.ids.tolist(), [5, 7])
+        assertAllClose(selected.data, [[6., 7., 8.], [0., 1., 2.]], 0.)
+        self.assertTrue(7 in vectors)
+        self.assertFalse(4 in vectors)
+        self.assertRaises(KeyError, vectors.__getitem__, 4)
+        self.assertEqual(len(VectorArray(np.zeros((4, 3)))[1:3]), 2)
+        self.assertEqual(vectors[1:3].ids.tolist(), [3, 5])  # slices are by position
+        assertAllClose(vectors[::-2].data, [[9., 10., 11.], [3., 4., 5.]], 0.)
+
+    def testRectangle(self):
+        corners = VectorArray([[0., 0., 0.], [0., 1., 0.], [2., 1., 0.], [2., 0., 0.]], ids=["a", "b", "c", "d"])
+        rect = Rectangle(corners)
+        self.assertAlmostEqual(rect.width, 2.)
+        self.assertAlmostEqual(rect.height, 1.)
+        assertAllClose(Rectangle(*corners[["a", "b", "c", "d"]]).center.data, rect.center.data, 0.)
+        assertAllClose(RectangleArray(corners).center, [rect.center.data], 0.)
+
 class TestVector(unittest.TestCase):
     def testCross(self):
         self.assertEqual(UNIT_X.cross(UNIT_Y), UNIT_Z)
@@ -132,7 +240,7 @@ class TestVector(unittest.TestCase):
         self.assertEqual(UNIT_Z.cross(UNIT_X), UNIT_Y)
 
         self.assertEqual(UNIT_X.cross((0,1,0)), UNIT_Z)
-        self.assertEqual(UNIT_X.cross(np.array((0,1,0), dtype=np.float)), UNIT_Z)
+        self.assertEqual(UNIT_X.cross(np.array((0,1,0), dtype=float)), UNIT_Z)
 
 
     def testDot(self):
@@ -144,7 +252,7 @@ class TestVector(unittest.TestCase):
         self.assertEqual(UNIT_Z.dot(UNIT_Z), 1.)
 
         self.assertEqual(UNIT_X.dot((1,0,0)), 1.)
-        self.assertEqual(UNIT_X.dot(np.array((1,0,0), dtype=np.float)), 1.)
+        self.assertEqual(UNIT_X.dot(np.array((1,0,0), dtype=float)), 1.)
 
     def testVector(self):
         temp = Vector(100., 200., 300.)
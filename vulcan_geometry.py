@@ -2,7 +2,7 @@
 from helper import INCH_TO_METRE, MantidGeom
 from lxml import etree as le  # python-lxml on rpm based systems
 import numpy as np
-from rectangle import Rectangle, Vector, makeLocation
+from rectangle import Rectangle, VectorArray, makeLocation
 from sns_ncolumn import readFile
 
 L1: float = -43.754  # meter
@@ -50,18 +50,15 @@ def readPositions(filename: str = CSV_FILE):
             banks_allpixels[bank_label]['Y'].append(positions['Y'][i])
             banks_allpixels[bank_label]['Z'].append(positions['Z'][i])
 
-    # convert the positions to ndarray of float
+    # convert the positions to arrays keyed by the point labels
     for bank_label in banks_allpixels.keys():
-        for column in ['X', 'Y', 'Z']:
-            banks_allpixels[bank_label][column] = np.array(banks_allpixels[bank_label][column], dtype=float)
+        pixels = banks_allpixels[bank_label]
+        banks_allpixels[bank_label] = VectorArray(np.column_stack([np.array(pixels[column], dtype=float)
+                                                                   for column in ['X', 'Y', 'Z']]),
+                                                  ids=pixels['Point'])
 
-    def pointFromName(pixels, label: str) -> Vector:
-        index = pixels['Point'].index(label)
-        return Vector(pixels['X'][index], pixels['Y'][index], pixels['Z'][index])
-
-    def rectangleFromName(pixels, corners) -> Rectangle:
-        points = [pointFromName(pixels, name) for name in corners]
-        return Rectangle(*points, tolerance_len=0.035)
+    def rectangleFromName(pixels: VectorArray, corners) -> Rectangle:
+        return Rectangle(pixels[list(corners)], tolerance_len=0.035)
 
     # get the 4 corners into a structure to return
     # corners in the order LL, UL, UR, LR
@@ -157,106 +154,113 @@ if __name__ == "__main__":
     xml_outfile = inst_name+"_Definition.xml"
     authors = ["Peter Peterson"]
 
-    # boiler plate stuff
-    instr = MantidGeom(inst_name,
-                       comment="Created by " + ", ".join(authors),
-                       valid_from="2021-01-01 00:00:01")
-    instr.addComment("DEFAULTS")
-    instr.addSnsDefaults()
-    instr.addComment("SOURCE")
-    instr.addModerator(L1)
-    instr.addComment("SAMPLE")
-    instr.addSamplePosition()
-
-    # monitors
-    instr.addComment("MONITORS")
-    instr.addMonitors(distance=[4.83, 1.50], names=["monitor2", "monitor3"])
-
-    # read in survey/alignment values for where the banks are located
-    bank_positions = readPositions()
-
-    # add empty "bank" components with the correct centers and to hang everything off of
-    addEmptyComponent(instr, type_name='bank1',  # right  (when facing downstream)
-                      rect=bank_positions['bank1'])
-    addEmptyComponent(instr, type_name='bank2',  # left (when facing downstream)
-                      rect=bank_positions['bank2'])
-    # addEmptyComponent(instr, type_name='bank3')
-    # addEmptyComponent(instr, type_name='bank4')
-    addEmptyComponent(instr, type_name='bank5',  # high angle on left where b4 will eventually be
-                      rect=bank_positions['bank5'])
-    # addEmptyComponent(instr, type_name='bank6')
-
-    # #### DETECTORS GO HERE! ######################################
-    # all tubes (all banks) are same diameter with 512 pixels
-    # bank1 is old bank 1-3 - has 20 8packs that are 1m long
-    addBankPosition(instr, bankname='bank1', componentname='eightpack', num_panels=20)
-
-    # bank2 is old bank 4-6 - has 20 8packs that are 1m long
-    addBankPosition(instr, bankname='bank2', componentname='eightpack', num_panels=20)
-
-    # bank3 (not installed) will have 18 8packs at 120deg
-    # addBankPosition(instr, bankname='bank3', componentname='eightpack', num_panels=18,
-    #                x_center=2*np.sin(np.deg2rad(120)), z_center=2*np.cos(np.deg2rad(120)),
-    #                rot_y=180+120., rot_y_bank=-120)
-    # bank4 (not installed) will have 18 8packs at 150deg
-    # addBankPosition(instr, bankname='bank4', componentname='eightpack', num_panels=18,
-    #                x_center=2.*np.sin(np.deg2rad(150.)), z_center=2.*np.cos(np.deg2rad(150.)),
-    #                rot_y=180+150., rot_y_bank=-150)
-    # bank5 is old bank 7 - has 9 8packs that are 0.7m long
-    addBankPosition(instr, bankname='bank5', componentname='eightpackshort', num_panels=9)
-    #      SHOULD    x_center=2.*np.sin(np.deg2rad(-150.)), z_center=2.*np.cos(np.deg2rad(-150.)),
-    #      SHOULD    rot_y=180-150., rot_y_bank=150)
-    # bank6 (not installed) will have 11 8packs at 60deg
-    # addBankPosition(instr, bankname='bank6', componentname='eightpack', num_panels=11,
-    #                x_center=2.*np.sin(np.deg2rad(-60.)), z_center=2.*np.cos(np.deg2rad(-60.)),
-    #                rot_y=180-60., rot_y_bank=60)
-    # bank9 (future plan and not part of the upgrade) at 210/-150deg
-
-    # 8-pack is being called a "eightpack"
-    # single tube
-
-    # 1m x
-    # old geometry had
-    #  <radius val="0.012192"/>
-    #  <height val="0.0093741875"/>
-    # ppt cad diagram has 0.434in in plane
-    #    and 0.323in front plane to back plane
-    #    and from one module to the next is 0.460in
-
-    # build up 8-pack with 1m tubes
-    addEightPack(instr, 'eightpack', 'tube')
-    instr.addComment('most banks are 512 pixels across {}m'.format(TUBE_LENGTH))
-    instr.addPixelatedTube(name='tube', type_name='onepixel', num_pixels=TUBE_PIXELS,
-                           tube_height=TUBE_LENGTH)
-    instr.addCylinderPixel("onepixel", (0.0, 0.0, 0.0), (0.0, 1.0, 0.0),
-                           TUBE_RADIUS, (TUBE_LENGTH/TUBE_PIXELS))
-
-    # build up 8-pack with .7m "short"  tubes
-    addEightPack(instr, 'eightpackshort', 'tubeshort', upsidedown=True)
-    instr.addComment('bank 5 is 512 pixels across {}m'.format(TUBE_LENGTH_SHORT))
-    instr.addPixelatedTube(name='tubeshort', type_name='onepixelshort', num_pixels=TUBE_PIXELS,
-                           tube_height=TUBE_LENGTH_SHORT)
-    instr.addCylinderPixel("onepixelshort", (0.0, 0.0, 0.0), (0.0, 1.0, 0.0),
-                           TUBE_RADIUS, (TUBE_LENGTH_SHORT/TUBE_PIXELS))
-
-    # detector ids
-    instr.addComment("DETECTOR IDs - panel is an 8-pack")
-    addBankIds(instr, 'bank1', bank_offset=0, num_panels=20)
-    addBankIds(instr, 'bank2', bank_offset=PIXELS_PER_BANK, num_panels=20)
-    # addBankIds(instr, 'bank3', bank_offset=2*PIXELS_PER_BANK, num_panels=18)
-    # addBankIds(instr, 'bank4', bank_offset=3*PIXELS_PER_BANK, num_panels=18)
-    addBankIds(instr, 'bank5', bank_offset=4*PIXELS_PER_BANK, num_panels=9)
-    # addBankIds(instr, 'bank6', bank_offset=5*PIXELS_PER_BANK, num_panels=11)
-
-    # shape for monitors
-    instr.addComment(" Shape for Monitors")
-    instr.addComment(" TODO: Update to real shape ")
-    instr.addDummyMonitor(0.01, 0.03)
-
-    # monitor ids
-    instr.addComment("MONITOR IDs")
-    instr.addMonitorIds([-2, -3])
-
-    # write out the file
-    instr.writeGeom(xml_outfile)
-    # instr.showGeom()
+    # boiler plate stuff, streamed to the file as it is built
+    with MantidGeom(inst_name,
+                    comment="Created by " + ", ".join(authors),
+                    valid_from="2021-01-01 00:00:01",
+                    stream=xml_outfile) as instr:
+        instr.addComment("DEFAULTS")
+        instr.addSnsDefaults()
+        instr.addComment("SOURCE")
+        instr.addModerator(L1)
+        instr.addComment("SAMPLE")
+        instr.addSamplePosition()
+
+        # monitors
+        instr.addComment("MONITORS")
+        instr.addMonitors(distance=[4.83, 1.50], names=["monitor2", "monitor3"])
+        instr.flush()
+
+        # read in survey/alignment values for where the banks are located
+        bank_positions = readPositions()
+
+        # add empty "bank" components with the correct centers and to hang everything off of
+        addEmptyComponent(instr, type_name='bank1',  # right  (when facing downstream)
+                          rect=bank_positions['bank1'])
+        addEmptyComponent(instr, type_name='bank2',  # left (when facing downstream)
+                          rect=bank_positions['bank2'])
+        # addEmptyComponent(instr, type_name='bank3')
+        # addEmptyComponent(instr, type_name='bank4')
+        addEmptyComponent(instr, type_name='bank5',  # high angle on left where b4 will eventually be
+                          rect=bank_positions['bank5'])
+        instr.flush()
+        # addEmptyComponent(instr, type_name='bank6')
+
+        # #### DETECTORS GO HERE! ######################################
+        # all tubes (all banks) are same diameter with 512 pixels
+        # bank1 is old bank 1-3 - has 20 8packs that are 1m long
+        addBankPosition(instr, bankname='bank1', componentname='eightpack', num_panels=20)
+
+        # bank2 is old bank 4-6 - has 20 8packs that are 1m long
+        addBankPosition(instr, bankname='bank2', componentname='eightpack', num_panels=20)
+
+        # bank3 (not installed) will have 18 8packs at 120deg
+        # addBankPosition(instr, bankname='bank3', componentname='eightpack', num_panels=18,
+        #                x_center=2*np.sin(np.deg2rad(120)), z_center=2*np.cos(np.deg2rad(120)),
+        #                rot_y=180+120., rot_y_bank=-120)
+        # bank4 (not installed) will have 18 8packs at 150deg
+        # addBankPosition(instr, bankname='bank4', componentname='eightpack', num_panels=18,
+        #                x_center=2.*np.sin(np.deg2rad(150.)), z_center=2.*np.cos(np.deg2rad(150.)),
+        #                rot_y=180+150., rot_y_bank=-150)
+        # bank5 is old bank 7 - has 9 8packs that are 0.7m long
+        addBankPosition(instr, bankname='bank5', componentname='eightpackshort', num_panels=9)
+        instr.flush()
+        #      SHOULD    x_center=2.*np.sin(np.deg2rad(-150.)), z_center=2.*np.cos(np.deg2rad(-150.)),
+        #      SHOULD    rot_y=180-150., rot_y_bank=150)
+        # bank6 (not installed) will have 11 8packs at 60deg
+        # addBankPosition(instr, bankname='bank6', componentname='eightpack', num_panels=11,
+        #                x_center=2.*np.sin(np.deg2rad(-60.)), z_center=2.*np.cos(np.deg2rad(-60.)),
+        #                rot_y=180-60., rot_y_bank=60)
+        # bank9 (future plan and not part of the upgrade) at 210/-150deg
+
+        # 8-pack is being called a "eightpack"
+        # single tube
+
+        # 1m x
+        # old geometry had
+        #  <radius val="0.012192"/>
+        #  <height val="0.0093741875"/>
+        # ppt cad diagram has 0.434in in plane
+        #    and 0.323in front plane to back plane
+        #    and from one module to the next is 0.460in
+
+        # build up 8-pack with 1m tubes
+        addEightPack(instr, 'eightpack', 'tube')
+        instr.addComment('most banks are 512 pixels across {}m'.format(TUBE_LENGTH))
+        instr.addPixelatedTube(name='tube', type_name='onepixel', num_pixels=TUBE_PIXELS,
+                               tube_height=TUBE_LENGTH)
+        instr.addCylinderPixel("onepixel", (0.0, 0.0, 0.0), (0.0, 1.0, 0.0),
+                               TUBE_RADIUS, (TUBE_LENGTH/TUBE_PIXELS))
+        instr.flush()
+
+        # build up 8-pack with .7m "short"  tubes
+        addEightPack(instr, 'eightpackshort', 'tubeshort', upsidedown=True)
+        instr.addComment('bank 5 is 512 pixels across {}m'.format(TUBE_LENGTH_SHORT))
+        instr.addPixelatedTube(name='tubeshort', type_name='onepixelshort', num_pixels=TUBE_PIXELS,
+                               tube_height=TUBE_LENGTH_SHORT)
+        instr.addCylinderPixel("onepixelshort", (0.0, 0.0, 0.0), (0.0, 1.0, 0.0),
+                               TUBE_RADIUS, (TUBE_LENGTH_SHORT/TUBE_PIXELS))
+        instr.flush()
+
+        # detector ids
+        instr.addComment("DETECTOR IDs - panel is an 8-pack")
+        addBankIds(instr, 'bank1', bank_offset=0, num_panels=20)
+        addBankIds(instr, 'bank2', bank_offset=PIXELS_PER_BANK, num_panels=20)
+        # addBankIds(instr, 'bank3', bank_offset=2*PIXELS_PER_BANK, num_panels=18)
+        # addBankIds(instr, 'bank4', bank_offset=3*PIXELS_PER_BANK, num_panels=18)
+        addBankIds(instr, 'bank5', bank_offset=4*PIXELS_PER_BANK, num_panels=9)
+        instr.flush()
+        # addBankIds(instr, 'bank6', bank_offset=5*PIXELS_PER_BANK, num_panels=11)
+
+        # shape for monitors
+        instr.addComment(" Shape for Monitors")
+        instr.addComment(" TODO: Update to real shape ")
+        instr.addDummyMonitor(0.01, 0.03)
+
+        # monitor ids
+        instr.addComment("MONITOR IDs")
+        instr.addMonitorIds([-2, -3])
+
+        # write out the file
+        instr.writeGeom(xml_outfile)
+        # instr.showGeom()
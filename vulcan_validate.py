@@ -1,33 +1,15 @@
-from mantid.simpleapi import LoadEmptyInstrument
+import idf_expand
+from idf_model import InstrumentModel
 import numpy as np
 from vulcan_geometry import readPositions
 
 
-def getTubeIds(compInfo, name):
-    # the component index for the bank as a whole
-    bankID = int(compInfo.indexOfAny(name))
-
-    # the bank is made of 8-packs
-    bank = []
-    eightpacks = compInfo.children(bankID)
-    for eightpack in eightpacks:
-        tubes = compInfo.children(int(eightpack))
-
-        eightpack = [compInfo.children(int(tube)) for tube in tubes]
-        bank.extend(eightpack)
-
-    # convert the result into a 2d array of integer indices
-    return np.asarray(bank, dtype=int)
-
-
-def getPositions(ids, compInfo):
-    x = np.zeros(ids.shape, dtype=float)
-    y = np.zeros(ids.shape, dtype=float)
-    z = np.zeros(ids.shape, dtype=float)
-    for i in range(ids.shape[0]):   # tube
-        for j in range(ids.shape[1]):  # pixel along the tube
-            x[i, j], y[i, j], z[i, j] = compInfo.position(int(ids[i, j]))
-    return x, y, z
+def getPositions(pixels, name):
+    # the bank is made of 8-packs of tubes, return 2d arrays of (tube, pixel along the tube)
+    inbank = np.char.startswith(pixels.paths.astype(str), name + '/')
+    num_tubes = len(np.unique(pixels.parents[inbank]))
+    positions = pixels.positions[inbank].reshape(num_tubes, -1, 3)
+    return positions[..., 0], positions[..., 1], positions[..., 2]
 
 
 def position_to_str(x, y, z):
@@ -35,9 +17,7 @@ def position_to_str(x, y, z):
 
 
 if __name__ == "__main__":
-    vulcan = LoadEmptyInstrument(Filename='VULCAN_Definition.xml', OutputWorkspace='vulcan')
-    compInfo = vulcan.componentInfo()
-    detInfo = vulcan.detectorInfo()
+    pixels = idf_expand.expand(InstrumentModel.fromFile('VULCAN_Definition.xml')).detectors()
 
     banks_exp = readPositions()
     for name in ['bank1', 'bank2', 'bank5']:
@@ -47,8 +27,7 @@ if __name__ == "__main__":
 
     for name in ['bank1', 'bank2', 'bank5']:
         print('=========================', name)
-        bank = getTubeIds(compInfo, name)
-        x, y, z = getPositions(bank, compInfo)
+        x, y, z = getPositions(pixels, name)
 
         # confirm which quadrants things are in - x-axis
         #                        | bank5
@@ -57,12 +36,12 @@ if __name__ == "__main__":
         #                        |
         #                        v     incident beam
         if name in ['bank1']:
-            assert np.alltrue(x < 0.)
+            assert np.all(x < 0.)
         elif name in ['bank2', 'bank5']:
-            assert np.alltrue(x > 0.)
+            assert np.all(x > 0.)
             # confirm which quadrants things are in - z-axis
         if name in ['bank5']:
-            assert np.alltrue(z < 0.)
+            assert np.all(z < 0.)
 
         # confirm that the y-center bank center
         center_exp = banks_exp[name].center
@@ -85,8 +64,8 @@ if __name__ == "__main__":
         distances = np.sqrt(np.square(x[:, 256]) + np.square(z[:, 256]))  # distance of in-plane
         delta = distances[1:] - distances[:-1]  # every other tube is same distance
         if name in ['bank1', 'bank2', 'bank5']:
-            assert np.alltrue(delta[::2] < 0.)
-            assert np.alltrue(delta[1::2] > 0.)
+            assert np.all(delta[::2] < 0.)
+            assert np.all(delta[1::2] > 0.)
 
         # confirm that the positions are increasing in other directions
         np.testing.assert_array_less(y[:, :-1], y[:, 1:], err_msg="everything in same row has increasing y")